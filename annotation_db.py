@@ -0,0 +1,286 @@
+"""
+Dataset-wide annotation database (SQLite, no Qt dependency).
+
+One row per marking with its image, label, type, visibility flags, area,
+bounding box and the points packed as an int32 blob (little-endian X, Y
+pairs, the MarkingStore layout). Markings are indexed by image, by label and by
+type, so label summaries over a whole dataset and "which images contain label
+X" are index scans instead of reading every annotation file. The GUI and
+batch_annotate.py write every image they annotate; exported points JSON files
+can be imported once:
+
+    python annotation_db.py annotations.sqlite import IMAGE_DIR JSON_DIR
+    python annotation_db.py annotations.sqlite summary
+    python annotation_db.py annotations.sqlite find LABEL [--type Contour]
+
+Areas are polygon areas for contours and box areas for bounding boxes.
+Coverage adds the areas of the markings, so overlapping markings are counted
+twice.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+# Custom modules
+import annotation_io
+import image_io
+import marking_store
+
+DB_NAME = "alphaseg_annotations.sqlite"
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    width INTEGER NOT NULL DEFAULT 0,
+    height INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS labels (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS markings (
+    id INTEGER PRIMARY KEY,
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    label_id INTEGER NOT NULL REFERENCES labels(id),
+    type INTEGER NOT NULL,
+    flags INTEGER NOT NULL,
+    num_points INTEGER NOT NULL,
+    area REAL NOT NULL,
+    x_min INTEGER NOT NULL,
+    y_min INTEGER NOT NULL,
+    x_max INTEGER NOT NULL,
+    y_max INTEGER NOT NULL,
+    coords BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS markings_image ON markings(image_id, position);
+CREATE INDEX IF NOT EXISTS markings_label ON markings(label_id, image_id, area);
+CREATE INDEX IF NOT EXISTS markings_type ON markings(type, label_id, image_id);
+"""
+
+
+def default_db_path(folder):
+    return os.path.join(folder, DB_NAME)
+
+
+def marking_geometry(store):
+    # Output: (areas, x_min, y_min, x_max, y_max) of every marking, computed on the packed coordinates
+    num_markings = len(store)
+    areas = np.zeros(num_markings, dtype=np.float64)
+    bounds = np.zeros((4, num_markings), dtype=np.int64)
+    if num_markings == 0:
+        return (areas,) + tuple(bounds)
+    coords = store.coords.astype(np.float64)
+    offsets = store.offsets
+    lengths = np.diff(offsets)
+    filled = np.flatnonzero(lengths > 0)
+    starts = offsets[:-1][filled]
+    # Shoelace formula, the point after the last point of a polygon is its first point
+    following = np.arange(1, len(coords) + 1)
+    following[offsets[1:][filled] - 1] = starts
+    x, y = coords[:, 0], coords[:, 1]
+    areas[filled] = np.abs(np.add.reduceat(x * y[following] - x[following] * y, starts)) / 2
+    # A bounding box is stored as its 2 corners
+    boxes = np.flatnonzero((store.type_codes == marking_store.BOUNDING_BOX) & (lengths == 2))
+    if len(boxes) > 0:
+        corners = coords[offsets[boxes]], coords[offsets[boxes] + 1]
+        areas[boxes] = np.abs((corners[1][:, 0] - corners[0][:, 0]) * (corners[1][:, 1] - corners[0][:, 1]))
+    for row, (reduce, column) in enumerate(((np.minimum, 0), (np.minimum, 1), (np.maximum, 0), (np.maximum, 1))):
+        bounds[row, filled] = reduce.reduceat(store.coords[:, column], starts)
+    return (areas,) + tuple(bounds)
+
+
+class AnnotationDB:
+    def __init__(self, path):
+        # Input: path = database file, created if missing (":memory:" for a temporary database)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        if path != ":memory:":
+            # Readers (e.g. a summary window) do not block the writer
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            self.connection.close()
+            raise ValueError(f"{path} was created by a newer version (schema {version})")
+        with self.connection:
+            self.connection.executescript(_SCHEMA)
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._label_ids = dict(self.connection.execute("SELECT name, id FROM labels"))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    ##########################################################################
+    ## Writing ###############################################################
+    ##########################################################################
+    def label_id(self, name):
+        if name not in self._label_ids:
+            self.connection.execute("INSERT OR IGNORE INTO labels(name) VALUES (?)", (name,))
+            self._label_ids[name] = self.connection.execute("SELECT id FROM labels WHERE name = ?", (name,)).fetchone()[0]
+        return self._label_ids[name]
+
+    def write_image(self, image_path, store, image_size=None):
+        # Replace the markings of an image in one transaction
+        # Input: image_size = (Width, Height), kept when None and the image is already in the database
+        image_path = os.path.abspath(image_path)
+        areas, x_min, y_min, x_max, y_max = marking_geometry(store)
+        offsets = store.offsets
+        packed = np.ascontiguousarray(store.coords, dtype="<i4").tobytes()  # 8 bytes per point
+        try:
+            with self.connection:
+                label_ids = [self.label_id(name) for name in store.label_names]
+                image_id = self._image_id(image_path, image_size)
+                self.connection.execute("DELETE FROM markings WHERE image_id = ?", (image_id,))
+                rows = ((image_id, index, label_ids[label_code], type_code, flags, end - start, area, x0, y0, x1, y1, packed[8 * start:8 * end])
+                        for index, (label_code, type_code, flags, start, end, area, x0, y0, x1, y1)
+                        in enumerate(zip(store.label_codes.tolist(), store.type_codes.tolist(), store.flags.tolist(), offsets[:-1].tolist(),
+                                         offsets[1:].tolist(), areas.tolist(), x_min.tolist(), y_min.tolist(), x_max.tolist(), y_max.tolist())))
+                self.connection.executemany("INSERT INTO markings(image_id, position, label_id, type, flags, num_points, area, x_min, y_min, x_max, y_max, coords) "
+                                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error:
+            self._label_ids = dict(self.connection.execute("SELECT name, id FROM labels"))  # Labels of the rolled back transaction
+            raise
+        return image_id
+
+    def _image_id(self, image_path, image_size):
+        row = self.connection.execute("SELECT id FROM images WHERE path = ?", (image_path,)).fetchone()
+        if row is None:
+            width, height = image_size if image_size is not None else (0, 0)
+            return self.connection.execute("INSERT INTO images(path, width, height, updated) VALUES (?, ?, ?, ?)",
+                                           (image_path, int(width), int(height), time.time())).lastrowid
+        if image_size is not None:
+            self.connection.execute("UPDATE images SET width = ?, height = ?, updated = ? WHERE id = ?", (int(image_size[0]), int(image_size[1]), time.time(), row[0]))
+        else:
+            self.connection.execute("UPDATE images SET updated = ? WHERE id = ?", (time.time(), row[0]))
+        return row[0]
+
+    def remove_image(self, image_path):
+        with self.connection:
+            self.connection.execute("DELETE FROM images WHERE path = ?", (os.path.abspath(image_path),))
+
+    ##########################################################################
+    ## Reading ###############################################################
+    ##########################################################################
+    def image_paths(self):
+        return [path for (path,) in self.connection.execute("SELECT path FROM images ORDER BY path")]
+
+    def read_image(self, image_path):
+        # Output: MarkingStore of the image in its saved order, None if the image is not in the database
+        row = self.connection.execute("SELECT id FROM images WHERE path = ?", (os.path.abspath(image_path),)).fetchone()
+        if row is None:
+            return None
+        rows = self.connection.execute("SELECT labels.name, type, flags, coords FROM markings JOIN labels ON labels.id = markings.label_id "
+                                       "WHERE image_id = ? ORDER BY position", (row[0],)).fetchall()
+        label_names = list(dict.fromkeys(name for name, _, _, _ in rows))
+        codes = {name: code for code, name in enumerate(label_names)}
+        polygons = [np.frombuffer(blob, dtype="<i4").reshape(-1, 2) for _, _, _, blob in rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(polygon) for polygon in polygons])
+        coords = np.concatenate(polygons).astype(np.int32) if polygons else np.zeros((0, 2), dtype=np.int32)
+        return marking_store.MarkingStore.from_arrays(coords, offsets, np.array([row[1] for row in rows], dtype=np.uint8),
+                                                      np.array([codes[row[0]] for row in rows], dtype=np.int32), label_names,
+                                                      np.array([row[2] for row in rows], dtype=np.uint8))
+
+    def label_summary(self, marking_type=None):
+        # Output: [(LABEL, markings, images, total area, coverage), ...] sorted by label
+        # coverage = marked area / area of the images containing the label, None when an image size is unknown
+        type_filter = "WHERE type = ?" if marking_type is not None else ""
+        parameters = (marking_store.MARKING_TYPES.index(marking_type),) if marking_type is not None else ()
+        return self.connection.execute(f"""
+            WITH per_image AS (
+                SELECT label_id, image_id, COUNT(*) AS count, SUM(area) AS area FROM markings {type_filter} GROUP BY label_id, image_id)
+            SELECT labels.name, SUM(per_image.count), COUNT(*), SUM(per_image.area),
+                   CASE WHEN MIN(images.width * images.height) > 0 THEN SUM(per_image.area) / SUM(images.width * images.height) END
+            FROM per_image JOIN labels ON labels.id = per_image.label_id JOIN images ON images.id = per_image.image_id
+            GROUP BY per_image.label_id ORDER BY labels.name""", parameters).fetchall()
+
+    def images_with_label(self, label, marking_type=None):
+        # Output: [(image path, number of markings with the label), ...] sorted by path
+        label_id = self._label_ids.get(label)
+        if label_id is None:
+            return []
+        type_filter = "AND type = ?" if marking_type is not None else ""
+        parameters = (label_id,) + ((marking_store.MARKING_TYPES.index(marking_type),) if marking_type is not None else ())
+        return self.connection.execute(f"""
+            SELECT images.path, counts.count FROM (
+                SELECT image_id, COUNT(*) AS count FROM markings WHERE label_id = ? {type_filter} GROUP BY image_id) AS counts
+            JOIN images ON images.id = counts.image_id ORDER BY images.path""", parameters).fetchall()
+
+    def label_names(self):
+        # Output: names of the labels used by at least one marking
+        return [name for (name,) in self.connection.execute(
+            "SELECT name FROM labels WHERE EXISTS (SELECT 1 FROM markings WHERE markings.label_id = labels.id) ORDER BY name")]
+
+
+##########################################################################
+## Command line ##########################################################
+##########################################################################
+def import_points_json(db, image_dir, json_dir, progress=None):
+    # Import {name}_points.json files exported for the images of a folder
+    # Output: number of imported images
+    # Input: json_dir = output folder of batch_annotate.py, names follow image_io.output_names
+    num_imported = 0
+    image_paths = image_io.list_images(image_dir)
+    names = image_io.output_names(image_paths)
+    for image_path in image_paths:
+        json_path = os.path.join(json_dir, names[image_path] + "_points.json")
+        if not os.path.exists(json_path):
+            continue
+        with Image.open(image_path) as image:
+            image_size = image.size  # Header only
+        db.write_image(image_path, annotation_io.read_points_json(json_path), image_size)
+        num_imported += 1
+        if progress is not None:
+            progress(image_path)
+    return num_imported
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Query or fill an AlphaSEG annotation database.")
+    parser.add_argument("database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_command = commands.add_parser("import", help="Import exported points JSON files")
+    import_command.add_argument("image_dir")
+    import_command.add_argument("json_dir")
+    summary_command = commands.add_parser("summary", help="Markings, images, area and coverage per label")
+    summary_command.add_argument("--type", choices=marking_store.MARKING_TYPES, default=None)
+    find_command = commands.add_parser("find", help="Images containing a label")
+    find_command.add_argument("label")
+    find_command.add_argument("--type", choices=marking_store.MARKING_TYPES, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with AnnotationDB(args.database) as db:
+        if args.command == "import":
+            num_imported = import_points_json(db, args.image_dir, args.json_dir, progress=lambda path: print(f"Imported {path}"))
+            print(f"{num_imported} image(s) imported")
+        elif args.command == "summary":
+            print("Label\tMarkings\tImages\tArea\tCoverage")
+            for label, count, num_images, area, coverage in db.label_summary(args.type):
+                print(f"{label}\t{count}\t{num_images}\t{area:.0f}\t" + (f"{100 * coverage:.2f}%" if coverage is not None else "-"))
+        elif args.command == "find":
+            for path, count in db.images_with_label(args.label, args.type):
+                print(f"{path}\t{count}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Export of markings to annotation files without Qt, shared by ExportOptionWindow
+and the batch scripts. Points are in real scale, orig_dim is (Width, Height).
+
+export_annotations converts the store to arrays once (clamped coordinates,
+bounding boxes, label names) and writes every requested format from them, each
+to its own file:
+
+    contour_points   {name}_points.json           {LABEL: [[[X, Y], ...], ...]} of contours
+    contour_corners  {name}_contour_corners.json  {LABEL: [[[X1, Y1], [X2, Y2]], ...]} of contour boxes
+    box_corners      {name}_box_corners.json      {LABEL: [[[X1, Y1], [X2, Y2]], ...]} of bounding boxes
+    yolo             {name}.txt                   LABEL X_CENTER_NORM Y_CENTER_NORM WIDTH_NORM HEIGHT_NORM
+    yolo_seg         {name}_seg.txt               LABEL X1_NORM Y1_NORM X2_NORM Y2_NORM ... of contours
+    mask             {name}_mask.npz              one bit-packed (or uint8) mask per label, see load_mask
+    instance_map     {name}_instances.npz         uint16 map of contour ids (1..N, 0 is background) and their labels
+    instance_png     {name}_instances.png         the same map as a 16-bit PNG
+    coco_rle         {name}_coco.json             COCO instances with uncompressed RLE segmentation
+    npz              {name}_markings.npz          every marking as arrays, see annotation_io.load_npz
+
+JSON files are written compactly through annotation_io, points one polygon at a time.
+
+Masks are filled polygon by polygon on crops of their bounding boxes, and the
+semantic masks are written to the archive one label at a time, so only one
+uint8 plane of the image is held in memory.
+"""
+
+import os
+import zipfile
+import cv2
+import numpy as np
+
+# Custom modules
+import annotation_io
+import marking_store
+
+FORMAT_FILE_NAMES = {"contour_points": "{name}_points.json",
+                     "contour_corners": "{name}_contour_corners.json",
+                     "box_corners": "{name}_box_corners.json",
+                     "yolo": "{name}.txt",
+                     "yolo_seg": "{name}_seg.txt",
+                     "mask": "{name}_mask.npz",
+                     "instance_map": "{name}_instances.npz",
+                     "instance_png": "{name}_instances.png",
+                     "coco_rle": "{name}_coco.json",
+                     "npz": "{name}_markings.npz"}
+FORMATS = list(FORMAT_FILE_NAMES.keys())
+
+
+class ExportData:
+    # Arrays shared by all formats, computed in one pass over the store
+    def __init__(self, store, orig_dim):
+        self.orig_dim = (int(orig_dim[0]), int(orig_dim[1]))
+        self.offsets = store.offsets.copy()
+        self.type_codes = store.type_codes.copy()
+        self.labels = store.labels()
+        # Valid pixel indices, [0, Width - 1] x [0, Height - 1]
+        self.coords = np.clip(store.coords, 0, [self.orig_dim[0] - 1, self.orig_dim[1] - 1]).astype(np.int32)
+        # Boxes of the unclamped points, as in the previous per-format export
+        self.bounds = store.bounds()
+        self._instance_map = None
+
+    def indices(self, marking_type):
+        return np.flatnonzero(self.type_codes == marking_store.MARKING_TYPES.index(marking_type))
+
+    def points(self, index):
+        return self.coords[self.offsets[index]:self.offsets[index + 1]]
+
+    def contour_labels(self):
+        # Output: ([LABEL, ...] in order of first appearance, {LABEL: [contour index, ...], ...})
+        grouped = group_by_label([self.labels[i] for i in self.indices("Contour")], self.indices("Contour").tolist())
+        return list(grouped.keys()), grouped
+
+    def instance_map(self):
+        # Output: numpy.ndarray(Height, Width) of contour ids 1..N in contour order, later contours on top
+        if self._instance_map is None:
+            indices = self.indices("Contour")
+            dtype = np.uint16 if len(indices) < 65536 else np.uint32
+            self._instance_map = np.zeros((self.orig_dim[1], self.orig_dim[0]), dtype=dtype)
+            for instance_id, i in enumerate(indices, start=1):
+                x_min, y_min, crop = fill_crop(self.points(i))
+                region = self._instance_map[y_min:y_min + crop.shape[0], x_min:x_min + crop.shape[1]]
+                region[crop.view(bool)] = instance_id
+        return self._instance_map
+
+
+def group_by_label(labels, items):
+    # Output: {LABEL: [item, ...], ...} in marking order
+    grouped = {}
+    for label, item in zip(labels, items):
+        grouped.setdefault(label, []).append(item)
+    return grouped
+
+
+def write_lines(path, lines):
+    # Nothing is written without markings
+    if len(lines) == 0:
+        return None
+    with open(path, "w") as text_file:
+        text_file.write("\n".join(lines))
+    return path
+
+
+def points_json(data):
+    # Output: [(LABEL, generator of numpy.ndarray(N, 2)), ...] for annotation_io.write_grouped_json
+    indices = data.indices("Contour")
+    grouped = group_by_label([data.labels[i] for i in indices], indices.tolist())
+    return [(label, (data.points(i) for i in label_indices)) for label, label_indices in grouped.items()]
+
+
+def corners_json(data, marking_type):
+    indices = data.indices(marking_type)
+    if marking_type == "Contour":
+        corners = np.clip(data.bounds[indices], 0, [data.orig_dim[0] - 1, data.orig_dim[1] - 1] * 2).reshape(-1, 2, 2)
+    else:
+        corners = [data.points(i) for i in indices]
+    return group_by_label([data.labels[i] for i in indices], corners).items()
+
+
+def yolo_lines(data, marking_types=marking_store.MARKING_TYPES):
+    # Boxes are ordered corner to corner, whichever direction the box was drawn in
+    indices = np.concatenate([data.indices(marking_type) for marking_type in marking_types] + [np.empty(0, dtype=np.int64)])
+    bounds = data.bounds[indices].astype(np.float64)
+    centers = (bounds[:, 0:2] + bounds[:, 2:4]) / 2 / data.orig_dim
+    sizes = (bounds[:, 2:4] - bounds[:, 0:2]) / data.orig_dim
+    return [f"{data.labels[i]} {x_center} {y_center} {width} {height}"
+            for i, (x_center, y_center), (width, height) in zip(indices.tolist(), centers.tolist(), sizes.tolist())]
+
+
+def yolo_seg_lines(data):
+    indices = data.indices("Contour")
+    normalized = (data.coords / np.array(data.orig_dim, dtype=np.float64)).ravel().tolist()
+    lines = []
+    for i in indices:
+        polygon = normalized[2 * data.offsets[i]:2 * data.offsets[i + 1]]
+        # One formatting operation per line instead of one per value
+        lines.append(f"{data.labels[i]} " + ("%.6f " * len(polygon) % tuple(polygon))[:-1])
+    return lines
+
+
+##########################################################################
+## Masks #################################################################
+##########################################################################
+def fill_crop(points):
+    # Input: numpy.ndarray(N, 2) of int32 [X, Y] inside the image
+    # Output: (X_MIN, Y_MIN, numpy.ndarray(h, w) of uint8) polygon filled on its bounding box only
+    x_min, y_min = points.min(axis=0)
+    x_max, y_max = points.max(axis=0)
+    crop = np.zeros((y_max - y_min + 1, x_max - x_min + 1), dtype=np.uint8)
+    cv2.fillPoly(crop, [points], 1, offset=(-int(x_min), -int(y_min)))
+    return int(x_min), int(y_min), crop
+
+
+def write_npz_array(archive, name, array):
+    # Arrays are compressed into the archive one by one, np.load reads the result as a regular .npz
+    with archive.open(f"{name}.npy", "w", force_zip64=True) as npy_file:
+        np.lib.format.write_array(npy_file, np.asarray(array), allow_pickle=False)
+
+
+def write_semantic_masks(path, data, bit_packed=True):
+    # Archive: labels, shape (Height, Width), mask_0 ... mask_{L-1}
+    # (bit-packed along the rows with numpy.packbits, or uint8 0/1)
+    label_set, grouped = data.contour_labels()
+    plane = np.zeros((data.orig_dim[1], data.orig_dim[0]), dtype=np.uint8)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        write_npz_array(archive, "labels", np.array(label_set, dtype=str))
+        write_npz_array(archive, "shape", np.array(plane.shape))
+        for label_index, label in enumerate(label_set):
+            plane.fill(0)
+            for i in grouped[label]:
+                x_min, y_min, crop = fill_crop(data.points(i))
+                plane[y_min:y_min + crop.shape[0], x_min:x_min + crop.shape[1]] |= crop
+            write_npz_array(archive, f"mask_{label_index}", np.packbits(plane, axis=-1) if bit_packed else plane)
+    return path
+
+
+def load_mask(path):
+    # Output: ([LABEL, ...], numpy.ndarray(Number of labels, Height, Width) of bool) from a "mask" export
+    with np.load(path) as archive:
+        labels = archive["labels"].tolist()
+        height, width = archive["shape"]
+        masks = np.zeros((len(labels), height, width), dtype=bool)
+        for label_index in range(len(labels)):
+            mask = archive[f"mask_{label_index}"]
+            masks[label_index] = np.unpackbits(mask, axis=-1, count=width) if mask.shape[-1] != width else mask
+    return labels, masks
+
+
+def write_instance_map(path, data):
+    labels = [data.labels[i] for i in data.indices("Contour")]
+    np.savez_compressed(path, instances=data.instance_map(), labels=np.array(labels, dtype=str))
+    return path
+
+
+def write_instance_png(path, data):
+    instance_map = data.instance_map()
+    if instance_map.dtype != np.uint16:
+        raise ValueError("PNG instance maps hold at most 65535 contours, use the instance_map format")
+    cv2.imwrite(path, instance_map)
+    return path
+
+
+def rle_counts(x_min, y_min, crop, height):
+    # Output: COCO uncompressed RLE counts (column-major, starting with background) of a crop placed
+    # at (x_min, y_min) in an image of the given height, computed from the crop only
+    columns = np.pad(crop.T, ((0, 0), (1, 1)))  # Runs never continue from one column to the next
+    changes = np.flatnonzero(np.diff(columns.ravel()))
+    column, row = np.divmod(changes, columns.shape[1])
+    # Positions in the full image, column-major: X * Height + Y
+    positions = (x_min + column) * height + (y_min + row)
+    starts, ends = positions[0::2], positions[1::2]
+    # Runs of adjacent columns touch when the crop spans the full height
+    keep_start = np.ones(len(starts), dtype=bool)
+    keep_start[1:] = starts[1:] != ends[:-1]
+    keep_end = np.ones(len(ends), dtype=bool)
+    keep_end[:-1] = keep_start[1:]
+    starts, ends = starts[keep_start], ends[keep_end]
+    boundaries = np.empty(2 * len(starts), dtype=np.int64)
+    boundaries[0::2], boundaries[1::2] = starts, ends
+    return np.diff(boundaries, prepend=0).tolist()
+
+
+def coco_json(data, name):
+    label_set, _ = data.contour_labels()
+    category_ids = {label: category_id for category_id, label in enumerate(label_set, start=1)}
+    width, height = data.orig_dim
+    annotations = []
+    for annotation_id, i in enumerate(data.indices("Contour"), start=1):
+        x_min, y_min, crop = fill_crop(data.points(i))
+        counts = rle_counts(x_min, y_min, crop, height)
+        if sum(counts) < width * height:
+            counts.append(width * height - sum(counts))  # Background after the last run
+        annotations.append({"id": annotation_id, "image_id": 1, "category_id": category_ids[data.labels[i]],
+                            "segmentation": {"size": [height, width], "counts": counts},
+                            "area": int(np.count_nonzero(crop)), "bbox": [x_min, y_min, crop.shape[1], crop.shape[0]],
+                            "iscrowd": 0})
+    return {"images": [{"id": 1, "file_name": name, "width": width, "height": height}],
+            "categories": [{"id": category_id, "name": label} for label, category_id in category_ids.items()],
+            "annotations": annotations}
+
+
+def export_annotations(store, directory, name, orig_dim, formats, yolo_types=marking_store.MARKING_TYPES, bit_packed=True):
+    # Input: formats = names from FORMATS, yolo_types = marking types exported as YOLO boxes,
+    #        bit_packed = pack the per-label masks to one bit per pixel (uint8 0/1 otherwise)
+    # Output: {format: written path or None when there was nothing to write, ...}
+    data = ExportData(store, orig_dim)
+    exported = {}
+    for export_format in formats:
+        if export_format not in FORMAT_FILE_NAMES:
+            raise ValueError(f"Unknown export format: {export_format}")
+        path = os.path.join(directory, FORMAT_FILE_NAMES[export_format].format(name=name))
+        if export_format == "contour_points":
+            exported[export_format] = annotation_io.write_grouped_json(path, points_json(data))
+        elif export_format == "contour_corners":
+            exported[export_format] = annotation_io.write_grouped_json(path, corners_json(data, "Contour"))
+        elif export_format == "box_corners":
+            exported[export_format] = annotation_io.write_grouped_json(path, corners_json(data, "Bounding Box"))
+        elif export_format == "yolo":
+            exported[export_format] = write_lines(path, yolo_lines(data, yolo_types))
+        elif export_format == "yolo_seg":
+            exported[export_format] = write_lines(path, yolo_seg_lines(data))
+        elif export_format == "mask":
+            exported[export_format] = write_semantic_masks(path, data, bit_packed)
+        elif export_format == "instance_map":
+            exported[export_format] = write_instance_map(path, data)
+        elif export_format == "instance_png":
+            exported[export_format] = write_instance_png(path, data)
+        elif export_format == "coco_rle":
+            exported[export_format] = annotation_io.write_json(path, coco_json(data, name))
+        elif export_format == "npz":
+            exported[export_format] = annotation_io.save_npz(path, store)
+    return exported
@@ -0,0 +1,190 @@
+"""
+Reading and writing annotation files without Qt.
+
+Points JSON files ({LABEL: [[[X, Y], ...], ...], ...}) are streamed: the
+writer emits one polygon at a time without indentation and the reader decodes
+one polygon at a time from a fixed-size read buffer straight into a
+MarkingStore, so peak memory stays close to the size of the int32 coordinates
+instead of several times the file size. orjson is used for writing when it is
+installed.
+
+The .npz sidecar holds the MarkingStore arrays themselves (coordinates,
+offsets, types, labels, visibility) and loads in milliseconds.
+"""
+
+import json
+import re
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # Optional faster backend, the standard library is used without it
+    orjson = None
+
+# Custom modules
+import marking_store
+
+READ_CHUNK = 1024 * 1024  # Characters read at a time
+_WHITESPACE = " \t\n\r"
+_POLYGON_END = re.compile(r"\]\s*\]")  # End of a [[X, Y], ...] list
+_NO_BRACKETS = str.maketrans("[]", "  ")
+
+
+##########################################################################
+## JSON Writing ##########################################################
+##########################################################################
+def dumps(content):
+    # Compact JSON text, numpy arrays are accepted by both backends
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+    if isinstance(content, np.ndarray):
+        content = content.tolist()
+    return json.dumps(content, separators=(",", ":"))
+
+
+def write_json(path, content):
+    with open(path, "w", encoding="utf-8") as save_as_json:
+        save_as_json.write(dumps(content))
+    return path
+
+
+def write_grouped_json(path, groups):
+    # Input: groups = iterable of (LABEL, iterable of numpy.ndarray(N, 2) or [[X, Y], ...])
+    # Output (JSON): {LABEL: [[[X, Y], ...], ...], ...} written one polygon at a time
+    with open(path, "w", encoding="utf-8") as save_as_json:
+        save_as_json.write("{")
+        for group_index, (label, polygons) in enumerate(groups):
+            save_as_json.write(("," if group_index else "") + json.dumps(str(label)) + ":[")
+            for polygon_index, polygon in enumerate(polygons):
+                if isinstance(polygon, np.ndarray):
+                    polygon = np.ascontiguousarray(polygon)
+                save_as_json.write(("," if polygon_index else "") + dumps(polygon))
+            save_as_json.write("]")
+        save_as_json.write("}")
+    return path
+
+
+##########################################################################
+## JSON Reading ##########################################################
+##########################################################################
+class _StreamReader:
+    # Minimal pull parser for {"LABEL": [POLYGON, ...], ...}, each string or polygon is decoded whole
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        chunk = self.file.read(READ_CHUNK)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # Output: next non-whitespace character, "" at the end of the file
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, characters):
+        character = self.peek()
+        if character == "" or character not in characters:
+            raise ValueError(f"Expected one of {characters!r} in JSON file, got {character!r}")
+        self.pos += 1
+        return character
+
+    def string(self):
+        self.peek()
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+
+    def polygon(self):
+        # Output: numpy.ndarray(N, 2), the numbers are parsed in C without building nested lists
+        while True:
+            end = _POLYGON_END.search(self.buffer, self.pos)
+            if end is None and self.fill():
+                continue
+            if end is not None:
+                text = self.buffer[self.pos:end.end()]
+                if text.count("[") == text.count("]"):
+                    values = np.fromstring(text.translate(_NO_BRACKETS), dtype=np.float64, sep=",")
+                    if len(values) % 2 == 0 and len(values) == text.count(",") + 1:
+                        self.pos = end.end()
+                        return values.reshape(-1, 2)
+            # Not a plain list of points (empty, nested differently...), use the standard decoder
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return np.asarray(value, dtype=np.float64).reshape(-1, 2)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+
+
+def iter_points_json(path):
+    # Output: generator of (LABEL, numpy.ndarray(N, 2)) in file order, one polygon in memory at a time
+    with open(path, "r", encoding="utf-8") as json_points:
+        reader = _StreamReader(json_points)
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            label = reader.string()
+            reader.expect(":")
+            reader.expect("[")
+            if reader.peek() != "]":
+                while True:
+                    reader.peek()
+                    yield label, reader.polygon()
+                    if reader.expect(",]") == "]":
+                        break
+            else:
+                reader.expect("]")
+            if reader.expect(",}") == "}":
+                return
+
+
+def read_points_json(path, store=None):
+    # Output: MarkingStore, markings with more than 2 points are contours, others bounding boxes
+    store = store if store is not None else marking_store.MarkingStore()
+    for label, points in iter_points_json(path):
+        if len(points) > 0:
+            store.append("Contour" if len(points) > 2 else "Bounding Box", label, points)
+    return store
+
+
+##########################################################################
+## Binary Sidecar ########################################################
+##########################################################################
+def store_arrays(store):
+    # Output: {name: numpy.ndarray} holding every marking, as saved in .npz files
+    return {"coords": store.coords, "offsets": store.offsets, "type_codes": store.type_codes,
+            "label_codes": store.label_codes, "label_names": np.array(store.label_names, dtype=str), "flags": store.flags}
+
+
+def store_from_arrays(archive):
+    # Input: mapping with the arrays of store_arrays (e.g. an opened .npz file)
+    return marking_store.MarkingStore.from_arrays(archive["coords"], archive["offsets"], archive["type_codes"],
+                                                  archive["label_codes"], archive["label_names"].tolist(), archive["flags"])
+
+
+def save_npz(path, store):
+    # Uncompressed, so loading is a few array reads
+    np.savez(path, **store_arrays(store))
+    return path
+
+
+def load_npz(path):
+    with np.load(path) as archive:
+        return store_from_arrays(archive)
@@ -0,0 +1,282 @@
+"""
+Crash-safe autosave of the markings of an image (no Qt dependency).
+
+Every change of the MarkingStore is appended to a journal file next to the
+image as one small binary record (added markings, removed indices, new points,
+labels or visibility flags), so autosaving costs the size of the edit and not
+of the session. Records are flushed to the OS immediately and fsync'd in
+batches. When the journal grows past the size of the markings it is compacted:
+the whole store is written to a snapshot .npz and a new journal is started.
+
+Journal layout: MAGIC, 16-byte epoch, then records of
+[kind: uint8][payload length: uint32][payload][crc32 of payload: uint32].
+The snapshot records the epoch of the journal that continues it, so a journal
+left over from before a compaction is never applied twice. Replay stops at the
+first incomplete or corrupt record (the tail being written during a crash).
+"""
+
+import os
+import struct
+import time
+import zlib
+import numpy as np
+
+# Custom modules
+import annotation_io
+import marking_store
+
+JOURNAL_SUFFIX = ".alphaseg-journal"
+SNAPSHOT_SUFFIX = ".alphaseg-snapshot.npz"
+MAGIC = b"ASJ1"
+EPOCH_SIZE = 16
+FSYNC_INTERVAL = 2.0  # Seconds between fsync calls while editing
+COMPACT_MIN_BYTES = 16 * 1024 * 1024  # Journal size below which it is never compacted
+
+# Record kinds
+ADD = 1
+INSERT = 2
+REMOVE = 3
+UPDATE = 4
+LABELS = 5
+VISIBILITY = 6
+CLEAR = 7
+LABEL_NAME = 8
+
+_RECORD_HEADER = struct.Struct("<BI")
+_CRC = struct.Struct("<I")
+_COUNT = struct.Struct("<Q")
+
+
+def journal_paths(image_path):
+    # Output: (journal path, snapshot path) next to the image
+    return image_path + JOURNAL_SUFFIX, image_path + SNAPSHOT_SUFFIX
+
+
+def has_journal(image_path):
+    return any(os.path.exists(path) for path in journal_paths(image_path))
+
+
+def discard(image_path):
+    # Journal first: a snapshot without journal is still a consistent state
+    for path in journal_paths(image_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+##########################################################################
+## Encoding ##############################################################
+##########################################################################
+def _pack_arrays(*arrays):
+    return b"".join(_COUNT.pack(array.size) + np.ascontiguousarray(array).tobytes() for array in arrays)
+
+
+def _unpack_arrays(payload, dtypes):
+    arrays, pos = [], 0
+    for dtype in dtypes:
+        count = _COUNT.unpack_from(payload, pos)[0]
+        pos += _COUNT.size
+        array = np.frombuffer(payload, dtype=dtype, count=count, offset=pos)
+        pos += array.nbytes
+        arrays.append(array)
+    return arrays
+
+
+_MARKING_DTYPES = (np.uint8, np.int32, np.uint8, np.int64, np.int32)  # Types, label codes, flags, lengths, coords
+
+
+def _pack_markings(store, indices):
+    indices = np.asarray(indices, dtype=np.int64)
+    subset = store.subset(indices)
+    return _pack_arrays(subset.type_codes, store.label_codes[indices], subset.flags, subset.lengths(), subset.coords)
+
+
+def _unpack_markings(arrays, label_names):
+    type_codes, label_codes, flags, lengths, coords = arrays
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    return marking_store.MarkingStore.from_arrays(coords.reshape(-1, 2), offsets, type_codes, label_codes, label_names, flags)
+
+
+def _split_polygons(lengths, coords):
+    return np.split(coords.reshape(-1, 2), np.cumsum(lengths)[:-1]) if len(lengths) > 0 else []
+
+
+##########################################################################
+## Replay ################################################################
+##########################################################################
+def _read_records(journal_path):
+    # Output: (epoch, [(kind, payload), ...]) up to the first incomplete or corrupt record
+    with open(journal_path, "rb") as journal:
+        data = journal.read()
+    if data[:len(MAGIC)] != MAGIC or len(data) < len(MAGIC) + EPOCH_SIZE:
+        return None, []
+    epoch = data[len(MAGIC):len(MAGIC) + EPOCH_SIZE]
+    records, pos = [], len(MAGIC) + EPOCH_SIZE
+    while pos + _RECORD_HEADER.size <= len(data):
+        kind, length = _RECORD_HEADER.unpack_from(data, pos)
+        end = pos + _RECORD_HEADER.size + length
+        if end + _CRC.size > len(data):
+            break
+        payload = data[pos + _RECORD_HEADER.size:end]
+        if _CRC.unpack_from(data, end)[0] != zlib.crc32(payload):
+            break
+        records.append((kind, payload))
+        pos = end + _CRC.size
+    return epoch, records
+
+
+def apply_record(store, kind, payload):
+    if kind == ADD:
+        store.append_store(_unpack_markings(_unpack_arrays(payload, _MARKING_DTYPES), store.label_names))
+    elif kind == INSERT:
+        arrays = _unpack_arrays(payload, (np.int64,) + _MARKING_DTYPES)
+        store.insert_store(arrays[0], _unpack_markings(arrays[1:], store.label_names))
+    elif kind == REMOVE:
+        store.delete(_unpack_arrays(payload, (np.int64,))[0])
+    elif kind == UPDATE:
+        indices, lengths, coords = _unpack_arrays(payload, (np.int64, np.int64, np.int32))
+        store.replace_points(indices, _split_polygons(lengths, coords))
+    elif kind == LABELS:
+        indices, codes = _unpack_arrays(payload, (np.int64, np.int32))
+        store.set_label_codes(indices, codes)
+    elif kind == VISIBILITY:
+        indices, flags = _unpack_arrays(payload, (np.int64, np.uint8))
+        store.set_flags(indices, flags)
+    elif kind == CLEAR:
+        store.clear()
+    elif kind == LABEL_NAME:
+        store.label_code(payload.decode("utf-8"))
+
+
+def recover(image_path):
+    # Output: (MarkingStore, number of journal records applied), the snapshot state followed by the journal
+    journal_path, snapshot_path = journal_paths(image_path)
+    store, snapshot_epoch = marking_store.MarkingStore(), None
+    if os.path.exists(snapshot_path):
+        with np.load(snapshot_path) as archive:
+            store = annotation_io.store_from_arrays(archive)
+            snapshot_epoch = archive["epoch"].tobytes()
+    num_records = 0
+    if os.path.exists(journal_path):
+        epoch, records = _read_records(journal_path)
+        # A journal from before the last compaction is already part of the snapshot
+        if epoch is not None and (snapshot_epoch is None or epoch == snapshot_epoch):
+            for kind, payload in records:
+                apply_record(store, kind, payload)
+            num_records = len(records)
+    return store, num_records
+
+
+##########################################################################
+## Recording #############################################################
+##########################################################################
+class AutosaveJournal:
+    def __init__(self, image_path, store, fsync_interval=FSYNC_INTERVAL, compact_min_bytes=COMPACT_MIN_BYTES):
+        self.image_path = image_path
+        self.journal_path, self.snapshot_path = journal_paths(image_path)
+        self.store = store
+        self.fsync_interval = fsync_interval
+        self.compact_min_bytes = compact_min_bytes
+        self.file = None  # Opened on the first edit when the markings start empty
+        self.journal_bytes = 0
+        self.snapshot_bytes = 0
+        self.num_label_names = 1  # Label names known to a replay ("NO LABEL" only without snapshot)
+        self.last_sync = time.monotonic()
+        self.dirty = False  # Records written since the last fsync
+        self.error = None  # OSError that stopped the autosave (disk full, folder not writable...)
+        # The journal starts from the current markings, older autosave files are replaced
+        if len(store) > 0:
+            self.compact()
+        else:
+            discard(image_path)
+        self.store.add_listener(self.on_markings_changed)
+
+    def close(self):
+        self.store.remove_listener(self.on_markings_changed)
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    ##########################################################################
+    ## Writing ###############################################################
+    ##########################################################################
+    def start_journal(self, epoch):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.journal_path, "wb")
+        self.file.write(MAGIC + epoch)
+        self.journal_bytes = len(MAGIC) + EPOCH_SIZE
+        self.dirty = True
+        self.sync(force=True)
+
+    def write_record(self, kind, payload):
+        if self.file is None:
+            self.start_journal(os.urandom(EPOCH_SIZE))
+        self.file.write(_RECORD_HEADER.pack(kind, len(payload)) + payload + _CRC.pack(zlib.crc32(payload)))
+        # In the OS right away (survives a crash of the application), on disk at the next sync
+        self.file.flush()
+        self.journal_bytes += _RECORD_HEADER.size + len(payload) + _CRC.size
+        self.dirty = True
+        if time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self, force=False):
+        # Called after edits and periodically by the GUI, so the last edits reach the disk when idle
+        if self.file is not None and (self.dirty or force):
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.dirty = False
+        self.last_sync = time.monotonic()
+
+    def write_label_names(self):
+        # Labels created since the last record, so that replayed label codes match
+        for name in self.store.label_names[self.num_label_names:]:
+            self.write_record(LABEL_NAME, name.encode("utf-8"))
+        self.num_label_names = len(self.store.label_names)
+
+    def compact(self):
+        # Snapshot of the whole store, then a new journal continuing it
+        epoch = os.urandom(EPOCH_SIZE)
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "wb") as snapshot:
+            np.savez(snapshot, epoch=np.frombuffer(epoch, dtype=np.uint8), **annotation_io.store_arrays(self.store))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        self.snapshot_bytes = os.path.getsize(self.snapshot_path)
+        self.num_label_names = len(self.store.label_names)
+        self.start_journal(epoch)
+
+    def on_markings_changed(self, kind, indices):
+        # A failing disk stops the autosave instead of interrupting the edit
+        try:
+            self.record(kind, indices)
+        except OSError as error:
+            self.error = error
+            self.store.remove_listener(self.on_markings_changed)
+
+    def record(self, kind, indices):
+        if kind == marking_store.ADDED and len(indices) > 0:
+            self.write_label_names()
+            self.write_record(ADD, _pack_markings(self.store, indices))
+        elif kind == marking_store.INSERTED:
+            self.write_label_names()
+            self.write_record(INSERT, _pack_arrays(np.asarray(indices, dtype=np.int64)) + _pack_markings(self.store, indices))
+        elif kind == marking_store.REMOVED:
+            self.write_record(REMOVE, _pack_arrays(np.asarray(indices, dtype=np.int64)))
+        elif kind == marking_store.UPDATED:
+            subset = self.store.subset(indices)
+            self.write_record(UPDATE, _pack_arrays(np.asarray(indices, dtype=np.int64), subset.lengths(), subset.coords))
+        elif kind == marking_store.LABELS_CHANGED:
+            self.write_label_names()
+            self.write_record(LABELS, _pack_arrays(np.asarray(indices, dtype=np.int64), self.store.label_codes[indices]))
+        elif kind == marking_store.VISIBILITY_CHANGED:
+            self.write_record(VISIBILITY, _pack_arrays(np.asarray(indices, dtype=np.int64), self.store.flags[indices]))
+        elif kind == marking_store.CLEARED:
+            self.write_record(CLEAR, b"")
+        else:
+            return
+        # Compacting once the journal outgrows the snapshot keeps the cost per edit constant on average
+        if self.journal_bytes > max(self.compact_min_bytes, self.snapshot_bytes):
+            self.compact()
@@ -0,0 +1,66 @@
+from PyQt5.QtCore import QThread, pyqtSignal
+
+# Workers are referenced here until they finish, so closing the window that
+# started one never destroys a running QThread
+RUNNING_WORKERS = set()
+
+
+class FunctionWorker(QThread):
+    # Run a function outside the GUI thread and deliver its result through a signal
+    result_signal = pyqtSignal(object)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, function, *args, **kwargs):
+        super(FunctionWorker, self).__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.finished.connect(lambda: RUNNING_WORKERS.discard(self))
+
+    def start(self):
+        RUNNING_WORKERS.add(self)
+        super(FunctionWorker, self).start()
+
+    def call(self):
+        return self.function(*self.args, **self.kwargs)
+
+    def run(self):
+        try:
+            result = self.call()
+        except Exception as error:
+            self.error_signal.emit(f"{type(error).__name__}: {error}")
+            return
+        self.result_signal.emit(result)
+
+
+class ProgressWorker(FunctionWorker):
+    # The function also receives progress(percent, message) and is_cancelled() keyword arguments
+    progress_signal = pyqtSignal(int, str)
+    cancelled_signal = pyqtSignal()
+
+    def __init__(self, function, *args, **kwargs):
+        super(ProgressWorker, self).__init__(function, *args, **kwargs)
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def call(self):
+        return self.function(*self.args, progress=self.progress_signal.emit, is_cancelled=self.is_cancelled, **self.kwargs)
+
+    def run(self):
+        try:
+            result = self.call()
+        except Exception as error:
+            if self._cancelled:
+                self.cancelled_signal.emit()
+            else:
+                self.error_signal.emit(f"{type(error).__name__}: {error}")
+            return
+        if self._cancelled:
+            self.cancelled_signal.emit()
+        else:
+            self.result_signal.emit(result)
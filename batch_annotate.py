@@ -0,0 +1,132 @@
+"""
+Headless Cellpose pre-annotation of every image in a folder.
+
+Each image goes through the same loading, segmentation and export code as the
+GUI, spread over a pool of worker processes that keep their Cellpose model
+loaded. Finished images are recorded in a manifest in the output folder, so an
+interrupted run picks up where it stopped and unchanged images are skipped.
+The markings of every image are also written to the annotation database of the
+output folder (see annotation_db.py) for dataset-wide queries.
+
+Usage:
+    python batch_annotate.py [input_dir] [output_dir] [--formats contour_points yolo mask coco_rle ...] [--workers N] [--database PATH]
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+# Custom modules
+import annotation_db
+import annotation_export
+import annotation_io
+import cellpose_segmentation
+import image_io
+import marking_store
+import polygon_simplify
+
+MANIFEST_NAME = "batch_manifest.jsonl"
+
+
+def image_key(image_dir):
+    # Identifies an image version, a modified image is processed again
+    stat = os.stat(image_dir)
+    return f"{os.path.abspath(image_dir)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def load_manifest(output_dir):
+    processed = set()
+    manifest_dir = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_dir):
+        with open(manifest_dir, "r") as manifest:
+            for line in manifest:
+                try:
+                    processed.add(json.loads(line)["key"])
+                except (ValueError, KeyError):
+                    pass  # Line cut short by an interrupted run
+    return processed
+
+
+def annotate_image(image_dir, output_dir, name, options):
+    # Runs in a worker process
+    # Input: name = output file name, see image_io.output_names
+    # Output: (number of contours, [label id of failed masks, ...], [exported path, ...], store arrays, (Width, Height))
+    image = image_io.load_image(image_dir)
+    contours, failed = cellpose_segmentation.segment(image, options["model_type"], options["diameter"], options["flow_threshold"],
+                                                     False, options["use_gpu"], simplify_tolerance=options["simplify_tolerance"])
+    store = marking_store.MarkingStore()
+    store.extend("Contour", options["label"], contours)
+    orig_dim = (image.shape[1], image.shape[0])
+    exported = annotation_export.export_annotations(store, output_dir, name, orig_dim, options["formats"])
+    return len(contours), failed, [path for path in exported.values() if path is not None], annotation_io.store_arrays(store), orig_dim
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Pre-annotate a folder of images with Cellpose.")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--formats", nargs="+", choices=annotation_export.FORMATS, default=["contour_points", "yolo"])
+    parser.add_argument("--model-type", default="cyto3")
+    parser.add_argument("--diameter", type=float, default=None, help="Estimated by Cellpose when omitted")
+    parser.add_argument("--flow-threshold", type=float, default=0.4)
+    parser.add_argument("--label", default=marking_store.NO_LABEL)
+    parser.add_argument("--simplify-tolerance", type=float, default=polygon_simplify.DEFAULT_TOLERANCE, help="Contour simplification in pixels, 0 keeps every boundary pixel")
+    parser.add_argument("--gpu", action="store_true")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count / torch threads, 1 with --gpu)")
+    parser.add_argument("--torch-threads", type=int, default=1, help="Torch threads per worker process")
+    parser.add_argument("--overwrite", action="store_true", help="Process images already recorded in the manifest again")
+    parser.add_argument("--database", default=None, help=f"Annotation database (default: {annotation_db.DB_NAME} in output_dir)")
+    parser.add_argument("--no-database", action="store_true", help="Do not write the annotation database")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    options = {"model_type": args.model_type, "diameter": args.diameter, "flow_threshold": args.flow_threshold,
+               "label": args.label, "use_gpu": args.gpu, "formats": args.formats, "simplify_tolerance": args.simplify_tolerance}
+    processed = set() if args.overwrite else load_manifest(args.output_dir)
+    image_dirs = image_io.list_images(args.input_dir)
+    names = image_io.output_names(image_dirs)  # From every image of the folder, so names do not depend on what is skipped
+    pending = [(image_dir, image_key(image_dir)) for image_dir in image_dirs]
+    skipped = sum(key in processed for _, key in pending)
+    pending = [(image_dir, key) for image_dir, key in pending if key not in processed]
+    print(f"{len(pending)} image(s) to process, {skipped} already processed")
+    if len(pending) == 0:
+        return 0
+
+    # A single GPU is shared, more processes would only compete for its memory
+    num_workers = 1 if args.gpu else (args.workers or max(1, (os.cpu_count() or 1) // max(1, args.torch_threads)))
+    num_failed = 0
+    start_time = time.time()
+    # Written by this process only, the workers send back the markings
+    db = None if args.no_database else annotation_db.AnnotationDB(args.database or annotation_db.default_db_path(args.output_dir))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, initializer=cellpose_segmentation.init_worker_process,
+                                                initargs=(args.torch_threads,)) as executor, \
+            open(os.path.join(args.output_dir, MANIFEST_NAME), "a") as manifest:
+        futures = {executor.submit(annotate_image, image_dir, args.output_dir, names[image_dir], options): (image_dir, key) for image_dir, key in pending}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            image_dir, key = futures[future]
+            try:
+                num_contours, failed_masks, exported, arrays, orig_dim = future.result()
+            except Exception as error:
+                # Not recorded in the manifest, the image is retried on the next run
+                num_failed += 1
+                print(f"[{done}/{len(pending)}] {image_dir}: failed ({type(error).__name__}: {error})")
+                continue
+            if db is not None:
+                db.write_image(image_dir, annotation_io.store_from_arrays(arrays), orig_dim)
+            manifest.write(json.dumps({"key": key, "image": image_dir, "contours": num_contours, "failed_masks": failed_masks, "outputs": exported}) + "\n")
+            manifest.flush()
+            print(f"[{done}/{len(pending)}] {image_dir}: {num_contours} contours" + (f", no contour for masks {failed_masks}" if failed_masks else ""))
+    if db is not None:
+        db.close()
+    print(f"Finished in {time.time() - start_time:.1f} s, {num_failed} image(s) failed")
+    return 1 if num_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,27 @@
+import os
 from PyQt5 import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
-from cellpose import models
-import numpy as np
-import cv2
+
+# Custom modules
+import background_worker
+import cellpose_segmentation
+import marking_store
+import polygon_simplify
 
 class CellposeOptionWindow(QMainWindow):
     cellpose_done_signal = pyqtSignal()
 
-    def __init__(self, image_arr, marking_info):
+    def __init__(self, image_arr, marking_store, simplify_tolerance=polygon_simplify.DEFAULT_TOLERANCE, image_dir=None):
         super(CellposeOptionWindow, self).__init__()
         self.setWindowTitle('Cellpose')
+        self.simplify_tolerance = simplify_tolerance
         self.build_gui()
         self.image_arr = image_arr
-        self.marking_info = marking_info
+        self.image_dir = image_dir
+        self.marking_store = marking_store
+        self.worker = None
+        self.worker_image_dir = None  # Image being segmented by the worker
 
     def build_gui(self):
         base_widget = QWidget(self)
@@ -39,21 +47,74 @@ class CellposeOptionWindow(QMainWindow):
         flow_threshold_h_layout.addWidget(self.flow_threshold_text)
         flow_threshold_h_layout.addWidget(self.flow_threshold_input)
 
+        simplify_h_layout = QHBoxLayout()
+        self.simplify_text = QLabel("Simplify tolerance (px, 0 = off)")
+        self.simplify_input = QLineEdit(str(self.simplify_tolerance))
+        simplify_h_layout.addWidget(self.simplify_text)
+        simplify_h_layout.addWidget(self.simplify_input)
+
         self.do_3d_checkbox = QCheckBox("Perform 3D")
         self.do_3d_checkbox.setChecked(False)
 
         self.use_gpu_checkbox = QCheckBox("Use GPU")
         self.use_gpu_checkbox.setChecked(False)
 
+        # Tiled inference for large images, tiles run on a process pool (one by one with GPU)
+        self.tiled_checkbox = QCheckBox("Tiled inference")
+        self.tiled_checkbox.setChecked(False)
+        tile_h_layout = QHBoxLayout()
+        self.tile_size_text = QLabel("Tile size")
+        self.tile_size_input = QLineEdit(str(cellpose_segmentation.TILE_SIZE))
+        self.tile_overlap_text = QLabel("Overlap")
+        self.tile_overlap_input = QLineEdit(str(cellpose_segmentation.TILE_OVERLAP))
+        tile_h_layout.addWidget(self.tile_size_text)
+        tile_h_layout.addWidget(self.tile_size_input)
+        tile_h_layout.addWidget(self.tile_overlap_text)
+        tile_h_layout.addWidget(self.tile_overlap_input)
+        workers_h_layout = QHBoxLayout()
+        self.num_workers_text = QLabel("Workers")
+        self.num_workers_input = QLineEdit(str(max(1, os.cpu_count() or 1)))
+        self.torch_threads_text = QLabel("Threads per worker")
+        self.torch_threads_input = QLineEdit("1")
+        workers_h_layout.addWidget(self.num_workers_text)
+        workers_h_layout.addWidget(self.num_workers_input)
+        workers_h_layout.addWidget(self.torch_threads_text)
+        workers_h_layout.addWidget(self.torch_threads_input)
+
         self.start_cellpose = QPushButton("Start Cellpose")
         self.start_cellpose.clicked.connect(self.generate_mask_with_cellpose)
+        self.cancel_cellpose = QPushButton("Cancel")
+        self.cancel_cellpose.setEnabled(False)
+        self.cancel_cellpose.clicked.connect(self.cancel_generate_mask_with_cellpose)
+        start_cancel_h_layout = QHBoxLayout()
+        start_cancel_h_layout.addWidget(self.start_cellpose)
+        start_cancel_h_layout.addWidget(self.cancel_cellpose)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_text = QLabel("")
+
+        model_cache_h_layout = QHBoxLayout()
+        self.model_cache_text = QLabel(cellpose_segmentation.MODEL_CACHE.summary())
+        self.model_cache_text.setWordWrap(True)
+        self.unload_models_button = QPushButton("Unload Models")
+        self.unload_models_button.clicked.connect(self.unload_models)
+        model_cache_h_layout.addWidget(self.model_cache_text)
+        model_cache_h_layout.addWidget(self.unload_models_button)
 
         main_v_layout.addLayout(model_type_h_layout)
         main_v_layout.addLayout(diameter_h_layout)
         main_v_layout.addLayout(flow_threshold_h_layout)
+        main_v_layout.addLayout(simplify_h_layout)
         main_v_layout.addWidget(self.do_3d_checkbox)
         main_v_layout.addWidget(self.use_gpu_checkbox)
-        main_v_layout.addWidget(self.start_cellpose)
+        main_v_layout.addWidget(self.tiled_checkbox)
+        main_v_layout.addLayout(tile_h_layout)
+        main_v_layout.addLayout(workers_h_layout)
+        main_v_layout.addLayout(start_cancel_h_layout)
+        main_v_layout.addWidget(self.progress_bar)
+        main_v_layout.addWidget(self.progress_text)
+        main_v_layout.addLayout(model_cache_h_layout)
 
     def generate_mask_with_cellpose(self):
         def is_float(string):
@@ -76,27 +137,82 @@ class CellposeOptionWindow(QMainWindow):
             flow_threshold = 0.4;
         do_3D = self.do_3d_checkbox.isChecked()
         use_gpu = self.use_gpu_checkbox.isChecked()
-        print(model_type, diameter, flow_threshold, do_3D, use_gpu)
-        self._generate_mask_with_cellpose(image_arr, model_type, diameter, flow_threshold, do_3D, use_gpu)
-
-    def _generate_mask_with_cellpose(self, image_arr, model_type, diameter, flow_threshold, do_3D, use_gpu):
-        model = models.Cellpose(gpu=use_gpu, model_type=model_type)
-        masks, _, _, _ = model.eval(image_arr, diameter=diameter, channels=[0, 0], flow_threshold=flow_threshold, do_3D=do_3D)
-        num_masks = len(np.unique(masks))
-        for i in range(1, num_masks):  # No need to consider "0" label
-            mask_temp = np.zeros(masks.shape, dtype=np.uint8)
-            mask_temp[masks == i] = 1
-            try:
-                contours = cv2.findContours(mask_temp, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
-                coord = contours[0][0]
-                coord_qpoint = []
-                for j in range(0, coord.shape[0]):
-                    coord_qpoint.append(QPoint(coord[j, :, 0][0], coord[j, :, 1][0]))
-                self.marking_info.append(["Contour", "NO LABEL", coord_qpoint, True, True])
-            except:
-                print("Mask failure")
+        tile_options = {"tiled": self.tiled_checkbox.isChecked(),
+                        "tile_size": max(64, int(self.tile_size_input.text())) if self.tile_size_input.text().isdigit() else cellpose_segmentation.TILE_SIZE,
+                        "overlap": int(self.tile_overlap_input.text()) if self.tile_overlap_input.text().isdigit() else cellpose_segmentation.TILE_OVERLAP,
+                        "num_workers": max(1, int(self.num_workers_input.text())) if self.num_workers_input.text().isdigit() else None,
+                        "torch_threads": max(1, int(self.torch_threads_input.text())) if self.torch_threads_input.text().isdigit() else 1}
+        simplify_tolerance = self.simplify_input.text()
+        tile_options["simplify_tolerance"] = float(simplify_tolerance) if is_float(simplify_tolerance) else self.simplify_tolerance
+        self._generate_mask_with_cellpose(image_arr, model_type, diameter, flow_threshold, do_3D, use_gpu, tile_options)
+
+    def _generate_mask_with_cellpose(self, image_arr, model_type, diameter, flow_threshold, do_3D, use_gpu, tile_options):
+        # Inference runs in a worker thread, the GUI stays responsive
+        self.worker = background_worker.ProgressWorker(cellpose_segmentation.segment, image_arr, model_type, diameter, flow_threshold, do_3D, use_gpu, **tile_options)
+        self.worker.progress_signal.connect(self.show_progress)
+        self.worker.result_signal.connect(self.finish_generate_mask_with_cellpose)
+        self.worker.error_signal.connect(self.fail_generate_mask_with_cellpose)
+        self.worker.cancelled_signal.connect(self.cancel_done_generate_mask_with_cellpose)
+        self.start_cellpose.setEnabled(False)
+        self.cancel_cellpose.setEnabled(True)
+        self.worker_image_dir = self.image_dir
+        self.worker.start()
+
+    def set_image(self, image_arr, image_dir):
+        # Another image was opened in the main window, a running segmentation is kept for the previous one
+        self.image_arr = image_arr
+        self.image_dir = image_dir
+
+    def show_progress(self, percent, message):
+        self.progress_bar.setValue(percent)
+        self.progress_text.setText(message)
+        self.model_cache_text.setText(cellpose_segmentation.MODEL_CACHE.summary())
+
+    def unload_models(self):
+        # Models in use by a running segmentation stay alive until it finishes
+        cellpose_segmentation.MODEL_CACHE.unload()
+        cellpose_segmentation.shutdown_tile_pool()  # Tile workers hold their own models
+        self.model_cache_text.setText(cellpose_segmentation.MODEL_CACHE.summary())
+
+    def cancel_generate_mask_with_cellpose(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_cellpose.setEnabled(False)
+            self.progress_text.setText("Cancelling (after the current step)...")
+
+    def finish_generate_mask_with_cellpose(self, result):
+        contours, failed = result
+        self.worker = None
+        self.start_cellpose.setEnabled(True)
+        self.cancel_cellpose.setEnabled(False)
+        if self.worker_image_dir != self.image_dir:
+            # The markings of the store now belong to another image
+            self.progress_bar.setValue(0)
+            self.progress_text.setText(f"Discarded: {os.path.basename(self.worker_image_dir or '')} is no longer the opened image")
+            return
+        self.marking_store.extend("Contour", marking_store.NO_LABEL, contours)
+        if failed:
+            shown = ", ".join(str(label) for label in failed[:20]) + (", ..." if len(failed) > 20 else "")
+            QMessageBox.warning(self, "Cellpose", f"No contour could be extracted for {len(failed)} mask(s): {shown}")
         self.cellpose_done_signal.emit()
 
+    def fail_generate_mask_with_cellpose(self, message):
+        self.worker = None
+        self.start_cellpose.setEnabled(True)
+        self.cancel_cellpose.setEnabled(False)
+        self.progress_text.setText(f"Cellpose failed: {message}")
+
+    def cancel_done_generate_mask_with_cellpose(self):
+        self.worker = None
+        self.start_cellpose.setEnabled(True)
+        self.progress_bar.setValue(0)
+        self.progress_text.setText("Cancelled")
+
+    def closeEvent(self, event):
+        # Closing the window cancels a running segmentation
+        self.cancel_generate_mask_with_cellpose()
+        super(CellposeOptionWindow, self).closeEvent(event)
+
 # For testing only
 if __name__ == '__main__':
     import sys
@@ -0,0 +1,358 @@
+"""
+Cellpose segmentation without Qt, shared by the Cellpose window and scripts.
+
+Long steps report progress through an optional progress(percent, message)
+callback and stop with Cancelled as soon as is_cancelled() returns True.
+Cancellation is checked between steps and while extracting contours; a
+running model.eval call cannot be interrupted, its result is dropped instead.
+
+Loaded models are kept in a process-wide LRU cache (MODEL_CACHE) keyed by
+(model_type, gpu), so repeated runs skip reloading the weights.
+
+Large images can be segmented in overlapping tiles spread over a pool of
+worker processes (segment_tiled). Every tile owns the core of its region, and
+cells cut by a core boundary are merged using the overlap, where the tile
+next to the boundary sees them whole.
+"""
+
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import numpy as np
+import cv2
+from scipy import ndimage
+
+# Custom modules
+import polygon_simplify
+
+MAX_CACHED_MODELS = 2
+CONTOUR_CHUNK_SIZE = 64  # Labels per contour extraction task
+THREAD_POOL_MIN_LABELS = 512  # Fewer labels are extracted in the calling thread
+TILE_SIZE = 1024
+TILE_OVERLAP = 128  # Should be larger than the cell diameter
+CANCEL_POLL_INTERVAL = 0.2  # Seconds between cancellation checks while tiles are running
+MERGE_FRACTION = 0.5  # Share of a cell piece that must fall in a tile's cell for the two to merge
+
+
+class Cancelled(Exception):
+    pass
+
+
+class ModelCache:
+    # Least recently used cache of Cellpose models keyed by (model_type, gpu)
+    def __init__(self, max_models=MAX_CACHED_MODELS):
+        self.max_models = max_models
+        self.hits = 0
+        self.misses = 0
+        self._models = collections.OrderedDict()
+        self._lock = threading.Lock()  # Held while loading, so a model is never loaded twice
+
+    def get(self, model_type, gpu):
+        key = (model_type, bool(gpu))
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return model
+            self.misses += 1
+            # Imported on first use, the contour and stitching helpers do not need torch
+            from cellpose import models
+            model = models.Cellpose(gpu=gpu, model_type=model_type)
+            self._models[key] = model
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+        return model
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def unload(self, model_type=None, gpu=None):
+        # Remove the matching models (all of them by default) and release GPU memory
+        with self._lock:
+            for key in list(self._models.keys()):
+                if (model_type is None or key[0] == model_type) and (gpu is None or key[1] == bool(gpu)):
+                    del self._models[key]
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "loaded": list(self._models.keys())}
+
+    def summary(self):
+        loaded = ", ".join(f"{model_type} ({'GPU' if gpu else 'CPU'})" for model_type, gpu in self._models.keys())
+        return f"Model cache: {self.hits} hits, {self.misses} misses. Loaded: {loaded or 'none'}"
+
+
+MODEL_CACHE = ModelCache()
+
+
+def _report(progress, percent, message):
+    if progress is not None:
+        progress(int(percent), message)
+
+
+def _check(is_cancelled):
+    if is_cancelled is not None and is_cancelled():
+        raise Cancelled()
+
+
+def _label_contour(masks, label, bbox):
+    # Output: numpy.ndarray(N, 2) of [X, Y] outer contour of one label, or None if it has none
+    y_slice, x_slice = bbox
+    crop = (masks[bbox] == label).astype(np.uint8)
+    # One pixel of padding so labels touching the crop edge still get a closed contour
+    crop = cv2.copyMakeBorder(crop, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    contours, _ = cv2.findContours(crop, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=(x_slice.start - 1, y_slice.start - 1))
+    if len(contours) == 0:
+        return None
+    contour = max(contours, key=len) if len(contours) > 1 else contours[0]
+    return contour.reshape(-1, 2)
+
+
+def _chunk_contours(masks, labels, bboxes):
+    contours_found, failed = [], []
+    for label, bbox in zip(labels, bboxes):
+        try:
+            contour = _label_contour(masks, label, bbox)
+        except cv2.error:
+            contour = None
+        if contour is None:
+            failed.append(label)
+        else:
+            contours_found.append(contour)
+    return contours_found, failed
+
+
+def masks_to_contours(masks, progress=None, is_cancelled=None, progress_range=(0, 100), num_threads=None):
+    # Input: masks = numpy.ndarray(H, W) label map, 0 is background
+    # Output: ([numpy.ndarray(N, 2) of [X, Y], ...] one outer contour per label, [failed label id, ...])
+    # A single pass (find_objects) gives the bounding slices of every label, each contour is then
+    # extracted from its crop only. OpenCV releases the GIL, so large label counts use a thread pool.
+    bboxes = ndimage.find_objects(masks)
+    labels = [label for label, bbox in enumerate(bboxes, start=1) if bbox is not None]
+    bboxes = [bbox for bbox in bboxes if bbox is not None]
+    chunks = [(labels[i:i + CONTOUR_CHUNK_SIZE], bboxes[i:i + CONTOUR_CHUNK_SIZE]) for i in range(0, len(labels), CONTOUR_CHUNK_SIZE)]
+    contours_found, failed = [], []
+
+    def collect(results, done):
+        contours_chunk, failed_chunk = results
+        contours_found.extend(contours_chunk)
+        failed.extend(failed_chunk)
+        _report(progress, progress_range[0] + (progress_range[1] - progress_range[0]) * done / len(labels), f"Extracting contours ({done}/{len(labels)})")
+
+    done = 0
+    if len(labels) < THREAD_POOL_MIN_LABELS:
+        for chunk_labels, chunk_bboxes in chunks:
+            _check(is_cancelled)
+            done += len(chunk_labels)
+            collect(_chunk_contours(masks, chunk_labels, chunk_bboxes), done)
+        return contours_found, failed
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads or os.cpu_count()) as executor:
+        # Results are collected in submission order, so contours keep the label order
+        futures = [executor.submit(_chunk_contours, masks, chunk_labels, chunk_bboxes) for chunk_labels, chunk_bboxes in chunks]
+        try:
+            for future, (chunk_labels, _) in zip(futures, chunks):
+                _check(is_cancelled)
+                done += len(chunk_labels)
+                collect(future.result(), done)
+        except Cancelled:
+            for future in futures:
+                future.cancel()
+            raise
+    return contours_found, failed
+
+
+##########################################################################
+## Tiled inference #######################################################
+##########################################################################
+def tile_starts(length, tile_size, overlap):
+    # Output: start of every tile along one axis, the last tile ends at length
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+
+def tile_cores(starts, length, overlap):
+    # Output: [(core start, core end), ...] partition of the axis, one core per tile
+    bounds = [0] + [start + overlap // 2 for start in starts[1:]] + [length]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def tile_grid(shape, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    # Output: [((y0, y1, x0, x1) tile, (y0, y1, x0, x1) core), ...] in row-major order
+    overlap = min(overlap, tile_size // 2)
+    grid = []
+    row_starts = tile_starts(shape[0], tile_size, overlap)
+    col_starts = tile_starts(shape[1], tile_size, overlap)
+    for row_start, row_core in zip(row_starts, tile_cores(row_starts, shape[0], overlap)):
+        for col_start, col_core in zip(col_starts, tile_cores(col_starts, shape[1], overlap)):
+            tile = (row_start, min(row_start + tile_size, shape[0]), col_start, min(col_start + tile_size, shape[1]))
+            grid.append((tile, row_core + col_core))
+    return grid
+
+
+def init_worker_process(torch_threads):
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    cv2.setNumThreads(1)
+
+
+def eval_tile(tile_arr, model_type, diameter, flow_threshold, use_gpu):
+    # Runs in a worker process, which keeps its own MODEL_CACHE between tiles and runs
+    model = MODEL_CACHE.get(model_type, use_gpu)
+    masks, _, _, _ = model.eval(tile_arr, diameter=diameter, channels=[0, 0], flow_threshold=flow_threshold, do_3D=False)
+    return masks.astype(np.uint16) if masks.max() < 65536 else masks.astype(np.int32)
+
+
+_tile_pool = None
+_tile_pool_key = None
+_tile_futures = set()  # Tiles submitted to the pool and not finished yet
+
+
+def tile_pool(num_workers, torch_threads):
+    # Process pool kept alive between runs, so the workers keep their models loaded
+    global _tile_pool, _tile_pool_key
+    if _tile_pool is None or _tile_pool_key != (num_workers, torch_threads):
+        shutdown_tile_pool()
+        # Spawned rather than forked, forking a process running Qt and torch threads is unsafe
+        _tile_pool = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"),
+                                                            initializer=init_worker_process, initargs=(torch_threads,))
+        _tile_pool_key = (num_workers, torch_threads)
+    return _tile_pool
+
+
+def shutdown_tile_pool():
+    global _tile_pool, _tile_pool_key
+    if _tile_pool is not None:
+        # Queued tiles are cancelled by hand, shutdown(cancel_futures=True) needs Python 3.9
+        for future in list(_tile_futures):
+            future.cancel()
+        _tile_pool.shutdown(wait=False)
+    _tile_pool, _tile_pool_key = None, None
+
+
+def stitch_tiles(shape, grid, tile_masks):
+    # Input: grid from tile_grid, tile_masks = [numpy.ndarray(tile height, tile width) label map, ...]
+    # Output: numpy.ndarray(H, W) of int32 labels, 1..N consecutive
+    labels = np.zeros(shape, dtype=np.int32)
+    num_labels = 0
+    for ((ty0, ty1, tx0, tx1), (cy0, cy1, cx0, cx1)), masks in zip(grid, tile_masks):
+        core = masks[cy0 - ty0:cy1 - ty0, cx0 - tx0:cx1 - tx0].astype(np.int32)
+        labels[cy0:cy1, cx0:cx1] = np.where(core > 0, core + num_labels, 0)
+        num_labels += int(masks.max())
+
+    # Union-find over the global labels
+    parent = np.arange(num_labels + 1)
+
+    def find(label):
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    for ((ty0, ty1, tx0, tx1), _), masks in zip(grid, tile_masks):
+        stitched = labels[ty0:ty1, tx0:tx1]
+        local = masks.astype(np.int64)
+        inside = (local > 0) & (stitched > 0)
+        if not inside.any():
+            continue
+        # Pixels shared by each (tile cell, stitched piece) pair, relative to the piece size in the tile
+        pairs, counts = np.unique(local[inside] * (num_labels + 1) + stitched[inside], return_counts=True)
+        piece_sizes = np.bincount(stitched.ravel(), minlength=num_labels + 1)
+        local_ids, pieces = np.divmod(pairs, num_labels + 1)
+        keep = counts > MERGE_FRACTION * piece_sizes[pieces]
+        # Every piece mostly covered by the same tile cell belongs to one cell
+        first_piece = {}
+        for local_id, piece in zip(local_ids[keep], pieces[keep]):
+            if local_id in first_piece:
+                root_a, root_b = find(first_piece[local_id]), find(piece)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+            else:
+                first_piece[local_id] = piece
+
+    # Consecutive ids for the roots of the labels present in the image, background stays 0
+    roots = np.array([find(label) for label in range(num_labels + 1)])
+    used = np.zeros(num_labels + 1, dtype=bool)
+    used[roots[np.bincount(labels.ravel(), minlength=num_labels + 1) > 0]] = True
+    used[0] = True
+    lut = (np.cumsum(used) - 1).astype(np.int32)
+    return lut[roots][labels]
+
+
+def segment_tiled(image_arr, model_type, diameter, flow_threshold, use_gpu, tile_size=TILE_SIZE, overlap=TILE_OVERLAP,
+                  num_workers=None, torch_threads=1, progress=None, is_cancelled=None):
+    # Output: numpy.ndarray(H, W) of int32 labels for the whole image
+    grid = tile_grid(image_arr.shape, tile_size, overlap)
+    num_workers = num_workers or max(1, (os.cpu_count() or 1) // max(1, torch_threads))
+    tile_masks = [None] * len(grid)
+
+    def report_tile(done):
+        _report(progress, 10 + 60 * done / len(grid), f"Running Cellpose (tile {done}/{len(grid)})")
+
+    report_tile(0)
+    if use_gpu or num_workers == 1 or len(grid) == 1:
+        # A single GPU is shared by all tiles, run them one by one in this process
+        for i, ((y0, y1, x0, x1), _) in enumerate(grid):
+            _check(is_cancelled)
+            tile_masks[i] = eval_tile(image_arr[y0:y1, x0:x1], model_type, diameter, flow_threshold, use_gpu)
+            report_tile(i + 1)
+    else:
+        executor = tile_pool(num_workers, torch_threads)
+        futures = {executor.submit(eval_tile, np.ascontiguousarray(image_arr[y0:y1, x0:x1]), model_type, diameter, flow_threshold, use_gpu): i
+                   for i, ((y0, y1, x0, x1), _) in enumerate(grid)}
+        for future in futures:
+            _tile_futures.add(future)
+            future.add_done_callback(_tile_futures.discard)
+        pending = set(futures)
+        try:
+            while pending:
+                # The timeout lets a cancellation return without waiting for a whole tile
+                finished, pending = concurrent.futures.wait(pending, timeout=CANCEL_POLL_INTERVAL, return_when=concurrent.futures.FIRST_COMPLETED)
+                _check(is_cancelled)
+                for future in finished:
+                    tile_masks[futures[future]] = future.result()
+                if finished:
+                    report_tile(len(futures) - len(pending))
+        except Cancelled:
+            for future in futures:
+                future.cancel()
+            raise
+    _check(is_cancelled)
+    _report(progress, 70, "Stitching tiles")
+    return stitch_tiles(image_arr.shape[:2], grid, tile_masks)
+
+
+def segment(image_arr, model_type, diameter, flow_threshold, do_3D, use_gpu, progress=None, is_cancelled=None, tiled=False,
+            tile_size=TILE_SIZE, overlap=TILE_OVERLAP, num_workers=None, torch_threads=1,
+            simplify_tolerance=polygon_simplify.DEFAULT_TOLERANCE):
+    # Output: ([numpy.ndarray(N, 2), ...] contours in real scale, [label id of masks without a contour, ...])
+    # tiled is ignored for 3D segmentation and for images that fit in one tile
+    if tiled and not do_3D and max(image_arr.shape[:2]) > tile_size:
+        masks = segment_tiled(image_arr, model_type, diameter, flow_threshold, use_gpu, tile_size, overlap,
+                              num_workers, torch_threads, progress, is_cancelled)
+    else:
+        if (model_type, bool(use_gpu)) in MODEL_CACHE:
+            _report(progress, 0, f"Using cached model ({model_type})")
+        else:
+            _report(progress, 0, f"Loading model ({model_type})")
+        model = MODEL_CACHE.get(model_type, use_gpu)
+        _check(is_cancelled)
+        _report(progress, 10, "Running Cellpose")
+        masks, _, _, _ = model.eval(image_arr, diameter=diameter, channels=[0, 0], flow_threshold=flow_threshold, do_3D=do_3D)
+    _check(is_cancelled)
+    _report(progress, 70, "Extracting contours")
+    contours, failed = masks_to_contours(masks, progress, is_cancelled, progress_range=(70, 100))
+    # Every boundary pixel is a vertex until simplified
+    contours = polygon_simplify.simplify_polygons(contours, simplify_tolerance)
+    _report(progress, 100, f"Found {len(contours)} contours")
+    return contours, failed
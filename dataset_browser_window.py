@@ -0,0 +1,98 @@
+"""
+Thumbnail grid of the images of the opened dataset folder.
+
+Thumbnails come from the persistent ThumbnailCache: those already cached are
+shown at once (icons are read from disk only when they scroll into view) and
+the missing ones are generated by worker processes in the background, so a
+folder scanned before opens in seconds.
+"""
+
+import os
+from PyQt5 import *
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+
+# Custom modules
+import background_worker
+import thumbnail_cache
+
+ICON_SIZE = 160
+
+
+class DatasetBrowserWindow(QMainWindow):
+    image_selected_signal = pyqtSignal(int)  # Index of the image in the dataset
+
+    def __init__(self, image_dirs, cache=None):
+        super(DatasetBrowserWindow, self).__init__()
+        self.image_dirs = image_dirs
+        self.cache = cache if cache is not None else thumbnail_cache.ThumbnailCache()
+        self.rows = {image_dir: row for row, image_dir in enumerate(image_dirs)}
+        self.worker = None
+        self.setWindowTitle('Dataset')
+        self.resize(900, 700)
+        self.build_gui()
+        self.fill_thumbnails()
+
+    def build_gui(self):
+        base_widget = QWidget(self)
+        self.setCentralWidget(base_widget)
+        main_v_layout = QVBoxLayout()
+        base_widget.setLayout(main_v_layout)
+
+        self.thumbnail_list = QListWidget()
+        self.thumbnail_list.setViewMode(QListView.IconMode)
+        self.thumbnail_list.setIconSize(QSize(ICON_SIZE, ICON_SIZE))
+        self.thumbnail_list.setResizeMode(QListView.Adjust)
+        self.thumbnail_list.setMovement(QListView.Static)
+        self.thumbnail_list.setUniformItemSizes(True)
+        self.thumbnail_list.setWordWrap(True)
+        self.thumbnail_list.itemActivated.connect(lambda item: self.image_selected_signal.emit(self.thumbnail_list.row(item)))
+        main_v_layout.addWidget(self.thumbnail_list)
+
+        self.status_label = QLabel()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        main_v_layout.addWidget(self.status_label)
+        main_v_layout.addWidget(self.progress_bar)
+
+    def fill_thumbnails(self):
+        for image_dir in self.image_dirs:
+            item = QListWidgetItem(os.path.basename(image_dir))
+            item.setToolTip(image_dir)
+            thumbnail_dir = self.cache.cached_path(image_dir)
+            if thumbnail_dir is not None:
+                item.setIcon(QIcon(thumbnail_dir))  # Loaded on demand by Qt
+            self.thumbnail_list.addItem(item)
+        missing = self.cache.missing(self.image_dirs)
+        if len(missing) == 0:
+            self.progress_bar.hide()
+            return
+        self.status_label.setText(f"Generating {len(missing)} thumbnail(s)...")
+        self.worker = background_worker.ProgressWorker(self.cache.generate, missing)
+        self.worker.progress_signal.connect(self.thumbnail_ready)
+        self.worker.result_signal.connect(self.finish_thumbnails)
+        self.worker.error_signal.connect(self.status_label.setText)
+        self.worker.start()
+
+    def thumbnail_ready(self, percent, image_dir):
+        # Input: image_dir = image whose thumbnail was just written
+        self.progress_bar.setValue(percent)
+        thumbnail_dir = self.cache.cached_path(image_dir)
+        if thumbnail_dir is not None:
+            self.thumbnail_list.item(self.rows[image_dir]).setIcon(QIcon(thumbnail_dir))
+
+    def finish_thumbnails(self, failed):
+        self.progress_bar.hide()
+        self.status_label.setText(f"{len(failed)} image(s) could not be read" if failed else "")
+        for image_dir, error in failed.items():
+            self.thumbnail_list.item(self.rows[image_dir]).setToolTip(f"{image_dir}\n{error}")
+
+    def set_current(self, index):
+        if 0 <= index < self.thumbnail_list.count():
+            self.thumbnail_list.setCurrentRow(index)
+
+    def closeEvent(self, event):
+        if self.worker is not None:
+            self.worker.cancel()
+        super(DatasetBrowserWindow, self).closeEvent(event)
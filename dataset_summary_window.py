@@ -0,0 +1,80 @@
+from PyQt5 import *
+from PyQt5.QtWidgets import *
+from PyQt5.QtCore import *
+
+# Custom modules
+import marking_store
+
+ALL_TYPES = "All Types"
+
+
+class DatasetSummaryWindow(QMainWindow):
+    # Label statistics of every image of the annotation database, and the images containing a label
+    image_selected_signal = pyqtSignal(str)  # Path of the image
+
+    def __init__(self, annotation_db):
+        super(DatasetSummaryWindow, self).__init__()
+        self.annotation_db = annotation_db
+        self.setWindowTitle('Dataset Summary')
+        self.resize(800, 600)
+        self.build_gui()
+        self.refresh()
+
+    def build_gui(self):
+        base_widget = QWidget(self)
+        self.setCentralWidget(base_widget)
+        main_v_layout = QVBoxLayout()
+        base_widget.setLayout(main_v_layout)
+
+        type_h_layout = QHBoxLayout()
+        self.type_drop_down = QComboBox()
+        self.type_drop_down.addItems([ALL_TYPES] + list(marking_store.MARKING_TYPES))
+        self.type_drop_down.currentIndexChanged.connect(self.refresh)
+        type_h_layout.addWidget(QLabel("Marking Type"))
+        type_h_layout.addWidget(self.type_drop_down)
+        type_h_layout.addStretch()
+        main_v_layout.addLayout(type_h_layout)
+
+        # Label summary table
+        self.label_summary_table = QTableWidget()
+        self.label_summary_table.setColumnCount(5)
+        self.label_summary_table.setHorizontalHeaderLabels(["Label", "Count", "Images", "Area (px)", "Coverage"])
+        self.label_summary_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.label_summary_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.label_summary_table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.label_summary_table.itemSelectionChanged.connect(self.find_images)
+        main_v_layout.addWidget(self.label_summary_table)
+
+        # Images containing the selected label
+        self.image_list_label = QLabel("Select a label to list the images containing it")
+        self.image_list = QListWidget()
+        self.image_list.itemActivated.connect(lambda item: self.image_selected_signal.emit(item.data(Qt.UserRole)))
+        main_v_layout.addWidget(self.image_list_label)
+        main_v_layout.addWidget(self.image_list)
+
+    def marking_type(self):
+        marking_type = self.type_drop_down.currentText()
+        return None if marking_type == ALL_TYPES else marking_type
+
+    def refresh(self):
+        summary = self.annotation_db.label_summary(self.marking_type())
+        self.label_summary_table.clearContents()
+        self.label_summary_table.setRowCount(len(summary))
+        for row, (label, count, num_images, area, coverage) in enumerate(summary):
+            values = [label, str(count), str(num_images), f"{area:.0f}", f"{100 * coverage:.2f}%" if coverage is not None else "-"]
+            for column, value in enumerate(values):
+                self.label_summary_table.setItem(row, column, QTableWidgetItem(value))
+        self.image_list.clear()
+
+    def find_images(self):
+        rows = self.label_summary_table.selectionModel().selectedRows()
+        self.image_list.clear()
+        if len(rows) == 0:
+            return
+        label = self.label_summary_table.item(rows[0].row(), 0).text()
+        images = self.annotation_db.images_with_label(label, self.marking_type())
+        self.image_list_label.setText(f"{len(images)} image(s) containing {label}")
+        for path, count in images:
+            item = QListWidgetItem(f"{path} ({count})")
+            item.setData(Qt.UserRole, path)
+            self.image_list.addItem(item)
@@ -0,0 +1,260 @@
+"""
+Undo/redo history of the marking edits (no Qt dependency).
+
+The history listens to the change notifications of a MarkingStore and turns
+each change into a small command holding only its delta: the index range of
+added markings, a copy of the removed markings, the previous points of
+reshaped markings, or the previous label codes / visibility flags. Hundreds of
+steps cost about the size of the markings they touch instead of a copy of the
+canvas per step. Changes made inside group() form a single step.
+"""
+
+import contextlib
+import numpy as np
+
+# Custom modules
+import marking_store
+
+DEFAULT_MAX_DEPTH = 200
+
+
+##########################################################################
+## Commands ##############################################################
+##########################################################################
+class AddMarkings:
+    name = "Add Markings"
+
+    def __init__(self, indices):
+        self.indices = indices  # Range of the added markings
+        self.markings = None  # Copy kept only while the command is undone, for redo
+
+    def undo(self, store):
+        self.markings = store.subset(self.indices)
+        store.delete(np.arange(self.indices[0], self.indices[-1] + 1))
+
+    def redo(self, store):
+        store.append_store(self.markings)
+        self.markings = None
+
+    def nbytes(self):
+        return 0 if self.markings is None else store_nbytes(self.markings)
+
+
+class RemoveMarkings:
+    name = "Delete Markings"
+
+    def __init__(self, indices, markings):
+        self.indices = indices  # Indices before removal
+        self.markings = markings  # Copy of the removed markings
+
+    def undo(self, store):
+        store.insert_store(self.indices, self.markings)
+
+    def redo(self, store):
+        store.delete(self.indices)
+
+    def nbytes(self):
+        return self.indices.nbytes + store_nbytes(self.markings)
+
+
+class ClearMarkings(RemoveMarkings):
+    name = "Clear Markings"
+
+    def redo(self, store):
+        store.clear()
+
+
+class ReplacePoints:
+    name = "Reshape Markings"
+
+    def __init__(self, indices, polygons):
+        self.indices = indices
+        self.polygons = polygons  # Points before the change, swapped with the current points on undo/redo
+
+    def swap(self, store):
+        polygons = [store.points(index).copy() for index in self.indices.tolist()]
+        store.replace_points(self.indices, self.polygons)
+        self.polygons = polygons
+
+    undo = redo = swap
+
+    def nbytes(self):
+        return self.indices.nbytes + sum(polygon.nbytes for polygon in self.polygons)
+
+
+class ChangeLabels:
+    name = "Change Labels"
+
+    def __init__(self, indices, codes):
+        self.indices = indices
+        self.codes = codes  # Label codes before the change (codes stay valid, the vocabulary only grows)
+
+    def swap(self, store):
+        codes = store.label_codes[self.indices].copy()
+        store.set_label_codes(self.indices, self.codes)
+        self.codes = codes
+
+    undo = redo = swap
+
+    def nbytes(self):
+        return self.indices.nbytes + self.codes.nbytes
+
+
+class ChangeVisibility:
+    name = "Change Visibility"
+
+    def __init__(self, indices, flags):
+        self.indices = indices
+        self.flags = flags  # Visibility flags before the change
+
+    def swap(self, store):
+        flags = store.flags[self.indices].copy()
+        store.set_flags(self.indices, self.flags)
+        self.flags = flags
+
+    undo = redo = swap
+
+    def nbytes(self):
+        return self.indices.nbytes + self.flags.nbytes
+
+
+class CommandGroup:
+    def __init__(self, name, commands):
+        self.name = name
+        self.commands = commands
+
+    def undo(self, store):
+        for command in reversed(self.commands):
+            command.undo(store)
+
+    def redo(self, store):
+        for command in self.commands:
+            command.redo(store)
+
+    def nbytes(self):
+        return sum(command.nbytes() for command in self.commands)
+
+
+def store_nbytes(store):
+    return store.coords.nbytes + store.offsets.nbytes + store.type_codes.nbytes + store.label_codes.nbytes + store.flags.nbytes
+
+
+##########################################################################
+## History ###############################################################
+##########################################################################
+class EditHistory:
+    def __init__(self, store, max_depth=DEFAULT_MAX_DEPTH):
+        self.store = store
+        self.max_depth = max_depth
+        self.undo_stack = []
+        self.redo_stack = []
+        self._replaying = False  # Changes made by undo/redo are not recorded again
+        self._group = None  # (name, [command, ...]) while inside group()
+        self._pending = None  # Command waiting for the "after" notification of its change
+        self.store.add_listener(self.on_markings_changed)
+
+    def set_max_depth(self, max_depth):
+        self.max_depth = max(1, int(max_depth))
+        self.trim()
+
+    def trim(self):
+        del self.undo_stack[:max(0, len(self.undo_stack) - self.max_depth)]
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    def can_undo(self):
+        return len(self.undo_stack) > 0
+
+    def can_redo(self):
+        return len(self.redo_stack) > 0
+
+    def undo_name(self):
+        return self.undo_stack[-1].name if self.undo_stack else None
+
+    def redo_name(self):
+        return self.redo_stack[-1].name if self.redo_stack else None
+
+    def nbytes(self):
+        # Memory held by the commands of both stacks
+        return sum(command.nbytes() for command in self.undo_stack + self.redo_stack)
+
+    ##########################################################################
+    ## Recording #############################################################
+    ##########################################################################
+    @contextlib.contextmanager
+    def group(self, name):
+        # Every change made inside the block is undone in one step
+        if self._group is not None:
+            yield
+            return
+        self._group = (name, [])
+        try:
+            yield
+        finally:
+            name, commands = self._group
+            self._group = None
+            if len(commands) == 1:
+                self.push(commands[0])
+            elif len(commands) > 1:
+                self.push(CommandGroup(name, commands))
+
+    def push(self, command):
+        if self._group is not None:
+            self._group[1].append(command)
+            return
+        self.undo_stack.append(command)
+        self.redo_stack.clear()
+        self.trim()
+
+    def on_markings_changed(self, kind, indices):
+        # Old values are copied from the "about to" notifications, the command is recorded once the change is done
+        if self._replaying:
+            return
+        if kind == marking_store.ADDED and len(indices) > 0:
+            self.push(AddMarkings(indices))
+        elif kind == marking_store.ABOUT_TO_REMOVE:
+            self._pending = RemoveMarkings(np.asarray(indices, dtype=np.int64).copy(), self.store.subset(indices))
+        elif kind == marking_store.ABOUT_TO_CLEAR and len(indices) > 0:
+            self._pending = ClearMarkings(np.arange(len(indices)), self.store.copy())
+        elif kind == marking_store.ABOUT_TO_UPDATE:
+            indices = np.asarray(indices, dtype=np.int64).copy()
+            self._pending = ReplacePoints(indices, [self.store.points(index).copy() for index in indices.tolist()])
+        elif kind == marking_store.ABOUT_TO_CHANGE_LABELS:
+            indices = np.asarray(indices, dtype=np.int64).copy()
+            self._pending = ChangeLabels(indices, self.store.label_codes[indices].copy())
+        elif kind == marking_store.ABOUT_TO_CHANGE_VISIBILITY:
+            indices = np.asarray(indices, dtype=np.int64).copy()
+            self._pending = ChangeVisibility(indices, self.store.flags[indices].copy())
+        elif kind in (marking_store.REMOVED, marking_store.CLEARED, marking_store.UPDATED,
+                      marking_store.LABELS_CHANGED, marking_store.VISIBILITY_CHANGED) and self._pending is not None:
+            self.push(self._pending)
+            self._pending = None
+
+    ##########################################################################
+    ## Undo / Redo ###########################################################
+    ##########################################################################
+    def undo(self):
+        # Output: name of the undone step, None if there was nothing to undo
+        if not self.undo_stack:
+            return None
+        command = self.undo_stack.pop()
+        self._replay(command.undo)
+        self.redo_stack.append(command)
+        return command.name
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        command = self.redo_stack.pop()
+        self._replay(command.redo)
+        self.undo_stack.append(command)
+        return command.name
+
+    def _replay(self, action):
+        self._replaying = True
+        try:
+            action(self.store)
+        finally:
+            self._replaying = False
@@ -1,17 +1,15 @@
 from PyQt5 import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
-import json
-import cv2
-import numpy as np
-import matplotlib.pyplot as plt
 
+import annotation_export
+import marking_store
 import marking_summary_window
 
 class ExportOptionWindow(QMainWindow):
-    def __init__(self, marking_info, orig_dim, display_dim, img_orig_dir):
+    def __init__(self, marking_store, orig_dim, display_dim, img_orig_dir):
         super(ExportOptionWindow, self).__init__()
-        self.marking_info = marking_info
+        self.marking_store = marking_store
         self.orig_dim = orig_dim  # (Width, Height)
         self.display_dim = display_dim  # (Width, Height)
         self.image_scaled_ratio = self.orig_dim[0] / self.display_dim[0]
@@ -44,9 +42,20 @@ class ExportOptionWindow(QMainWindow):
         contour_export_option_group.setMinimumWidth(320)
         contour_export_option_v_layout = QVBoxLayout()
         self.contour_export_points_checkbox = QCheckBox("Export Points (.JSON)")
-        self.contour_export_mask_checkbox = QCheckBox("Export Mask (.NPY)")
+        self.contour_export_mask_checkbox = QCheckBox("Export Mask per Label (.NPZ)")
+        self.contour_export_mask_bit_packed_checkbox = QCheckBox("Bit-packed Mask")
+        self.contour_export_mask_bit_packed_checkbox.setChecked(True)
+        self.contour_export_instance_map_checkbox = QCheckBox("Export Instance Map (.NPZ)")
+        self.contour_export_instance_png_checkbox = QCheckBox("Export Instance Map (16-bit .PNG)")
+        self.contour_export_coco_rle_checkbox = QCheckBox("Export as COCO RLE (.JSON)")
+        self.contour_export_yolo_seg_checkbox = QCheckBox("Export as YOLO segmentation (.TXT)")
         contour_export_option_v_layout.addWidget(self.contour_export_points_checkbox)
         contour_export_option_v_layout.addWidget(self.contour_export_mask_checkbox)
+        contour_export_option_v_layout.addWidget(self.contour_export_mask_bit_packed_checkbox)
+        contour_export_option_v_layout.addWidget(self.contour_export_instance_map_checkbox)
+        contour_export_option_v_layout.addWidget(self.contour_export_instance_png_checkbox)
+        contour_export_option_v_layout.addWidget(self.contour_export_coco_rle_checkbox)
+        contour_export_option_v_layout.addWidget(self.contour_export_yolo_seg_checkbox)
         contour_export_option_group.setLayout(contour_export_option_v_layout)
 
         contour_as_b_box_export_option_group = QGroupBox("Contour as Bounding Box")
@@ -70,6 +79,10 @@ class ExportOptionWindow(QMainWindow):
         b_box_export_option_group.setLayout(b_box_export_option_v_layout)
 
         other_export_option_group = QGroupBox("Other")
+        other_export_option_v_layout = QVBoxLayout()
+        self.export_npz_checkbox = QCheckBox("Export All Markings (.NPZ)")
+        other_export_option_v_layout.addWidget(self.export_npz_checkbox)
+        other_export_option_group.setLayout(other_export_option_v_layout)
 
         export_option_v_layout.addWidget(contour_export_option_group)
         export_option_v_layout.addWidget(contour_as_b_box_export_option_group)
@@ -119,11 +132,11 @@ class ExportOptionWindow(QMainWindow):
         main_v_layout.addLayout(button_h_layout)
 
     def fill_table(self):
-        for i in range(0, len(self.marking_info)):
+        for i in range(0, len(self.marking_store)):
             marking_type = QLabel()
-            marking_type.setText(str(self.marking_info[i][0]))
+            marking_type.setText(self.marking_store.marking_type(i))
             marking_label = QLineEdit()
-            marking_label.setText(str(self.marking_info[i][1]))
+            marking_label.setText(self.marking_store.label(i))
 
             self.marking_info_table.insertRow(self.marking_info_table.rowCount())
             self.marking_info_table.setCellWidget(self.marking_info_table.rowCount() - 1, 0, marking_type)
@@ -136,176 +149,45 @@ class ExportOptionWindow(QMainWindow):
         self.export_button.setEnabled(True)
 
     def export_with_option(self):
+        # All checked formats are written in one pass, each to its own file
+        formats = []
+        yolo_types = []
         # Contour
         if self.contour_export_points_checkbox.isChecked():
-            self.export_contour_as_point()
+            formats.append("contour_points")
         if self.contour_export_mask_checkbox.isChecked():
-            self.export_contour_as_mask()
+            formats.append("mask")
+        if self.contour_export_yolo_seg_checkbox.isChecked():
+            formats.append("yolo_seg")
+        if self.contour_export_instance_map_checkbox.isChecked():
+            formats.append("instance_map")
+        if self.contour_export_instance_png_checkbox.isChecked():
+            formats.append("instance_png")
+        if self.contour_export_coco_rle_checkbox.isChecked():
+            formats.append("coco_rle")
         # Contour as Bounding Box
         if self.contour_as_b_box_export_exact_corners.isChecked():
-            self.export_contour_as_b_box_exact_corners()
+            formats.append("contour_corners")
         if self.contour_as_b_box_export_yolo_format.isChecked():
-            self.export_contour_as_b_box_in_yolo_format()
+            yolo_types.append("Contour")
         # Bounding Box
         if self.b_box_export_exact_corners.isChecked():
-            self.export_b_box_as_exact_corners()
+            formats.append("box_corners")
         if self.b_box_export_yolo_format.isChecked():
-            self.export_b_box_in_yolo_format()
-        if self.b_box_export_mask:
-            pass
-
-    def contour_to_box(self, points):
-        # Input: [POINT1, POINT2, POINT3, ...]
-        # Output: [CORNER1, CORNER2]
-        max_x = points[0].x()
-        min_x = points[0].x()
-        max_y = points[0].y()
-        min_y = points[0].y()
-        for i in range(1, len(points)):
-            if points[i].x() > max_x:
-                max_x = points[i].x()
-            if points[i].x() < min_x:
-                min_x = points[i].x()
-            if points[i].y() > max_y:
-                max_y = points[i].y()
-            if points[i].y() < min_y:
-                min_y = points[i].y()
-        b_box = [QPoint(min_x, min_y), QPoint(max_x, max_y)]
-        return b_box
-
-    def export_contour_as_b_box_in_yolo_format(self):
-        # Input: [[TYPE, LABEL, [CORNER1, CORNER2]], ...]
-        # Output (YOLO): LABEL X_CENTER_NORM Y_CENTER_NORM WIDTH_NORM HEIGHT_NORM
-        output_string = ""
-        for i in range(0, len(self.marking_info)):
-            if self.marking_info[i][0] == "Contour":
-                points_as_corners = self.contour_to_box(self.marking_info[i][2])
-                label = self.marking_info[i][1]
-                corner1 = points_as_corners[0]
-                corner2 = points_as_corners[1]
-                corner1_x = corner1.x()
-                corner1_y = corner1.y()
-                corner2_x = corner2.x()
-                corner2_y = corner2.y()
-                x_center_norm = ((corner1_x + corner2_x) / 2) / self.orig_dim[0]
-                y_center_norm = ((corner1_y + corner2_y) / 2) / self.orig_dim[1]
-                width_norm = (corner2_x - corner1_x) / self.orig_dim[0]
-                height_norm = (corner2_y - corner1_y) / self.orig_dim[1]
-                output_string += f"{label} {x_center_norm} {y_center_norm} {width_norm} {height_norm}\n"
-            else:
-                pass
-        if output_string != "":
-            output_string = output_string[:-1]  # For removing the \n at the end of the string
-            save_file_name = self.file_name_fill_box.text()
-            with open(f"{self.export_directory_path}/{save_file_name}.txt", "w") as text_file:
-                text_file.write(output_string)
-
-    def export_contour_as_b_box_exact_corners(self):
-        point_label_pair_dict = {}
-        for i in range(0, len(self.marking_info)):
-            if self.marking_info[i][0] == "Contour":
-                points_as_corners = self.contour_to_box(self.marking_info[i][2])
-                points_ready = []
-                for j in range(0, len(points_as_corners)):
-                    points_ready.append([min([int(points_as_corners[j].x()), int(self.orig_dim[0]) - 1]),
-                                         min([int(points_as_corners[j].y()), int(self.orig_dim[1]) - 1])])
-                if self.marking_info[i][1] not in point_label_pair_dict.keys():
-                    point_label_pair_dict[self.marking_info[i][1]] = [points_ready]
-                else:
-                    point_label_pair_dict[self.marking_info[i][1]].append(points_ready)
-        save_file_name = self.file_name_fill_box.text()
-        save_as_json = open(f"{self.export_directory_path}/{save_file_name}.json", "w")
-        json.dump(point_label_pair_dict, save_as_json, indent=4)
-        save_as_json.close()
-
-    def export_b_box_as_exact_corners(self):
-        point_label_pair_dict = {}
-        for i in range(0, len(self.marking_info)):
-            if self.marking_info[i][0] == "Bounding Box":
-                points_ready = []
-                for j in range(0, len(self.marking_info[i][2])):
-                    points_ready.append([min([int(self.marking_info[i][2][j].x()), int(self.orig_dim[0]) - 1]),
-                                         min([int(self.marking_info[i][2][j].y()), int(self.orig_dim[1]) - 1])])
-                if self.marking_info[i][1] not in point_label_pair_dict.keys():
-                    point_label_pair_dict[self.marking_info[i][1]] = [points_ready]
-                else:
-                    point_label_pair_dict[self.marking_info[i][1]].append(points_ready)
-        save_file_name = self.file_name_fill_box.text()
-        save_as_json = open(f"{self.export_directory_path}/{save_file_name}.json", "w")
-        json.dump(point_label_pair_dict, save_as_json, indent=4)
-        save_as_json.close()
-
-    def export_b_box_in_yolo_format(self):
-        # Input: [[TYPE, LABEL, [CORNER1, CORNER2]], ...]
-        # Output (YOLO): LABEL X_CENTER_NORM Y_CENTER_NORM WIDTH_NORM HEIGHT_NORM
-        output_string = ""
-        for i in range(0, len(self.marking_info)):
-            if self.marking_info[i][0] == "Bounding Box":
-                label = self.marking_info[i][1]
-                corner1 = self.marking_info[i][2][0]
-                corner2 = self.marking_info[i][2][1]
-                corner1_x = corner1.x()
-                corner1_y = corner1.y()
-                corner2_x = corner2.x()
-                corner2_y = corner2.y()
-                x_center_norm = ((corner1_x + corner2_x) / 2) / self.orig_dim[0]
-                y_center_norm = ((corner1_y + corner2_y) / 2) / self.orig_dim[1]
-                width_norm = (corner2_x - corner1_x) / self.orig_dim[0]
-                height_norm = (corner2_y - corner1_y) / self.orig_dim[1]
-                output_string += f"{label} {x_center_norm} {y_center_norm} {width_norm} {height_norm}\n"
-            else:
-                pass
-        if output_string != "":
-            save_file_name = self.file_name_fill_box.text()
-            output_string = output_string[:-1]  # For removing the \n at the end of the string
-            with open(f"{self.export_directory_path}/{save_file_name}.txt", "w") as text_file:
-                text_file.write(output_string)
-
-    def export_contour_as_point(self):
-        #label_set = list(set([self.marking_info[i][1] for i in range(0, len(self.marking_info)) if self.marking_info[i][0] == "Contour"]))
-        point_label_pair_dict = {}
-        for i in range(0, len(self.marking_info)):
-            if self.marking_info[i][0] == "Contour":
-                points_ready = []
-                for j in range(0, len(self.marking_info[i][2])):
-                    points_ready.append([min([int(self.marking_info[i][2][j].x()), int(self.orig_dim[0]) - 1]),
-                                         min([int(self.marking_info[i][2][j].y()), int(self.orig_dim[1]) - 1])])
-                if self.marking_info[i][1] not in point_label_pair_dict.keys():
-                    point_label_pair_dict[self.marking_info[i][1]] = [points_ready]
-                else:
-                    point_label_pair_dict[self.marking_info[i][1]].append(points_ready)
-        save_file_name = self.file_name_fill_box.text()
-        save_as_json = open(f"{self.export_directory_path}/{save_file_name}.json", "w")
-        json.dump(point_label_pair_dict, save_as_json, indent=4)
-        save_as_json.close()
-
-    def export_contour_as_mask(self):
-        # Input: [[TYPE, LABEL, [POINT1, POINT2, POINT3, ...]], ...]
-        # Output: numpy.ndarray(Number of classes/labels, Mask)
-        label_set = list(set([self.marking_info[i][1] for i in range(0, len(self.marking_info)) if self.marking_info[i][0] == "Contour"]))
-        num_labels = len(label_set)
-        mask_npy = np.zeros((int(self.orig_dim[1]), int(self.orig_dim[0]), num_labels))
-        for i in range(0, len(self.marking_info)):
-            if self.marking_info[i][0] == "Contour":
-                points_ready = []
-                for j in range(0, len(self.marking_info[i][2])):
-                    points_ready.append([min([int(self.marking_info[i][2][j].x()), int(self.orig_dim[0]) - 1]),
-                                         min([int(self.marking_info[i][2][j].y()), int(self.orig_dim[1]) - 1])])
-                points_ready = np.array(points_ready)
-                point_specific_label = self.marking_info[i][1]
-                index = label_set.index(point_specific_label)
-                mask_temp = mask_npy[:, :, index]
-                cv2.fillPoly(mask_temp, [points_ready], (1))
-                plt.imshow(mask_temp)
-                plt.show()
-                mask_npy[:, :, index] = mask_temp
-            else:
-                pass
-        save_file_name = self.file_name_fill_box.text()
-        np.save(f"{self.export_directory_path}/{save_file_name}.npy", mask_npy)
+            yolo_types.append("Bounding Box")
+        if yolo_types:
+            formats.append("yolo")
+        # Other
+        if self.export_npz_checkbox.isChecked():
+            formats.append("npz")
+        try:
+            annotation_export.export_annotations(self.marking_store, self.export_directory_path, self.file_name_fill_box.text(),
+                                                 self.orig_dim, formats, yolo_types, self.contour_export_mask_bit_packed_checkbox.isChecked())
+        except (OSError, ValueError) as error:  # Unwritable folder, full disk or invalid option
+            QMessageBox.warning(self, "Export", str(error))
 
     def open_summary_window(self):
-        self.summary_window = marking_summary_window.MarkingSummaryWindow(self.marking_info)
+        self.summary_window = marking_summary_window.MarkingSummaryWindow(self.marking_store)
         self.summary_window.show()
 
 # For testing only
@@ -313,6 +195,9 @@ if __name__ == '__main__':
     import sys
     import PyQt5
     app = PyQt5.QtWidgets.QApplication(sys.argv)
-    window = ExportOptionWindow([["Contour", "LABEL1"], ["Bounding Box", "LABEL2"]], (700, 700), (700, 700), "XXX/img1.png")
+    store = marking_store.MarkingStore()
+    store.append("Contour", "LABEL1", [[10, 10], [50, 10], [30, 40]])
+    store.append("Bounding Box", "LABEL2", [[100, 100], [200, 150]])
+    window = ExportOptionWindow(store, (700, 700), (700, 700), "XXX/img1.png")
     window.show()
     sys.exit(app.exec_())
\ No newline at end of file
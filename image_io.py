@@ -0,0 +1,147 @@
+"""
+Image loading for the GUI and the scripts (no Qt dependency).
+
+TIFF files are memory-mapped when they are stored uncompressed, so only the
+rows being processed are read from disk. The min/max normalization statistics
+are computed in a streaming pass and the uint8 display image is written strip
+by strip, into a temporary memory-mapped file when it is too large to keep in
+RAM. Peak memory is therefore a few strips instead of several float64 copies
+of the whole image.
+"""
+
+import collections
+import os
+import tempfile
+import numpy as np
+import cv2
+from PIL import Image
+
+try:
+    import tifffile
+except ImportError:  # tifffile comes with cellpose, fall back to OpenCV without it
+    tifffile = None
+
+TIFF_FORMATS = ["tif", "TIF", "tiff", "TIFF"]
+IMAGE_FORMATS = ["png", "PNG", "jpg", "JPG", "jpeg", "JPEG", "bmp", "BMP"] + TIFF_FORMATS
+STRIP_PIXELS = 2 * 1024 * 1024  # Pixels normalized at a time (float64 strips)
+MEMMAP_OUTPUT_BYTES = 1024 * 1024 * 1024  # Larger outputs are backed by a temporary file
+
+
+def open_tiff(image_dir):
+    # Output: (array, channel order), array is a read-only memory map whenever possible
+    if tifffile is not None:
+        try:
+            image = tifffile.memmap(image_dir, mode="r")
+        except (ValueError, OSError):
+            # Compressed or non-contiguous TIFF, decode it once
+            image = tifffile.imread(image_dir)
+        # Planar configuration (C, H, W) -> (H, W, C) view
+        if image.ndim == 3 and image.shape[0] in (3, 4) and image.shape[2] not in (3, 4):
+            image = np.moveaxis(image, 0, -1)
+        return image, "RGB"
+    return cv2.imread(image_dir, -1), "BGR"
+
+
+def rows_per_strip(image):
+    return max(1, STRIP_PIXELS // max(1, image.shape[1]))
+
+
+def min_max_chunked(image, strip_rows=None):
+    # Streaming min/max over the rows of the image (and its first 3 channels)
+    strip_rows = strip_rows or rows_per_strip(image)
+    imin, imax = None, None
+    for row in range(0, image.shape[0], strip_rows):
+        strip = image[row:row + strip_rows]
+        if strip.ndim == 3:
+            strip = strip[:, :, 0:3]
+        strip_min, strip_max = strip.min(), strip.max()
+        imin = strip_min if imin is None else min(imin, strip_min)
+        imax = strip_max if imax is None else max(imax, strip_max)
+    return imin, imax
+
+
+def allocate_output(shape, dtype=np.uint8, max_bytes=MEMMAP_OUTPUT_BYTES):
+    # Array in memory, or backed by an anonymous temporary file for very large images
+    if int(np.prod(shape)) * np.dtype(dtype).itemsize <= max_bytes:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode="w+", shape=shape)
+
+
+def process_tif(tif_image, channel_order="BGR", strip_rows=None):
+    # Input: TIFF array (H, W) or (H, W, C) of any dtype, possibly memory-mapped
+    # Output: numpy.ndarray(H, W, 3) of uint8 in RGB order, normalized by the global min/max
+    # Same arithmetic as normalizing the whole image at once: float inputs keep their precision, others use float64
+    work_dtype = tif_image.dtype if np.issubdtype(tif_image.dtype, np.floating) else np.dtype(np.float64)
+    strip_rows = strip_rows or rows_per_strip(tif_image)
+    imin, imax = min_max_chunked(tif_image, strip_rows)
+    imin, imax = work_dtype.type(imin), work_dtype.type(imax)
+    irange = abs(imax - imin)
+    output = allocate_output((tif_image.shape[0], tif_image.shape[1], 3))
+    for row in range(0, tif_image.shape[0], strip_rows):
+        strip = tif_image[row:row + strip_rows]
+        if strip.ndim == 2:
+            strip = strip[:, :, np.newaxis][:, :, [0, 0, 0]]
+        elif channel_order == "BGR":
+            strip = strip[:, :, [2, 1, 0]]
+        else:
+            strip = strip[:, :, 0:3]
+        if irange == 0:
+            # A constant image is not normalized, only scaled
+            output[row:row + strip_rows] = strip.astype(work_dtype) * 255.0
+        else:
+            output[row:row + strip_rows] = ((strip.astype(work_dtype) - imin) / irange) * 255.0
+    return output
+
+
+def list_images(input_dir):
+    # Output: sorted paths of the images in a folder (not recursive)
+    return sorted(os.path.join(input_dir, name) for name in os.listdir(input_dir) if name.split(".")[-1] in IMAGE_FORMATS)
+
+
+def output_name(image_dir):
+    # Output: file name without its extension ("a.b.png" -> "a.b"), used to name exported files
+    return os.path.splitext(os.path.basename(image_dir))[0]
+
+
+def output_names(image_dirs):
+    # Output: {image path: output name} without duplicates, images differing only by their extension keep it ("cell.png" -> "cell_png")
+    stem_counts = collections.Counter(output_name(image_dir) for image_dir in image_dirs)
+    names, used = {}, set()
+    for image_dir in image_dirs:
+        stem, extension = os.path.splitext(os.path.basename(image_dir))
+        name = stem if stem_counts[stem] == 1 else f"{stem}_{extension.lstrip('.')}"
+        unique_name, suffix = name, 2
+        while unique_name in used:  # Same base name in several folders
+            unique_name, suffix = f"{name}_{suffix}", suffix + 1
+        used.add(unique_name)
+        names[image_dir] = unique_name
+    return names
+
+
+def load_image(image_dir):
+    # Output: numpy.ndarray(H, W, C) ready for display (RGB, uint8 for TIFF)
+    if image_dir.split(".")[-1] in TIFF_FORMATS:
+        tif_image, channel_order = open_tiff(image_dir)
+        return process_tif(tif_image, channel_order)
+    image = np.array(Image.open(image_dir))
+    if image.ndim == 2:
+        image = np.stack((image, image, image), axis=2)
+    return image
+
+
+def load_thumbnail(image_dir, max_size):
+    # Output: numpy.ndarray(H, W, 3) of uint8 (RGB), longest side at most max_size, normalized like load_image
+    # Only a subsample of uncompressed TIFFs and a reduced JPEG decode are read
+    if image_dir.split(".")[-1] in TIFF_FORMATS:
+        tif_image, channel_order = open_tiff(image_dir)
+        step = max(1, max(tif_image.shape[:2]) // (2 * max_size))
+        image = process_tif(tif_image[::step, ::step], channel_order)
+    else:
+        with Image.open(image_dir) as pil_image:
+            pil_image.draft("RGB", (max_size, max_size))
+            image = np.asarray(pil_image.convert("RGB"))
+    scale = max_size / max(image.shape[:2])
+    if scale < 1:
+        size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+        image = cv2.resize(np.ascontiguousarray(image), size, interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(image)
@@ -0,0 +1,99 @@
+"""
+Background decoding of the images around the current one (no Qt dependency).
+
+A small thread pool runs the load function (decode, TIFF normalization,
+pyramid build) for the next images of a dataset while the current one is
+annotated. Loaded images are kept in a least recently used cache with a cap on
+the total number of bytes, so moving to a prefetched image is a dictionary
+lookup.
+"""
+
+import collections
+import concurrent.futures
+import threading
+
+MAX_WORKERS = 2
+DEFAULT_CACHE_BYTES = 1024 * 1024 * 1024
+
+
+def default_nbytes(value):
+    # Size of a loaded image, or of a tuple such as (image, pyramid)
+    if isinstance(value, (tuple, list)):
+        return sum(default_nbytes(item) for item in value)
+    if hasattr(value, "levels"):  # ImagePyramid, level 0 is the image itself
+        return sum(level.nbytes for level in value.levels[1:])
+    return getattr(value, "nbytes", 0)
+
+
+class ImagePrefetcher:
+    def __init__(self, load, max_workers=MAX_WORKERS, max_bytes=DEFAULT_CACHE_BYTES, nbytes=default_nbytes):
+        # Input: load = function(path) returning the loaded image, called in worker threads
+        self.load = load
+        self.max_bytes = max_bytes
+        self.nbytes = nbytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()  # Path -> (value, size)
+        self._pending = {}  # Path -> Future
+        self._lock = threading.RLock()  # Cancelling a future runs its done callback in the calling thread
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+
+    def get(self, path):
+        # Output: the loaded image, waiting for its prefetch or loading it now if it was not requested
+        with self._lock:
+            if path in self._cache:
+                self._cache.move_to_end(path)
+                self.hits += 1
+                return self._cache[path][0]
+            future = self._pending.get(path)
+            self.misses += 1
+        value = future.result() if future is not None else self.load(path)
+        self._store(path, value)
+        return value
+
+    def prefetch(self, paths):
+        # Input: paths in order of priority, requests for other paths that did not start yet are dropped
+        wanted = set(paths)
+        with self._lock:
+            for path in list(self._pending):
+                if path not in wanted and self._pending[path].cancel():
+                    self._pending.pop(path, None)
+            for path in paths:
+                if path not in self._cache and path not in self._pending:
+                    future = self._executor.submit(self.load, path)
+                    self._pending[path] = future
+                    future.add_done_callback(lambda future, path=path: self._finished(path, future))
+
+    def _finished(self, path, future):
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                if self._pending.get(path) is future:
+                    del self._pending[path]
+            return  # A failed prefetch is retried (and its error raised) by get()
+        self._store(path, future.result())
+
+    def _store(self, path, value):
+        with self._lock:
+            self._pending.pop(path, None)
+            if path not in self._cache:
+                size = self.nbytes(value)
+                self._cache[path] = (value, size)
+                self.num_bytes += size
+            self._cache.move_to_end(path)
+            # The most recent image is always kept, even when alone above the cap
+            while self.num_bytes > self.max_bytes and len(self._cache) > 1:
+                _, (_, size) = self._cache.popitem(last=False)
+                self.num_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            for future in list(self._pending.values()):
+                future.cancel()
+            self._pending.clear()
+            self._cache.clear()
+            self.num_bytes = 0
+
+    def shutdown(self):
+        self.clear()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,125 @@
+"""
+Multi-resolution image pyramid with an LRU tile cache.
+
+The pyramid is built once per image by repeated 2x area downsampling. Each
+render picks the coarsest level that still has at least one image pixel per
+display pixel and assembles only the tiles covering the requested region, so
+zooming into large images never copies or rescales the full-resolution array.
+"""
+
+import collections
+import itertools
+import threading
+import numpy as np
+import cv2
+
+TILE_SIZE = 256
+MIN_LEVEL_SIZE = 256  # Stop downsampling once the longest side is below this
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+STRIP_ROWS = 1024  # Rows processed at a time while building levels (must be even)
+
+
+def downsample_by_two(image, strip_rows=STRIP_ROWS):
+    # Input: numpy.ndarray(H, W, C) or (H, W), may be a memory map
+    # Output: numpy.ndarray(H // 2, W // 2, C) of the same dtype (mean of every 2x2 block)
+    height, width = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    output = np.empty((height // 2, width // 2) + image.shape[2:], dtype=image.dtype)
+    for row in range(0, height, strip_rows):
+        strip = np.ascontiguousarray(image[row:min(row + strip_rows, height), :width])
+        target = output[row // 2:(row + strip.shape[0]) // 2]
+        target[:] = cv2.resize(strip, (width // 2, strip.shape[0] // 2), interpolation=cv2.INTER_AREA).reshape(target.shape)
+    return output
+
+
+class TileCache:
+    # Least recently used cache of tiles with a cap on the total number of bytes
+    _tokens = itertools.count()
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._tiles = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def new_token(cls):
+        # Unique key prefix for each pyramid sharing the cache
+        return next(cls._tokens)
+
+    def get(self, key, build):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+            self.misses += 1
+        tile = build()
+        with self._lock:
+            if key not in self._tiles:
+                self._tiles[key] = tile
+                self.num_bytes += tile.nbytes
+            while self.num_bytes > self.max_bytes and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self.num_bytes -= evicted.nbytes
+        return tile
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self.num_bytes = 0
+
+
+class ImagePyramid:
+    def __init__(self, image, tile_cache=None, tile_size=TILE_SIZE, min_level_size=MIN_LEVEL_SIZE):
+        # Input: image = numpy.ndarray(H, W, C) of uint8 (level 0 is not copied)
+        self.tile_size = tile_size
+        self.tile_cache = tile_cache if tile_cache is not None else TileCache()
+        self.token = TileCache.new_token()
+        self.levels = [image]
+        while max(self.levels[-1].shape[:2]) > min_level_size and min(self.levels[-1].shape[:2]) >= 2:
+            self.levels.append(downsample_by_two(self.levels[-1]))
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    def level_for_scale(self, scale):
+        # Input: scale = image pixels per display pixel
+        # Output: coarsest level with at least one pixel per display pixel
+        if scale <= 1:
+            return 0
+        return int(min(np.floor(np.log2(scale)), len(self.levels) - 1))
+
+    def tile(self, level, tile_x, tile_y):
+        def build():
+            array = self.levels[level]
+            return np.ascontiguousarray(array[tile_y * self.tile_size:(tile_y + 1) * self.tile_size,
+                                              tile_x * self.tile_size:(tile_x + 1) * self.tile_size])
+        return self.tile_cache.get((self.token, level, tile_x, tile_y), build)
+
+    def render(self, x_min, y_min, x_max, y_max, out_size):
+        # Input: region in real scale (level 0), out_size = (Width, Height) in display scale
+        # Output: numpy.ndarray(Height, Width, C) of the region resampled to out_size
+        scale = max((x_max - x_min) / out_size[0], (y_max - y_min) / out_size[1])
+        level = self.level_for_scale(scale)
+        array = self.levels[level]
+        factor_x = self.levels[0].shape[1] / array.shape[1]
+        factor_y = self.levels[0].shape[0] / array.shape[0]
+        # Region in level coordinates
+        lx_min, ly_min = int(x_min / factor_x), int(y_min / factor_y)
+        lx_max = max(lx_min + 1, min(array.shape[1], int(np.ceil(x_max / factor_x))))
+        ly_max = max(ly_min + 1, min(array.shape[0], int(np.ceil(y_max / factor_y))))
+        mosaic = np.empty((ly_max - ly_min, lx_max - lx_min) + array.shape[2:], dtype=array.dtype)
+        for tile_y in range(ly_min // self.tile_size, (ly_max - 1) // self.tile_size + 1):
+            for tile_x in range(lx_min // self.tile_size, (lx_max - 1) // self.tile_size + 1):
+                tile = self.tile(level, tile_x, tile_y)
+                # Overlap between the tile and the region, in level coordinates
+                top, left = tile_y * self.tile_size, tile_x * self.tile_size
+                y0, y1 = max(ly_min, top), min(ly_max, top + tile.shape[0])
+                x0, x1 = max(lx_min, left), min(lx_max, left + tile.shape[1])
+                mosaic[y0 - ly_min:y1 - ly_min, x0 - lx_min:x1 - lx_min] = tile[y0 - top:y1 - top, x0 - left:x1 - left]
+        interpolation = cv2.INTER_AREA if mosaic.shape[1] > out_size[0] else cv2.INTER_NEAREST
+        return np.ascontiguousarray(cv2.resize(mosaic, (int(out_size[0]), int(out_size[1])), interpolation=interpolation))
@@ -2,6 +2,9 @@ from PyQt5 import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 
+# Custom modules
+import marking_store
+
 class ImportPointsWindow(QMainWindow):
     import_done_signal = pyqtSignal()
     
@@ -9,9 +12,8 @@ class ImportPointsWindow(QMainWindow):
         super(ImportPointsWindow, self).__init__()
         self.setWindowTitle('Import Points')
         self.build_gui()
-        self.marking_info = []
-        self.temp_area = []
-        self.point = None
+        self.marking_store = marking_store.MarkingStore()
+        self.imported_store = marking_store.MarkingStore()
 
     def build_gui(self):
         base_widget = QWidget(self)
@@ -41,40 +43,34 @@ class ImportPointsWindow(QMainWindow):
         main_v_layout.addWidget(self.points_info_table)
         main_v_layout.addLayout(function_h_layout)
 
-    def fill_table(self, points):
-        self.point = points
-        # Loop through labels
-        for key in points.keys():
-            for i in range(0, len(points[key])):
-                # Information
-                table_number_of_area_points = QLabel(str(len(points[key][i])))
-                self.temp_area.append(points[key][i])
-                table_select_check_box = QCheckBox()
-                table_select_check_box.setChecked(True)
-                table_area_label_text = QLineEdit()
-                table_area_label_text.setText(str(key))
+    def fill_table(self, markings):
+        # Input: markings = MarkingStore read from the file (annotation_io)
+        self.imported_store = markings
+        lengths = markings.lengths()
+        for i in range(0, len(markings)):
+            # Information
+            table_number_of_area_points = QLabel(str(lengths[i]))
+            table_select_check_box = QCheckBox()
+            table_select_check_box.setChecked(True)
+            table_area_label_text = QLineEdit()
+            table_area_label_text.setText(markings.label(i))
+
+            # Fill table
+            self.points_info_table.insertRow(self.points_info_table.rowCount())
+            self.points_info_table.setCellWidget(self.points_info_table.rowCount() - 1, 0, table_select_check_box)
+            self.points_info_table.setCellWidget(self.points_info_table.rowCount() - 1, 1, table_area_label_text)
+            self.points_info_table.setCellWidget(self.points_info_table.rowCount() - 1, 2, table_number_of_area_points)
 
-                # Fill table
-                self.points_info_table.insertRow(self.points_info_table.rowCount())
-                self.points_info_table.setCellWidget(self.points_info_table.rowCount() - 1, 0, table_select_check_box)
-                self.points_info_table.setCellWidget(self.points_info_table.rowCount() - 1, 1, table_area_label_text)
-                self.points_info_table.setCellWidget(self.points_info_table.rowCount() - 1, 2, table_number_of_area_points)
-    
     def process_dictionary(self):
+        # Keep the selected markings with their (possibly edited) labels
+        self.marking_store = self.imported_store.copy()
+        unselected = []
         for i in range(self.points_info_table.rowCount()):
-            check_box = self.points_info_table.cellWidget(i, 0)
-            no_points = len(self.temp_area[i])
-            if no_points > 2:
-                draw_type = "Contour"
-            else:
-                draw_type = "Bounding Box"
-            if check_box.isChecked():
-                cord_qt = []
-                for j in range(no_points):
-                    cord_qt.append(QPoint(self.temp_area[i][j][0], self.temp_area[i][j][1]))                    
-                self.marking_info.append([draw_type,self.points_info_table.cellWidget(i,1).text(),cord_qt,True,True])
+            if self.points_info_table.cellWidget(i, 0).isChecked():
+                self.marking_store.set_label(i, self.points_info_table.cellWidget(i, 1).text())
             else:
-                pass
+                unselected.append(i)
+        self.marking_store.delete(unselected)
         self.import_done_signal.emit()
 
 # For testing only
@@ -1,8 +1,10 @@
 import sys
+import multiprocessing
 import PyQt5
 import main_window
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()  # Tiled Cellpose workers are spawned processes, also in the frozen build
     app = PyQt5.QtWidgets.QApplication(sys.argv)
     window = main_window.MainWindow()
     window.installEventFilter(window)
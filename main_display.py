@@ -2,21 +2,44 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 import matplotlib.pyplot as plt
+import numpy as np
+
+# Custom modules
+import image_pyramid
+import marking_store
+import polygon_simplify
+import spatial_index
 
 
 class QLabelCanvas(QLabel):
-    table_refresh_signal = pyqtSignal()
+    marking_clicked_signal = pyqtSignal(int)  # Index of the marking clicked when no tool is active
 
     def __init__(self):
         super(QLabel, self).__init__()
         self.setMouseTracking(True)
+        self.setAlignment(Qt.AlignLeft | Qt.AlignTop)  # Layers are composited from the top-left corner
         self.draw_lines = False
         self.draw_lines_action_started = False
         self.canvas_orig = None
         self.canvas_zoom = None # Store image after zoom (by Ricky)
 
+        # Layers (composited in paintEvent)
+        self.base_layer = None  # Image only, never drawn on
+        self.annotation_layer = None  # Transparent, holds finished markings
+        # Shape being drawn, in display scale, painted over the layers without a pixmap of its own
+        self.preview_rect = None  # Bounding box or zoom rectangle being dragged
+        self.preview_polyline = QPolygon()  # Free drawing in progress
+        self.preview_pen = QPen(Qt.black)
+        self.marking_font = QFont()
+        self.marking_font.setFamily('Times')
+        self.marking_font.setBold(True)
+        self.marking_font.setPointSize(24)
+
         # Basic information
-        self.canvas_array = None  # Scale it and get the pixmap directly
+        self.canvas_array = None  # Full resolution image
+        self.image_pyramid = None  # Downsampled levels of canvas_array for display
+        self.tile_cache = image_pyramid.TileCache()  # Shared by every pyramid shown on this canvas
+        self.display_adjustment = None  # Optional function applied to each rendered display image
         self.canvas_orig_size = None  # (Width, Height)
         self.canvas_display_size = None  # (Width, Height)
         self.canvas_scaling = None  # Orig / Display
@@ -26,13 +49,16 @@ class QLabelCanvas(QLabel):
         self.free_drawing_start_point = None
         self.free_drawing_absolute_start_point = None
         self.temp_area = []
+        self.simplify_tolerance = polygon_simplify.DEFAULT_TOLERANCE  # Applied when a contour is finished, 0 disables
 
         # Bounding box
         self.draw_b_box = False
         self.draw_b_box_action_started = False
         self.b_box_start_corner = False
-        self.canvas_last_frame = None
-        self.marking_info = [] # [TYPE, LABEL, [CORNERS/POINTS], NUMBER VISABILITY, VISABILITY]
+        self.marking_store = marking_store.MarkingStore()
+        self.spatial_index = spatial_index.MarkingSpatialIndex(self.marking_store)
+        self.pending_region = None  # Area of markings about to be removed or reshaped
+        self.marking_store.add_listener(self.on_markings_changed)
 
         # Zoom in/out
         self.zoom = False
@@ -45,62 +71,229 @@ class QLabelCanvas(QLabel):
     ## Canvas Update Function ################################################
     ##########################################################################
     def initiate_canvas_and_set_pixmap(self, qpixmap):
-        self.canvas = qpixmap
-        self.set_and_update_pixmap()
-        self.painter = QPainter(self.canvas)
-        self.painter.setPen(QPen(Qt.black))
-        self.painter.end()
-        self.text_painter = QPainter(self.canvas)
-        self.text_painter.setPen(QPen(Qt.black))
-        font = QFont()
-        font.setFamily('Times')
-        font.setBold(True)
-        font.setPointSize(24)
-        self.text_painter.setFont(font)
-        self.text_painter.end()
+        self.set_base_layer(qpixmap)
 
+    def set_image(self, image_arr, display_size, pyramid=None, keep_view=False):
+        # Input: image_arr = numpy.ndarray(H, W, 3) of uint8, display_size = (Width, Height)
+        # Input: pyramid = ImagePyramid of image_arr if already built (e.g. in a background worker)
+        # Input: keep_view = keep the current zoom region instead of showing the whole image
+        self.canvas_array = image_arr
+        self.canvas_display_size = display_size
+        self.image_pyramid = pyramid if pyramid is not None else image_pyramid.ImagePyramid(image_arr, tile_cache=self.tile_cache)
+        if keep_view and self.zoom_corner1 is not None:
+            self.replace_canvas_with_zoom(self.zoom_corner1, self.zoom_corner2)
+        else:
+            self.replace_canvas_origin()
+            self.canvas_orig = self.base_layer
+
+    def set_base_layer(self, qpixmap):
+        # Replace the image and start with an empty annotation layer of the same size
+        self.base_layer = qpixmap
+        self.annotation_layer = QPixmap(qpixmap.size())
+        self.annotation_layer.fill(Qt.transparent)
+        self.preview_rect = None
+        self.preview_polyline = QPolygon()
+        self.set_and_update_pixmap()
 
     def set_and_update_pixmap(self):
-        self.setPixmap(self.canvas)
+        self.setPixmap(self.base_layer)
         self.update()
 
+    def paintEvent(self, event):
+        # Base image is drawn by QLabel, markings are composited on top and the preview drawn last
+        super(QLabelCanvas, self).paintEvent(event)
+        if self.annotation_layer is None:
+            return
+        rect = event.rect()
+        painter = QPainter(self)
+        painter.drawPixmap(rect, self.annotation_layer, rect)
+        if self.preview_rect is not None or not self.preview_polyline.isEmpty():
+            painter.setClipRect(rect)
+            painter.setPen(self.preview_pen)
+            painter.setBrush(Qt.NoBrush)
+            if self.preview_rect is not None:
+                painter.drawRect(self.preview_rect)
+            if not self.preview_polyline.isEmpty():
+                painter.drawPolyline(self.preview_polyline)
+        painter.end()
+
     # Show selected function
     def refresh_pixmap_acc_to_vis(self):
-        if self.zoom:
-            self.canvas = self.canvas_zoom.copy()
-            self.set_and_update_pixmap()
-            self.zoom_to_vis()
-        else:
-            self.canvas = self.canvas_orig.copy()
-            self.set_and_update_pixmap()
-            for i in range(0, len(self.marking_info)):
-                if self.marking_info[i][0] == "Contour" and self.marking_info[i][3] and self.marking_info[i][-1]:
-                    self.draw_contour(self.marking_info[i][2], dynamic=False, number=i+1)
-                elif self.marking_info[i][0] == "Bounding Box" and self.marking_info[i][3] and self.marking_info[i][-1]:
-                    self.draw_bounding_box(self.marking_info[i][2], dynamic=False, number=i+1)
-                elif self.marking_info[i][0] == "Contour" and self.marking_info[i][-1]:
-                    self.draw_contour(self.marking_info[i][2], dynamic=False)
-                elif self.marking_info[i][0] == "Bounding Box" and self.marking_info[i][-1]:
-                    self.draw_bounding_box(self.marking_info[i][2], dynamic=False)
-                else:
-                    pass
+        # Redraw every visible marking on the annotation layer
+        if self.annotation_layer is None:
+            return
+        self.annotation_layer.fill(Qt.transparent)
+        painter = QPainter(self.annotation_layer)
+        # Only the markings intersecting the viewport are drawn
+        self.draw_markings(painter, self.visible_markings_in(self.base_layer.rect()), anchor=self.canvas_orig_anchor)
+        painter.end()
+        self.update()
+
+    def visible_markings_in(self, display_rect):
+        # Output: indices of the visible markings (including their number) intersecting a display rectangle
+        corners = self.display_to_image([[display_rect.left(), display_rect.top()],
+                                         [display_rect.right() + 1, display_rect.bottom() + 1]], anchor=self.canvas_orig_anchor)
+        font_metrics = QFontMetrics(self.marking_font)
+        margin = (font_metrics.maxWidth() * len(str(len(self.marking_store))) + font_metrics.height()) * self.canvas_scaling
+        indices = self.spatial_index.query(corners[0, 0] - margin, corners[0, 1] - margin, corners[1, 0] + margin, corners[1, 1] + margin)
+        return indices[(self.marking_store.flags[indices] & marking_store.VISIBLE) != 0]
+
+    def refresh_markings(self, indices):
+        # Repaint only the area covered by the given markings (e.g. after toggling visibility)
+        self.repaint_region(self.region_from_rects(self.marking_display_rects(indices)))
+
+    @staticmethod
+    def region_from_rects(rects):
+        region = QRegion()
+        for rect in rects:
+            region = region.united(QRect(QPoint(rect[0], rect[1]), QPoint(rect[2], rect[3])))
+        return region
+
+    def repaint_region(self, region):
+        # Clear the dirty region of the annotation layer and redraw the visible markings overlapping it
+        if region.isEmpty():
+            return
+        painter = QPainter(self.annotation_layer)
+        painter.setClipRegion(region)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.fillRect(region.boundingRect(), Qt.transparent)
+        painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        # Spatial index and bounding box test first, exact region test only for the candidates
+        visible = self.visible_markings_in(region.boundingRect())
+        rects = self.marking_display_rects(visible)
+        dirty = region.boundingRect()
+        overlap = ((rects[:, 0] <= dirty.right()) & (rects[:, 2] >= dirty.left()) &
+                   (rects[:, 1] <= dirty.bottom()) & (rects[:, 3] >= dirty.top()))
+        candidates = [i for i, rect in zip(visible[overlap], rects[overlap])
+                      if region.intersects(QRect(QPoint(rect[0], rect[1]), QPoint(rect[2], rect[3])))]
+        self.draw_markings(painter, candidates, anchor=self.canvas_orig_anchor)
+        painter.end()
+        self.update(region)
+
+    def draw_markings(self, painter, indices, anchor=(0, 0)):
+        # One polygon per marking, all drawn with the same painter
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return
+        offsets = self.marking_store.offsets
+        coords = self.marking_store.coords
+        # Transform the whole coordinate buffer at once unless only a small part of it is drawn
+        transform_all = 4 * np.sum(offsets[indices + 1] - offsets[indices]) > len(coords)
+        if transform_all:
+            coords = self.image_to_display(coords, anchor=anchor)
+        type_codes = self.marking_store.type_codes[indices]
+        painter.setPen(QPen(Qt.black))
+        painter.setBrush(Qt.NoBrush)
+        for i, type_code in zip(indices, type_codes):
+            points = coords[offsets[i]:offsets[i + 1]]
+            if not transform_all:
+                points = self.image_to_display(points, anchor=anchor)
+            if type_code == marking_store.CONTOUR:
+                painter.drawPolygon(self.array_to_qpolygonf(points))
+            else:
+                painter.drawRect(QRectF(QPointF(*points[0]), QPointF(*points[1])).normalized())
+        # Add number at the centre of the bounding box
+        numbered = indices[(self.marking_store.flags[indices] & marking_store.NUMBER_VISIBLE) != 0]
+        if len(numbered) > 0:
+            self.spatial_index.sync()
+            bounds = self.image_to_display(self.spatial_index.bounds[numbered].reshape(-1, 2), anchor=anchor).astype(np.int64).reshape(-1, 4)
+            text_x = (bounds[:, 0] + bounds[:, 2]) // 2
+            text_y = (bounds[:, 1] + bounds[:, 3]) // 2
+            painter.setFont(self.marking_font)
+            for i, x, y in zip(numbered, text_x, text_y):
+                painter.drawText(int(x), int(y), str(i + 1))
+
+    def marking_display_rect(self, index):
+        # Output: QRect in display scale covering the marking and its number
+        rect = self.marking_display_rects([index])[0]
+        return QRect(QPoint(rect[0], rect[1]), QPoint(rect[2], rect[3]))
+
+    def marking_display_rects(self, indices):
+        # Output: numpy.ndarray(N, 4) of [LEFT, TOP, RIGHT, BOTTOM] in display scale,
+        # covering each marking and its number
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return np.empty((0, 4), dtype=np.int64)
+        self.spatial_index.sync()
+        bounds = self.spatial_index.bounds[indices]
+        rects = self.image_to_display(bounds.reshape(-1, 2), anchor=self.canvas_orig_anchor).astype(np.int64).reshape(-1, 4)
+        # Number is drawn from the centre of the bounding box
+        font_metrics = QFontMetrics(self.marking_font)
+        text_x = (rects[:, 0] + rects[:, 2]) // 2
+        text_y = (rects[:, 1] + rects[:, 3]) // 2
+        text_width = font_metrics.maxWidth() * (np.floor(np.log10(indices + 1)).astype(np.int64) + 1)
+        rects[:, 0] = np.minimum(rects[:, 0], text_x)
+        rects[:, 1] = np.minimum(rects[:, 1], text_y - font_metrics.ascent())
+        rects[:, 2] = np.maximum(rects[:, 2], text_x + text_width)
+        rects[:, 3] = np.maximum(rects[:, 3], text_y + font_metrics.descent())
+        return rects + np.array([-1, -1, 1, 1])
 
     # Clear markings
     def clear_all_markings(self):
-        self.marking_info = []
-        self.canvas_last_frame = None
-        self.table_refresh_signal.emit()
-        self.replace_canvas_with_zoom(self.zoom_corner1, self.zoom_corner2)
+        self.marking_store.clear()
+
+    # Simplify selected contours
+    def simplify_selected_markings(self, selected_list, tolerance):
+        selected = np.flatnonzero(selected_list)
+        if len(selected) > 0:
+            polygon_simplify.simplify_markings(self.marking_store, selected, tolerance)
 
     # Clear selected markings
     def clear_selected_markings(self, selected_list):
-        self.marking_info = [self.marking_info[i] for i in range(len(self.marking_info)) if not selected_list[i]]
-        if len(self.marking_info) == 0:
-            self.clear_all_markings()
+        self.marking_store.delete(selected_list)
+
+    ##########################################################################
+    ## Change Notifications ##################################################
+    ##########################################################################
+    def on_markings_changed(self, kind, indices):
+        # Repaint only the area touched by the change (other views listen to the store themselves)
+        if self.annotation_layer is not None:
+            if kind == marking_store.ADDED:
+                self.draw_added_markings(indices)
+            elif kind == marking_store.ABOUT_TO_REMOVE:
+                # Removed markings leave a hole and the following numbered markings get renumbered
+                self.pending_region = self.region_from_rects(self.marking_display_rects(self.with_renumbered(indices)))
+            elif kind == marking_store.INSERTED:
+                self.repaint_region(self.region_from_rects(self.marking_display_rects(self.with_renumbered(indices))))
+            elif kind == marking_store.ABOUT_TO_UPDATE:
+                self.pending_region = self.region_from_rects(self.marking_display_rects(indices))
+            elif kind == marking_store.REMOVED:
+                self.repaint_region(self.pending_region)
+            elif kind == marking_store.UPDATED:
+                self.repaint_region(self.pending_region.united(self.region_from_rects(self.marking_display_rects(indices))))
+            elif kind == marking_store.VISIBILITY_CHANGED:
+                self.refresh_markings(indices)
+            elif kind == marking_store.CLEARED:
+                self.annotation_layer.fill(Qt.transparent)
+                self.update()
+        if kind in (marking_store.REMOVED, marking_store.UPDATED):
+            self.pending_region = None
+
+    def with_renumbered(self, indices):
+        # Output: the given markings and the following markings whose number is shown
+        number_visible = (self.marking_store.flags & marking_store.NUMBER_VISIBLE) != 0
+        renumbered = np.flatnonzero(number_visible[indices[0]:]) + indices[0]
+        return np.union1d(indices, renumbered)
+
+    def draw_added_markings(self, indices):
+        # Input: indices = range of the appended markings
+        # Drawn on top of the annotation layer without touching the others
+        if len(indices) == 1:
+            indices = np.array([indices[0]], dtype=np.int64)
+            indices = indices[(self.marking_store.flags[indices] & marking_store.VISIBLE) != 0]
         else:
-            self.replace_canvas_with_zoom(self.zoom_corner1, self.zoom_corner2)
-            self.canvas_last_frame = self.canvas.copy()
-            self.table_refresh_signal.emit()
+            # Large batches (Cellpose, import): only the new markings inside the viewport are drawn
+            visible = self.visible_markings_in(self.base_layer.rect())
+            indices = visible[(visible >= indices[0]) & (visible <= indices[-1])] if len(indices) > 0 else visible[:0]
+        if len(indices) == 0:
+            return
+        painter = QPainter(self.annotation_layer)
+        self.draw_markings(painter, indices, anchor=self.canvas_orig_anchor)
+        painter.end()
+        if len(indices) == 1:
+            self.update(self.marking_display_rect(indices[0]))
+        else:
+            self.update()
 
     def replace_canvas_origin(self):
         self.replace_canvas_with_zoom(QPoint(0, 0), QPoint(self.canvas_array.shape[1], self.canvas_array.shape[0]))
@@ -116,32 +309,25 @@ class QLabelCanvas(QLabel):
             y_max = y_min + (x_max-x_min)
         elif (x_max-x_min)<(y_max-y_min):
             x_max = x_min + (y_max-y_min)
-        zoomed_array = self.canvas_array[y_min:y_max, x_min:x_max, :].astype('uint8')
-        qimage = QImage(zoomed_array, zoomed_array.shape[1], zoomed_array.shape[0], 3 * zoomed_array.shape[1], QImage.Format_RGB888)
+        # Keep the region inside the image
+        x_min = min(max(x_min, 0), self.canvas_array.shape[1] - 1)
+        y_min = min(max(y_min, 0), self.canvas_array.shape[0] - 1)
+        x_max = max(min(x_max, self.canvas_array.shape[1]), x_min + 1)
+        y_max = max(min(y_max, self.canvas_array.shape[0]), y_min + 1)
+        # Fit the region into the display keeping the aspect ratio
+        self.canvas_orig_size = (x_max - x_min, y_max - y_min)
+        self.canvas_scaling = max(self.canvas_orig_size[0] / self.canvas_display_size[0], self.canvas_orig_size[1] / self.canvas_display_size[1])
+        out_size = (max(1, round(self.canvas_orig_size[0] / self.canvas_scaling)), max(1, round(self.canvas_orig_size[1] / self.canvas_scaling)))
+        zoomed_array = self.image_pyramid.render(x_min, y_min, x_max, y_max, out_size)
+        if self.display_adjustment is not None:
+            zoomed_array = np.ascontiguousarray(self.display_adjustment(zoomed_array))
+        qimage = QImage(zoomed_array.data, zoomed_array.shape[1], zoomed_array.shape[0], zoomed_array.strides[0], QImage.Format_RGB888)
         qpixmap = QPixmap.fromImage(qimage)
-        qpixmap = qpixmap.scaled(self.canvas_display_size[0], self.canvas_display_size[1], Qt.KeepAspectRatio)
-        self.canvas = qpixmap.copy()
-        self.set_and_update_pixmap()
-        self.canvas_zoom = qpixmap.copy()
-        self.canvas_orig_size = (zoomed_array.shape[1], zoomed_array.shape[0])
-        self.canvas_scaling = self.canvas_orig_size[0] / self.canvas_display_size[0]
+        self.canvas_zoom = qpixmap
+        self.set_base_layer(qpixmap)
         self.canvas_orig_anchor = (x_min, y_min)
         # Draw markings
-        self.zoom_to_vis()
-        self.canvas_last_frame = self.canvas.copy()
-    
-    def zoom_to_vis(self):
-        for i in range(0, len(self.marking_info)):
-            if self.marking_info[i][0] == "Contour" and self.marking_info[i][3] and self.marking_info[i][-1]:
-                self.draw_contour(self.marking_info[i][2], dynamic=False, anchor=self.canvas_orig_anchor, number=i+1)
-            elif self.marking_info[i][0] == "Bounding Box" and self.marking_info[i][3] and self.marking_info[i][-1]:
-                self.draw_bounding_box(self.marking_info[i][2], dynamic=False, anchor=self.canvas_orig_anchor, number=i+1)
-            elif self.marking_info[i][0] == "Contour" and self.marking_info[i][-1]:
-                self.draw_contour(self.marking_info[i][2], dynamic=False, anchor=self.canvas_orig_anchor)
-            elif self.marking_info[i][0] == "Bounding Box" and self.marking_info[i][3] and self.marking_info[i][-1]:
-                self.draw_bounding_box(self.marking_info[i][2], dynamic=False, anchor=self.canvas_orig_anchor)
-            else:
-                pass
+        self.refresh_pixmap_acc_to_vis()
 
     ##########################################################################
     ## Event Filter for Drawing Function #####################################
@@ -157,26 +343,21 @@ class QLabelCanvas(QLabel):
                 self.draw_lines_action_started = True
                 self.temp_area = []
                 self.temp_area.append(self.free_drawing_absolute_start_point)
-                self.canvas_last_frame = self.canvas.copy()
             # Finish
             if self.draw_lines_action_started and event.type() == QEvent.MouseButtonPress and event.button() == Qt.RightButton:
                 # All QPoint in real scale
                 curr_point = self.scale_points([QPoint(event.pos().x(), event.pos().y())], to_display=False, anchor=self.canvas_orig_anchor)[0]
                 self.temp_area.append(curr_point)
-                #self.draw_contour([self.free_drawing_start_point, curr_point], dynamic=True, anchor=self.canvas_orig_anchor)
-                #self.draw_contour([curr_point, self.free_drawing_absolute_start_point], dynamic=True, anchor=self.canvas_orig_anchor)
-                self.canvas = self.canvas_last_frame.copy()
-                self.draw_contour(self.temp_area, dynamic=False, anchor=self.canvas_orig_anchor, number=len(self.marking_info)+1)
-                self.canvas_last_frame = self.canvas.copy()
+                self.clear_preview()
                 self.draw_lines_action_started = False
-                self.marking_info.append(["Contour", "NO LABEL", self.temp_area, True, True])
+                points = polygon_simplify.simplify_polygon(self.qpoints_to_array(self.temp_area), self.simplify_tolerance)
+                self.marking_store.append("Contour", marking_store.NO_LABEL, points)
                 self.temp_area = []
-                self.table_refresh_signal.emit()
             # Moving
             if self.draw_lines_action_started and event.type() == QEvent.MouseMove:
                 # All QPoint in real scale
                 curr_point = self.scale_points([QPoint(event.pos().x(), event.pos().y())], to_display=False, anchor=self.canvas_orig_anchor)[0]
-                self.draw_contour([self.free_drawing_start_point, curr_point], dynamic=True, anchor=self.canvas_orig_anchor)
+                self.draw_preview_line([self.free_drawing_start_point, curr_point], anchor=self.canvas_orig_anchor)
                 self.free_drawing_start_point = curr_point
                 self.temp_area.append(curr_point)
         # Bounding box
@@ -190,16 +371,14 @@ class QLabelCanvas(QLabel):
             if self.draw_b_box_action_started and event.type() == QEvent.MouseButtonPress and event.button() == Qt.RightButton:
                 # All QPoint in real scale
                 curr_point = self.scale_points([QPoint(event.pos().x(), event.pos().y())], to_display=False, anchor=self.canvas_orig_anchor)[0]
-                self.draw_bounding_box([self.b_box_start_corner, curr_point], dynamic=True, anchor=self.canvas_orig_anchor, number=len(self.marking_info)+1)
-                self.canvas_last_frame = self.canvas.copy()
+                self.clear_preview()
                 self.draw_b_box_action_started = False
-                self.marking_info.append(["Bounding Box", "NO LABEL", [self.b_box_start_corner, curr_point], True, True])
-                self.table_refresh_signal.emit()
+                self.marking_store.append("Bounding Box", marking_store.NO_LABEL, self.qpoints_to_array([self.b_box_start_corner, curr_point]))
             # Moving
             if self.draw_b_box_action_started and event.type() == QEvent.MouseMove:
                 # All QPoint in real scale
                 curr_point = self.scale_points([QPoint(event.pos().x(), event.pos().y())], to_display=False, anchor=self.canvas_orig_anchor)[0]
-                self.draw_bounding_box([self.b_box_start_corner, curr_point], dynamic=True, anchor=self.canvas_orig_anchor)
+                self.draw_preview_box([self.b_box_start_corner, curr_point], anchor=self.canvas_orig_anchor)
         # Zoom
         elif self.zoom:
             # Start
@@ -210,93 +389,100 @@ class QLabelCanvas(QLabel):
             if self.zoom_started and event.type() == QEvent.MouseButtonPress and event.button() == Qt.RightButton:
                 curr_point = self.scale_points([QPoint(event.pos().x(), event.pos().y())], to_display=False, anchor=self.canvas_orig_anchor)[0]
                 self.zoom_started = False
+                self.clear_preview()
                 self.replace_canvas_with_zoom(self.zoom_start_corner, curr_point)
             # Moving
             if self.zoom_started and event.type() == QEvent.MouseMove:
                 curr_point = self.scale_points([QPoint(event.pos().x(), event.pos().y())], to_display=False, anchor=self.canvas_orig_anchor)[0]
-                self.draw_bounding_box([self.zoom_start_corner, curr_point], dynamic=True, anchor=self.canvas_orig_anchor)
+                self.draw_preview_box([self.zoom_start_corner, curr_point], anchor=self.canvas_orig_anchor)
+        # Select marking by clicking on it
+        elif self.base_layer is not None and event.type() == QEvent.MouseButtonPress and event.button() == Qt.LeftButton:
+            x, y = self.display_to_image([[event.pos().x(), event.pos().y()]], anchor=self.canvas_orig_anchor)[0]
+            index = self.spatial_index.hit_test(x, y)
+            if index is not None:
+                self.marking_clicked_signal.emit(index)
 
         return super(QLabelCanvas, self).eventFilter(obj, event)
 
     ##########################################################################
     ## Drawing Function ######################################################
     ##########################################################################
-    def scale_points(self, points, to_display=True, anchor=(0, 0)):
+    @staticmethod
+    def qpoints_to_array(points):
         # Input: points = [QPoint, QPoint, ...]
-        # Input: to_real: Define whether changing the points from display scale to real scale, or inverse
-        # Real X = Display X * Scaling + Anchor X
+        # Output: numpy.ndarray(N, 2) of int32
+        return np.array([(point.x(), point.y()) for point in points], dtype=np.int32).reshape(-1, 2)
+
+    @staticmethod
+    def array_to_qpoints(points):
+        # Input: numpy.ndarray(N, 2)
+        # Output: [QPoint, QPoint, ...]
+        return [QPoint(int(x), int(y)) for x, y in points]
+
+    @staticmethod
+    def array_to_qpolygonf(points):
+        # Input: numpy.ndarray(N, 2)
+        # Output: QPolygonF filled through its buffer, without creating a QPointF per point
+        polygon = QPolygonF(len(points))
+        if len(points) > 0:
+            buffer = polygon.data()
+            buffer.setsize(16 * len(points))  # QPointF is two doubles
+            np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = points
+        return polygon
+
+    def image_to_display(self, coords, anchor=(0, 0)):
         # Display X = (Real X - Anchor X) / Scaling
+        # Input/Output: numpy.ndarray(N, 2)
+        return (np.asarray(coords, dtype=np.float64) - anchor) / self.canvas_scaling
+
+    def display_to_image(self, coords, anchor=(0, 0)):
+        # Real X = Display X * Scaling + Anchor X
+        # Input/Output: numpy.ndarray(N, 2)
+        return np.asarray(coords, dtype=np.float64) * self.canvas_scaling + anchor
+
+    def scale_points(self, points, to_display=True, anchor=(0, 0)):
+        # Input: points = [QPoint, QPoint, ...]
+        # Input: to_display: Define whether changing the points from real scale to display scale, or inverse
         # QPoints in real scale (relative to image original size)
-        scaled_points = []
-        for i in range(0, len(points)):
-            if to_display:
-                scaled_single_point = QPoint(int((points[i].x() - anchor[0]) / self.canvas_scaling),
-                                             int((points[i].y() - anchor[1]) / self.canvas_scaling))
-            else:
-                scaled_single_point = QPoint(int(points[i].x() * self.canvas_scaling + anchor[0]),
-                                             int(points[i].y() * self.canvas_scaling + anchor[1]))
-            scaled_points.append(scaled_single_point)
-        return scaled_points
-
-    def draw_bounding_box(self, corners, dynamic=False, anchor=(0, 0), number=None):
-        # Input: corners = [QPoint, QPoint]
-        # Corners in real scale (relative to image original size)
-        corners = self.scale_points(corners, to_display=True, anchor=anchor)
-        corner1 = corners[0]
-        corner2 = corners[1]
-        corner1_x = corner1.x()
-        corner1_y = corner1.y()
-        corner2_x = corner2.x()
-        corner2_y = corner2.y()
-        corner3 = QPoint(corner2_x, corner1_y)
-        corner4 = QPoint(corner1_x, corner2_y)
-        if dynamic:
-            if self.canvas_last_frame is None:
-                self.canvas = self.canvas_orig.copy()
-            else:
-                self.canvas = self.canvas_last_frame.copy()
-        self.painter.begin(self.canvas)
-        self.painter.setPen(QPen(Qt.black))
-        self.painter.drawLine(corner1, corner3)
-        self.painter.drawLine(corner3, corner2)
-        self.painter.drawLine(corner2, corner4)
-        self.painter.drawLine(corner4, corner1)
-        self.painter.end()
-        if number is not None:
-            self.text_painter.begin(self.canvas)
-            text_x, text_y = int((corner1_x + corner2_x) / 2), int((corner1_y + corner2_y) / 2)
-            self.text_painter.drawText(text_x, text_y, str(number))
-            self.text_painter.end()
+        points = self.qpoints_to_array(points)
+        if to_display:
+            scaled_points = self.image_to_display(points, anchor=anchor)
         else:
-            pass
-        self.set_and_update_pixmap()
+            scaled_points = self.display_to_image(points, anchor=anchor)
+        return self.array_to_qpoints(scaled_points.astype(np.int64))
+
+    # Preview of the shape being drawn ######################################
+    # Only the bounding rectangles of the previous and new preview are repainted on each mouse move
+    @staticmethod
+    def preview_dirty_rect(rect):
+        # The outline is drawn on the right/bottom edge of the rectangle, plus a pixel of antialiasing
+        return rect.adjusted(-1, -1, 2, 2)
 
-    def draw_contour(self, points, dynamic=False, anchor=(0, 0), number=None):
-        def find_central_point(points):
-            # Input (points): [QPoint, QPoint, ...]
-            x, y = [], []
-            for i in range(0, len(points)):
-                x.append(int(points[i].x()))
-                y.append(int(points[i].y()))
-            return int((max(x) + min(x)) / 2), int((max(y) + min(y)) / 2)
-        # Input: points = [[QPoint(), QPoint[]]]
+    def clear_preview(self):
+        dirty = QRect()
+        if self.preview_rect is not None:
+            dirty = dirty.united(self.preview_dirty_rect(self.preview_rect))
+        if not self.preview_polyline.isEmpty():
+            dirty = dirty.united(self.preview_dirty_rect(self.preview_polyline.boundingRect()))
+        self.preview_rect = None
+        self.preview_polyline = QPolygon()
+        if not dirty.isEmpty():
+            self.update(dirty)
+
+    def draw_preview_box(self, corners, anchor=(0, 0)):
+        # Input: corners = [QPoint, QPoint] in real scale
+        corners = self.scale_points(corners, to_display=True, anchor=anchor)
+        rect = QRect(corners[0], corners[1]).normalized()
+        dirty = self.preview_dirty_rect(rect)
+        if self.preview_rect is not None:
+            dirty = dirty.united(self.preview_dirty_rect(self.preview_rect))
+        self.preview_rect = rect
+        self.update(dirty)
+
+    def draw_preview_line(self, points, anchor=(0, 0)):
+        # Input: points = [QPoint, QPoint] in real scale, appended to the free drawing preview
         points = self.scale_points(points, to_display=True, anchor=anchor)
-        self.painter.begin(self.canvas)
-        self.painter.setPen(QPen(Qt.black))
-        if dynamic:
-            self.painter.drawLine(points[0], points[1])
-            self.painter.end()
-        else:
-            for i in range(0, len(points) - 1):
-                self.painter.drawLine(points[i], points[i + 1])
-            self.painter.drawLine(points[-1], points[0])
-            self.painter.end()
-            # Add number
-            if number is not None:
-                self.text_painter.begin(self.canvas)
-                text_x, text_y = find_central_point(points)
-                self.text_painter.drawText(text_x, text_y, str(number))
-                self.text_painter.end()
-            else:
-                pass
-        self.set_and_update_pixmap()
+        if self.preview_polyline.isEmpty():
+            self.preview_polyline.append(points[0])
+        self.preview_polyline.append(points[1])
+        self.update(self.preview_dirty_rect(QRect(points[0], points[1]).normalized()))
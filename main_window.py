@@ -1,21 +1,39 @@
+import collections
 import copy
-import cv2
-import json
+import os
+import sqlite3
 import numpy as np
-import skimage
 import matplotlib.pyplot as plt
-from cellpose import models
 from PIL import Image, ImageQt
-from PyQt5.QtCore import QEvent, QSize, Qt, QPoint, pyqtSignal
-from PyQt5.QtGui import QPixmap, QImage, QPainter, QPen
-from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QHBoxLayout, QComboBox, QWidget, QFileDialog, QLabel, QGroupBox, QStatusBar, QTableWidget, QTableWidgetItem, QCheckBox, QLineEdit, QMenuBar, QMenu, QAction
+from PyQt5.QtCore import QEvent, QSize, Qt, QSettings, QTimer, pyqtSignal
+from PyQt5.QtGui import QPainter, QPen, QKeySequence
+from PyQt5.QtWidgets import QMessageBox, QApplication, QMainWindow, QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QFileDialog, QLabel, QGroupBox, QStatusBar, QTableWidgetItem, QTableView, QAbstractItemView, QLineEdit, QMenuBar, QMenu, QAction, QInputDialog
 
 # Custom modules
+import annotation_db
+import annotation_io
+import autosave_journal
+import background_worker
+import edit_history
+import image_adjustment
+import image_io
+import image_prefetch
+import image_pyramid
 import main_display
+import marking_table_model
+import polygon_simplify
 import import_points_window
 import export_option_window
 import cellpose_option_window
+import dataset_browser_window
+import dataset_summary_window
 import preferences_window
+import session_io
+import thumbnail_cache
+
+ADJUSTED_IMAGE_CACHE_SIZE = 2  # Full resolution adjusted images kept in memory
+PREFETCH_AHEAD = 3  # Dataset images decoded in the background after the current one
+PREFETCH_BEHIND = 1
 
 
 class MainWindow(QMainWindow):
@@ -62,20 +80,105 @@ class MainWindow(QMainWindow):
         self.import_action.triggered.connect(self.import_points_from_json)
         self.file_menu.addAction(self.import_action)
 
+        # Dataset (folder of images, markings of each image kept in its autosave)
+        self.open_folder_action = QAction("Open &Folder...", self)
+        self.open_folder_action.triggered.connect(self.open_dataset)
+        self.file_menu.addAction(self.open_folder_action)
+        self.next_image_action = QAction("&Next Image", self)
+        self.next_image_action.setShortcuts([QKeySequence("Ctrl+Right"), QKeySequence("Ctrl+PgDown")])
+        self.next_image_action.triggered.connect(self.next_image)
+        self.file_menu.addAction(self.next_image_action)
+        self.previous_image_action = QAction("&Previous Image", self)
+        self.previous_image_action.setShortcuts([QKeySequence("Ctrl+Left"), QKeySequence("Ctrl+PgUp")])
+        self.previous_image_action.triggered.connect(self.previous_image)
+        self.file_menu.addAction(self.previous_image_action)
+        self.dataset_browser_action = QAction("Dataset &Browser...", self)
+        self.dataset_browser_action.triggered.connect(self.open_dataset_browser)
+        self.file_menu.addAction(self.dataset_browser_action)
+        self.dataset_summary_action = QAction("Dataset &Summary...", self)
+        self.dataset_summary_action.triggered.connect(self.open_dataset_summary)
+        self.file_menu.addAction(self.dataset_summary_action)
+        self.dataset_images = []
+        self.dataset_index = -1
+        self.image_prefetcher = image_prefetch.ImagePrefetcher(lambda image_dir: self._load_for_display(image_dir, self.old_image_pixmap.tile_cache))
+        self.dataset_browser = None
+        self.dataset_summary = None
+        self.cellpose_option_window = None
+        self.annotation_db = None  # Markings of every visited image of the dataset, in the dataset folder
+        try:
+            self.thumbnail_cache = thumbnail_cache.ThumbnailCache()
+        except OSError:
+            self.thumbnail_cache = None  # Cache folder not writable, the browser is unavailable
+
+        # Session (image reference, label choices and markings in one file)
+        self.file_menu.addSeparator()
+        self.open_session_action = QAction("Open &Session...", self)
+        self.open_session_action.triggered.connect(self.open_session)
+        self.file_menu.addAction(self.open_session_action)
+        self.save_session_action = QAction("Save S&ession", self)
+        self.save_session_action.setShortcut(QKeySequence.Save)
+        self.save_session_action.triggered.connect(self.save_session)
+        self.file_menu.addAction(self.save_session_action)
+        self.save_session_as_action = QAction("Save Session &As...", self)
+        self.save_session_as_action.triggered.connect(self.save_session_as)
+        self.file_menu.addAction(self.save_session_as_action)
+        self.session_dir = None
+
         # Automation - Cellpose
         self.cellpose_mask_function = QAction("&Cellpose", self)
         self.cellpose_mask_function.triggered.connect(self.generate_mask_with_cellpose)
         self.automation_menu.addAction(self.cellpose_mask_function)
 
+        # Edit - Undo/Redo of the marking edits
+        self.undo_action = QAction("&Undo", self)
+        self.undo_action.setShortcut(QKeySequence.Undo)
+        self.undo_action.triggered.connect(self.undo_edit)
+        self.edit_menu.addAction(self.undo_action)
+        self.redo_action = QAction("&Redo", self)
+        self.redo_action.setShortcuts([QKeySequence.Redo, QKeySequence("Ctrl+Y")])
+        self.redo_action.triggered.connect(self.redo_edit)
+        self.edit_menu.addAction(self.redo_action)
+        self.undo_depth_action = QAction("Undo &History Depth...", self)
+        self.undo_depth_action.triggered.connect(self.set_undo_depth)
+        self.edit_menu.addAction(self.undo_depth_action)
+        self.edit_menu.aboutToShow.connect(self.update_undo_actions)
+        self.edit_menu.addSeparator()
+
         # Edit - Preference
         self.pref_action = QAction("&Preferences", self)
         self.pref_action.triggered.connect(self.open_preference_window)
         self.edit_menu.addAction(self.pref_action)
 
-        # Edit - Histogram Equalization
+        # Edit - Image adjustments (previewed immediately, full resolution computed in background)
         self.hist_eq_action = QAction("&Histogram Equalization", self)
+        self.hist_eq_action.setCheckable(True)
         self.hist_eq_action.triggered.connect(self.run_hist_eq)
         self.edit_menu.addAction(self.hist_eq_action)
+        self.clahe_action = QAction("&CLAHE", self)
+        self.clahe_action.setCheckable(True)
+        self.clahe_action.triggered.connect(self.apply_adjustments)
+        self.edit_menu.addAction(self.clahe_action)
+        self.percentile_window_action = QAction("&Percentile Window (1% - 99%)", self)
+        self.percentile_window_action.setCheckable(True)
+        self.percentile_window_action.triggered.connect(self.apply_adjustments)
+        self.edit_menu.addAction(self.percentile_window_action)
+        self.gamma_action = QAction("&Gamma", self)
+        self.gamma_action.setCheckable(True)
+        self.gamma_action.triggered.connect(self.toggle_gamma)
+        self.edit_menu.addAction(self.gamma_action)
+        self.gamma_value = 1.0
+
+        # Edit - Polygon simplification (finished contours and Cellpose output)
+        self.simplify_action = QAction("&Polygon Simplification...", self)
+        self.simplify_action.triggered.connect(self.set_simplify_tolerance)
+        self.edit_menu.addAction(self.simplify_action)
+        self.simplify_selected_action = QAction("&Simplify Selected Markings", self)
+        self.simplify_selected_action.triggered.connect(self.simplify_selected)
+        self.edit_menu.addAction(self.simplify_selected_action)
+        self.source_image = None  # Image before adjustments
+        self.adjustment_generation = 0  # Incremented by every image change or adjustment, older worker results are ignored
+        self.source_pyramid = None
+        self.adjusted_images = collections.OrderedDict()  # Pipeline key -> (image, pyramid)
 
         # Status bar
         self.base_status_bar = QStatusBar()
@@ -109,7 +212,7 @@ class MainWindow(QMainWindow):
         view_group_h_layout.setAlignment(Qt.AlignTop)
         self.old_image_pixmap = main_display.QLabelCanvas()
         self.old_image_pixmap.installEventFilter(self.old_image_pixmap)
-        self.old_image_pixmap.table_refresh_signal.connect(self.refresh_seg_label_list_table)
+        self.old_image_pixmap.marking_clicked_signal.connect(self.select_marking_in_table)
         view_group_h_layout.addWidget(self.old_image_pixmap)
         view_group.setLayout(view_group_h_layout)
         view_group.setMinimumHeight(700)
@@ -155,18 +258,34 @@ class MainWindow(QMainWindow):
         seg_label_list_group.setMaximumWidth(400)
         seg_label_list_v_layout = QVBoxLayout()
 
-        self.seg_label_list_table = QTableWidget()
-        self.seg_label_list_table.setColumnCount(4)
-        self.seg_label_list_table.setHorizontalHeaderLabels(["Select", "Show", "Type", "Label"])
-        self.seg_label_list_table.setWordWrap(True)
-        self.seg_label_list_table.clearContents()
-        self.seg_label_list_table.setRowCount(0)
         self.label_drop_down_choices = []
+        self.marking_store = self.old_image_pixmap.marking_store
+        self.edit_history = edit_history.EditHistory(self.marking_store)
+
+        # Autosave journal of the markings of the opened image, fsync'd in batches
+        self.autosave = None
+        self.settings = QSettings("AlphaHKU", "AlphaSEG")
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self.sync_autosave)
+        self.autosave_timer.start(int(autosave_journal.FSYNC_INTERVAL * 1000))
+        QTimer.singleShot(0, self.offer_autosave_recovery)
+        self.marking_table_model = marking_table_model.MarkingTableModel(self.marking_store, self)
+        self.seg_label_list_table = QTableView()
+        self.seg_label_list_table.setModel(self.marking_table_model)
+        self.seg_label_list_table.setItemDelegateForColumn(marking_table_model.LABEL_COLUMN, marking_table_model.LabelDelegate(lambda: self.label_drop_down_choices, self.seg_label_list_table))
+        self.seg_label_list_table.setEditTriggers(QAbstractItemView.CurrentChanged | QAbstractItemView.SelectedClicked | QAbstractItemView.DoubleClicked)
+        self.seg_label_list_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.seg_label_list_table.setWordWrap(True)
+        self.seg_label_list_table.horizontalHeader().setStretchLastSection(True)
+        self.seg_label_list_table.verticalHeader().setDefaultSectionSize(24)  # Fixed row height, no per-row measuring
 
         seg_label_list_function_h_layout = QHBoxLayout()
         self.remove_mask_button = QPushButton("Remove Selected")
         self.remove_mask_button.clicked.connect(self.remove_selected)
         seg_label_list_function_h_layout.addWidget(self.remove_mask_button)
+        self.simplify_mask_button = QPushButton("Simplify Selected")
+        self.simplify_mask_button.clicked.connect(self.simplify_selected)
+        seg_label_list_function_h_layout.addWidget(self.simplify_mask_button)
 
         seg_label_list_function_h_layout_2 = QHBoxLayout()
         self.remove_all_mask_button = QPushButton("Remove All")
@@ -221,53 +340,173 @@ class MainWindow(QMainWindow):
         self.old_image_pixmap.zoom = False
         self.magnify_zoom_button.setChecked(False)
 
-    def set_pixmap_from_array(self, image_arr):
-        image_arr = image_arr[:, :, 0:3].astype('uint8')
-        qimage = QImage(image_arr, image_arr.shape[1], image_arr.shape[0], 3 * image_arr.shape[1], QImage.Format_RGB888)
+    def set_pixmap_from_array(self, image_arr, pyramid=None):
+        # Input: pyramid = ImagePyramid of the image if already built (e.g. by the dataset prefetch)
+        image_arr = image_arr[:, :, 0:3]
+        if image_arr.dtype != np.uint8:
+            image_arr = image_arr.astype('uint8')
         self.image_width_orig = image_arr.shape[1]
         self.image_height_orig = image_arr.shape[0]
-        self.qpixmap = QPixmap.fromImage(qimage)
-        self.qpixmap = self.qpixmap.scaled(self.pixmap_display_size[0], self.pixmap_display_size[1], Qt.KeepAspectRatio)
-        self.qpixmap_orig = self.qpixmap.copy()
+        # The canvas builds the image pyramid once and renders the display from it
+        self.old_image_pixmap.display_adjustment = None
+        self.old_image_pixmap.set_image(image_arr, self.pixmap_display_size, pyramid=pyramid)
+        self.qpixmap_orig = self.old_image_pixmap.canvas_orig
+        self.qpixmap = self.qpixmap_orig
         self.image_width_scaled = self.qpixmap_orig.rect().width()
         self.image_height_scaled = self.qpixmap_orig.rect().height()
-        self.old_image_pixmap.canvas_orig = self.qpixmap_orig
-        self.old_image_pixmap.initiate_canvas_and_set_pixmap(self.qpixmap)
-        self.old_image_pixmap.canvas_display_size = self.pixmap_display_size
-        self.old_image_pixmap.canvas_orig_size = (self.image_width_orig, self.image_height_orig)
-        self.old_image_pixmap.canvas_array = image_arr
-        self.old_image_pixmap.canvas_scaling = self.image_width_orig / self.image_width_scaled
-        self.old_image_pixmap.zoom_corner1 = QPoint(0, 0)
-        self.old_image_pixmap.zoom_corner2 = QPoint(image_arr.shape[1], image_arr.shape[0])
-
-    def process_tif(self, tif_image):
-        def normalize_image(image):
-            imin, imax = np.min(image), np.max(image)
-            irange = abs(imax - imin)
-            if irange == 0:
-                return image
-            else:
-                return (image - imin) / irange
-        tif_red = tif_image[:, :, 2]
-        tif_green = tif_image[:, :, 1]
-        tif_blue = tif_image[:, :, 0]
-        tif_image = (normalize_image(np.stack((tif_red, tif_green, tif_blue), axis=2)) * 255.0).astype('uint8')
-        return tif_image
+        # New source image for the adjustments
+        self.source_image = image_arr
+        self.source_pyramid = self.old_image_pixmap.image_pyramid
+        self.adjusted_images.clear()
+        self.adjustment_generation += 1
+        if len(self.build_adjustment_pipeline()) > 0:
+            self.apply_adjustments()
+
+    def process_tif(self, tif_image, channel_order="BGR"):
+        # Streaming normalization, see image_io.process_tif
+        return image_io.process_tif(tif_image, channel_order)
 
     def browse_image(self):
         support_file_format = ["png", "PNG", "jpg", "JPG", "tif", "TIF", "tiff", "TIFF"]
         open_file = QFileDialog.getOpenFileName(self, "Open File", "", "All Files (*);;PNG (*.png;*.PNG);;JPEG (*.jpg;*.JPG);;TIFF (*.tif;*.TIF;*.tiff;*.TIFF")[0]
         if open_file[-3:] in support_file_format:
-            self.orig_image_dir = open_file
-            self.orig_image = self.image_loader(self.orig_image_dir)
-            self.set_pixmap_from_array(self.orig_image)
-            self.old_image_size_label.setText(f"Size: {self.orig_image.shape[1]} x {self.orig_image.shape[0]}")
-            self.old_image_dir_label.setText(f"Directory: {self.orig_image_dir}")
+            self.open_image(open_file)
         elif open_file == "":
             pass
         else:
             return
 
+    def open_image(self, image_dir, restore_autosave=None, preloaded=None):
+        # Input: restore_autosave = True/False to restore or discard autosaved markings without asking
+        # Input: preloaded = (image, pyramid) from _load_for_display
+        if preloaded is None:
+            preloaded = (self.image_loader(image_dir), None)
+        # The current markings are kept when the image cannot be read
+        self.close_image_markings()
+        self.orig_image_dir = image_dir
+        self.orig_image = preloaded[0]
+        self.set_pixmap_from_array(self.orig_image, pyramid=preloaded[1])
+        self.old_image_size_label.setText(f"Size: {self.orig_image.shape[1]} x {self.orig_image.shape[0]}")
+        self.old_image_dir_label.setText(f"Directory: {self.orig_image_dir}")
+        if self.cellpose_option_window is not None:
+            self.cellpose_option_window.set_image(self.old_image_pixmap.canvas_array, image_dir)
+        self.start_autosave(image_dir, restore_autosave)
+
+    def close_image_markings(self):
+        # The markings of the image being left are saved by its journal (and database) before the store is emptied,
+        # so the journal of the next image never starts from them
+        self.write_annotation_db()
+        self.stop_autosave()
+        self.marking_store.clear()
+        self.edit_history.clear()
+
+    @staticmethod
+    def _load_for_display(image_dir, tile_cache):
+        # Runs in a prefetch thread: decode, keep 3 uint8 channels and build the pyramid as set_pixmap_from_array would
+        image = image_io.load_image(image_dir)
+        display = image[:, :, 0:3]
+        if display.dtype != np.uint8:
+            display = display.astype('uint8')
+        return image, image_pyramid.ImagePyramid(display, tile_cache=tile_cache)
+
+    # Dataset ################################################################
+    def open_dataset(self):
+        folder = QFileDialog.getExistingDirectory(self, "Open Folder")
+        if folder == "":
+            return
+        images = image_io.list_images(folder)
+        if len(images) == 0:
+            QMessageBox.warning(self, "Open Folder", f"No image found in {folder}")
+            return
+        self.image_prefetcher.clear()
+        self.open_annotation_db(folder)
+        self.dataset_images = images
+        self.dataset_index = -1
+        self.show_dataset_image(0)
+        self.open_dataset_browser()
+
+    def open_dataset_browser(self):
+        if len(self.dataset_images) == 0 or self.thumbnail_cache is None:
+            return
+        if self.dataset_browser is None or self.dataset_browser.image_dirs is not self.dataset_images:
+            if self.dataset_browser is not None:
+                self.dataset_browser.close()
+            self.dataset_browser = dataset_browser_window.DatasetBrowserWindow(self.dataset_images, self.thumbnail_cache)
+            self.dataset_browser.image_selected_signal.connect(self.show_dataset_image)
+        self.dataset_browser.set_current(self.dataset_index)
+        self.dataset_browser.show()
+        self.dataset_browser.raise_()
+
+    def open_annotation_db(self, folder):
+        # The markings of the image being left are recorded in the database of its own dataset first
+        self.write_annotation_db()
+        if self.dataset_summary is not None:
+            self.dataset_summary.close()
+            self.dataset_summary = None
+        if self.annotation_db is not None:
+            self.annotation_db.close()
+        try:
+            self.annotation_db = annotation_db.AnnotationDB(annotation_db.default_db_path(folder))
+        except (sqlite3.Error, OSError, ValueError) as error:
+            self.annotation_db = None
+            self.base_status_bar.showMessage(f"Annotation database unavailable: {error}", 5000)
+
+    def write_annotation_db(self):
+        if self.annotation_db is None or not 0 <= self.dataset_index < len(self.dataset_images):
+            return
+        if self.orig_image_dir != self.dataset_images[self.dataset_index]:
+            return  # Another image was opened outside of the dataset
+        try:
+            self.annotation_db.write_image(self.orig_image_dir, self.marking_store, (self.image_width_orig, self.image_height_orig))
+        except sqlite3.Error as error:
+            self.base_status_bar.showMessage(f"Annotation database not updated: {error}", 5000)
+
+    def open_dataset_summary(self):
+        if self.annotation_db is None:
+            QMessageBox.warning(self, "Dataset Summary", "Open a folder of images first")
+            return
+        self.write_annotation_db()
+        if self.dataset_summary is None:
+            self.dataset_summary = dataset_summary_window.DatasetSummaryWindow(self.annotation_db)
+            self.dataset_summary.image_selected_signal.connect(self.show_dataset_image_path)
+        else:
+            self.dataset_summary.refresh()
+        self.dataset_summary.show()
+        self.dataset_summary.raise_()
+
+    def show_dataset_image_path(self, image_dir):
+        paths = [os.path.abspath(path) for path in self.dataset_images]
+        if os.path.abspath(image_dir) in paths:
+            self.show_dataset_image(paths.index(os.path.abspath(image_dir)))
+        else:
+            self.base_status_bar.showMessage(f"{image_dir} is not in the opened folder", 5000)
+
+    def show_dataset_image(self, index):
+        if not 0 <= index < len(self.dataset_images):
+            return
+        image_dir = self.dataset_images[index]
+        try:
+            preloaded = self.image_prefetcher.get(image_dir)
+        except (OSError, ValueError) as error:  # Unreadable or corrupted image file
+            self.base_status_bar.showMessage(f"{image_dir} could not be opened: {error}", 5000)
+            return
+        # Markings of the previous image stay in its autosave files, those of the new image are restored from its own.
+        # The index changes afterwards, so open_image records the previous image in the database under its own path
+        self.open_image(image_dir, restore_autosave=True, preloaded=preloaded)
+        self.dataset_index = index
+        neighbours = [self.dataset_images[i] for i in range(index + 1, min(index + 1 + PREFETCH_AHEAD, len(self.dataset_images)))]
+        neighbours += [self.dataset_images[i] for i in range(max(0, index - PREFETCH_BEHIND), index)]
+        self.image_prefetcher.prefetch(neighbours)
+        if self.dataset_browser is not None:
+            self.dataset_browser.set_current(index)
+        self.base_status_bar.showMessage(f"Image {index + 1} / {len(self.dataset_images)}", 3000)
+
+    def next_image(self):
+        self.show_dataset_image(self.dataset_index + 1)
+
+    def previous_image(self):
+        self.show_dataset_image(self.dataset_index - 1)
+
     def save_image(self):
         save_file = QFileDialog.getSaveFileName(self, "Save File", "", "All Files (*);;PNG (*.png;*.PNG);;JPEG (*.jpg;*.JPG)")[0]
         self.new_image_dir = save_file
@@ -277,82 +516,69 @@ class MainWindow(QMainWindow):
         image_to_save_pil.save(self.new_image_dir)
 
     def image_loader(self, image_dir):
-        if image_dir.split(".")[-1] in ["tif", "TIF", "tiff", "TIFF"]:
-            return self.process_tif(cv2.imread(image_dir, -1))
-        return np.array(Image.open(image_dir))
-
-    def refresh_seg_label_list_table(self):
-        self.marking_info = self.old_image_pixmap.marking_info
-        self.seg_label_list_table.clearContents()
-        self.seg_label_list_table.setRowCount(0)
-
-        for i in range(0, len(self.marking_info)):
-            self.seg_label_list_table.insertRow(self.seg_label_list_table.rowCount())
-
-            # Check box for selection
-            table_select_check_box = QCheckBox()
-            table_select_check_box.setChecked(False)
-            # Check box for visualization option
-            table_show_check_box = QCheckBox()
-            table_show_check_box.setCheckState(self.marking_info[i][-1])
-            table_show_check_box.clicked.connect(self.refresh_pixmap_with_visualization_option)
-            # Labels for marking type (Contour/Bounding box)
-            table_area_type_text = QLabel()  # Set as label because the user cannot change the type of the marking
-            table_area_type_text.setText(str(self.marking_info[i][0]))
-            # Labels for marked areas
-            #table_area_label_text = QLineEdit()  # Set as line edit because the label can be changed
-            #table_area_label_text.setText(str(self.marking_info[i][1]))
-            #table_area_label_text.textChanged.connect(self.refresh_area_labels)
-            table_area_label_text = QComboBox()
-            table_area_label_text.addItem("NO LABEL")
-            table_area_label_text.addItems(self.label_drop_down_choices)
-            table_area_label_text.setCurrentText(str(self.marking_info[i][1]))
-            table_area_label_text.currentIndexChanged.connect(self.refresh_area_labels)
-
-            self.seg_label_list_table.setCellWidget(self.seg_label_list_table.rowCount() - 1, 0, table_select_check_box)
-            self.seg_label_list_table.setCellWidget(self.seg_label_list_table.rowCount() - 1, 1, table_show_check_box)
-            self.seg_label_list_table.setCellWidget(self.seg_label_list_table.rowCount() - 1, 2, table_area_type_text)
-            self.seg_label_list_table.setCellWidget(self.seg_label_list_table.rowCount() - 1, 3, table_area_label_text)
-
-    def refresh_pixmap_with_visualization_option(self):
-        if self.seg_label_list_table.rowCount() == 0:
-            pass
-        else:
-            for i in range(0, len(self.marking_info)):
-                if self.seg_label_list_table.cellWidget(i, 1).checkState() == Qt.Checked:
-                    self.marking_info[i][-1] = True
-                    self.marking_info[i][3] = False
-                elif self.seg_label_list_table.cellWidget(i, 1).checkState() == Qt.PartiallyChecked:
-                    self.marking_info[i][-1] = True
-                    self.marking_info[i][3] = True
-                else:
-                    self.marking_info[i][-1] = False
-            self.old_image_pixmap.marking_info = self.marking_info
-            self.old_image_pixmap.refresh_pixmap_acc_to_vis()
-
-    def refresh_area_labels(self, _):
-        if self.seg_label_list_table.rowCount() == 0:
-            pass
-        else:
-            for i in range(0, len(self.marking_info)):
-                self.marking_info[i][1] = self.seg_label_list_table.cellWidget(i, 3).currentText()
+        # TIFF files are memory-mapped and normalized strip by strip
+        return image_io.load_image(image_dir)
+
+    def select_marking_in_table(self, index):
+        # Toggle the "Select" check box of the clicked marking and bring its row into view
+        if index >= self.marking_table_model.rowCount():
+            return
+        self.marking_table_model.toggle_selected(index)
+        self.seg_label_list_table.selectRow(index)
+        self.seg_label_list_table.scrollTo(self.marking_table_model.index(index, 0))
 
     def reset_pixmap(self):
         self.old_image_pixmap.setPixmap(self.qpixmap_orig)
         self.old_image_pixmap.update()
 
     # Remove Markings ########################################################
+    def selected_markings(self):
+        # Output: numpy.ndarray of bool, state of the "Select" check box of every row
+        return self.marking_table_model.selected_markings()
+
     def remove_selected(self):
-        if self.seg_label_list_table.rowCount() == 0:
+        if self.marking_table_model.rowCount() == 0:
             pass
         else:
-            checked_list = []
-            for i in range(0, self.seg_label_list_table.rowCount()):
-                if self.seg_label_list_table.cellWidget(i, 0).isChecked():
-                    checked_list.append(True)
-                else:
-                    checked_list.append(False)
-            self.old_image_pixmap.clear_selected_markings(checked_list)
+            self.old_image_pixmap.clear_selected_markings(self.selected_markings())
+
+    # Simplify Markings ######################################################
+    def set_simplify_tolerance(self):
+        tolerance, accepted = QInputDialog.getDouble(self, "Polygon Simplification", "Tolerance in image pixels (0 = off):",
+                                                     self.old_image_pixmap.simplify_tolerance, 0.0, 100.0, 2)
+        if accepted:
+            self.old_image_pixmap.simplify_tolerance = tolerance
+
+    def simplify_selected(self):
+        tolerance = self.old_image_pixmap.simplify_tolerance
+        if tolerance <= 0:
+            tolerance, accepted = QInputDialog.getDouble(self, "Simplify Selected", "Tolerance in image pixels:", polygon_simplify.DEFAULT_TOLERANCE, 0.01, 100.0, 2)
+            if not accepted:
+                return
+        self.old_image_pixmap.simplify_selected_markings(self.selected_markings(), tolerance)
+
+    # Undo / Redo ############################################################
+    def undo_edit(self):
+        name = self.edit_history.undo()
+        if name is not None:
+            self.base_status_bar.showMessage(f"Undo: {name}", 3000)
+
+    def redo_edit(self):
+        name = self.edit_history.redo()
+        if name is not None:
+            self.base_status_bar.showMessage(f"Redo: {name}", 3000)
+
+    def update_undo_actions(self):
+        # Name the step each action would undo/redo (the actions stay enabled so the shortcuts always work)
+        undo_name, redo_name = self.edit_history.undo_name(), self.edit_history.redo_name()
+        self.undo_action.setText("&Undo" + (f" {undo_name}" if undo_name else ""))
+        self.redo_action.setText("&Redo" + (f" {redo_name}" if redo_name else ""))
+
+    def set_undo_depth(self):
+        depth, accepted = QInputDialog.getInt(self, "Undo History Depth", f"Undo steps kept ({self.edit_history.nbytes() / 1024:.0f} KB in use):",
+                                              self.edit_history.max_depth, 1, 100000)
+        if accepted:
+            self.edit_history.set_max_depth(depth)
 
     # Visualization ##########################################################
     def image_mask_overlay(self, image_orig, mask):
@@ -363,10 +589,13 @@ class MainWindow(QMainWindow):
     # Import Points ##########################################################
     def import_points_from_json(self):
         support_file_format = ["JSON", "json"]
-        open_file = QFileDialog.getOpenFileName(self, "Open File", "", "All Files (*);;JSON (*.json;*.JSON);;")[0]
-        if open_file[-4:] in support_file_format:
-            with open(open_file) as json_points:
-                data = json.load(json_points) # as dictionary
+        open_file = QFileDialog.getOpenFileName(self, "Open File", "", "All Files (*);;JSON (*.json;*.JSON);;Markings (*.npz);;")[0]
+        if open_file[-4:] in support_file_format or open_file[-4:] == ".npz":
+            # Points JSON is streamed polygon by polygon, the .npz sidecar holds the arrays directly
+            if open_file[-4:] == ".npz":
+                data = annotation_io.load_npz(open_file)
+            else:
+                data = annotation_io.read_points_json(open_file)
             self.import_points_json_window = import_points_window.ImportPointsWindow()
             self.import_points_json_window.fill_table(data)
             self.import_points_json_window.show()
@@ -377,33 +606,161 @@ class MainWindow(QMainWindow):
             return
     
     def finish_import_points_from_json(self):
-        self.old_image_pixmap.marking_info = self.import_points_json_window.marking_info
-        for i in range(0, len(self.old_image_pixmap.marking_info)):
-            if self.old_image_pixmap.marking_info[i][1] not in self.label_drop_down_choices:
-                self.label_drop_down_choices.append(self.old_image_pixmap.marking_info[i][1])
-        self.refresh_seg_label_list_table()
-        self.old_image_pixmap.refresh_pixmap_acc_to_vis()
+        # Replacing the markings is undone in one step
+        with self.edit_history.group("Import Markings"):
+            self.old_image_pixmap.marking_store.clear()
+            self.old_image_pixmap.marking_store.append_store(self.import_points_json_window.marking_store)
+        for label in set(self.old_image_pixmap.marking_store.labels()):
+            if label not in self.label_drop_down_choices:
+                self.label_drop_down_choices.append(label)
         self.import_points_json_window.close()
 
+    ##########################################################################
+    # Autosave ###############################################################
+    ##########################################################################
+    def start_autosave(self, image_dir, restore=None):
+        self.stop_autosave()
+        if autosave_journal.has_journal(image_dir):
+            try:
+                recovered, num_records = autosave_journal.recover(image_dir)
+            except (OSError, ValueError, KeyError) as error:
+                recovered, num_records = None, 0
+                self.base_status_bar.showMessage(f"Autosave of {image_dir} could not be read: {error}", 5000)
+            if recovered is not None and restore is None:
+                answer = QMessageBox.question(self, "Autosave", f"Autosaved markings were found for this image ({len(recovered)} markings).\nRestore them?",
+                                              QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+                restore = answer == QMessageBox.Yes
+            if recovered is not None and restore:
+                with self.edit_history.group("Restore Autosave"):
+                    self.marking_store.clear()
+                    self.marking_store.append_store(recovered)
+                for label in recovered.label_names[1:]:
+                    if label not in self.label_drop_down_choices:
+                        self.label_drop_down_choices.append(label)
+        try:
+            self.autosave = autosave_journal.AutosaveJournal(image_dir, self.marking_store)
+        except OSError as error:
+            self.base_status_bar.showMessage(f"Autosave disabled: {error}", 5000)
+            return
+        self.settings.setValue("autosave/image", image_dir)
+
+    def stop_autosave(self):
+        if self.autosave is not None:
+            self.autosave.close()
+            self.autosave = None
+
+    def sync_autosave(self):
+        if self.autosave is None:
+            return
+        if self.autosave.error is not None:
+            self.base_status_bar.showMessage(f"Autosave stopped: {self.autosave.error}", 5000)
+            self.autosave = None
+            return
+        try:
+            self.autosave.sync()
+        except OSError as error:
+            self.autosave.error = error
+
+    def offer_autosave_recovery(self):
+        # After a crash, reopen the last image and replay its journal
+        image_dir = self.settings.value("autosave/image", "")
+        clean_exit = self.settings.value("autosave/clean_exit", True, type=bool)
+        self.settings.setValue("autosave/clean_exit", False)
+        if clean_exit or not image_dir or not os.path.exists(image_dir) or not autosave_journal.has_journal(image_dir):
+            return
+        answer = QMessageBox.question(self, "Autosave", f"AlphaSEG did not close properly.\nReopen {image_dir} and restore its autosaved markings?",
+                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if answer == QMessageBox.Yes:
+            self.open_image(image_dir, restore_autosave=True)
+
+    def closeEvent(self, event):
+        self.stop_autosave()
+        self.image_prefetcher.shutdown()
+        if self.dataset_browser is not None:
+            self.dataset_browser.close()
+        if self.dataset_summary is not None:
+            self.dataset_summary.close()
+        if self.annotation_db is not None:
+            self.write_annotation_db()
+            self.annotation_db.close()
+            self.annotation_db = None
+        self.settings.setValue("autosave/clean_exit", True)
+        super(MainWindow, self).closeEvent(event)
+
+    ##########################################################################
+    # Session ################################################################
+    ##########################################################################
+    def save_session(self):
+        if self.session_dir is None:
+            self.save_session_as()
+            return
+        self.write_session(self.session_dir)
+
+    def save_session_as(self):
+        save_file = QFileDialog.getSaveFileName(self, "Save Session", "", f"Session (*{session_io.SESSION_SUFFIX});;All Files (*)")[0]
+        if save_file == "":
+            return
+        self.write_session(save_file)
+
+    def write_session(self, save_file):
+        # The session path only changes once the file is written
+        image_size = (self.image_width_orig, self.image_height_orig) if self.orig_image_dir else None
+        try:
+            self.session_dir = session_io.save_session(save_file, self.marking_store, self.orig_image_dir, image_size, self.label_drop_down_choices)
+        except (OSError, ValueError) as error:
+            QMessageBox.warning(self, "Save Session", f"The session could not be saved: {error}")
+            return
+        self.base_status_bar.showMessage(f"Session saved to {self.session_dir}", 3000)
+
+    def open_session(self):
+        open_file = QFileDialog.getOpenFileName(self, "Open Session", "", f"Session (*{session_io.SESSION_SUFFIX});;All Files (*)")[0]
+        if open_file == "":
+            return
+        try:
+            session = session_io.load_session(open_file)
+        except (OSError, ValueError, KeyError) as error:
+            QMessageBox.warning(self, "Open Session", str(error))
+            return
+        image_dir = session_io.resolve_image_path(session, open_file)
+        if image_dir is None:
+            if session.image_path:
+                QMessageBox.warning(self, "Open Session", f"Image not found: {session.image_path}\nThe markings are opened on the current image.")
+        else:
+            if not session_io.image_matches(session, image_dir):
+                QMessageBox.warning(self, "Open Session", f"{image_dir} has changed since the session was saved, the markings may not match it.")
+            self.open_image(image_dir, restore_autosave=False)  # Replaced by the session markings anyway
+        self.marking_store.clear()
+        self.marking_store.append_store(session.markings)
+        # Undo starts from the opened session
+        self.edit_history.clear()
+        for label in session.label_choices + session.markings.label_names[1:]:
+            if label not in self.label_drop_down_choices:
+                self.label_drop_down_choices.append(label)
+        self.session_dir = open_file
+
     ##########################################################################
     # Export Option ##########################################################
     ##########################################################################
     def export_with_option(self):
-        self.export_option_window = export_option_window.ExportOptionWindow(self.marking_info, (self.image_width_orig, self.image_height_orig), (self.image_width_scaled, self.image_height_scaled), self.orig_image_dir)
+        self.export_option_window = export_option_window.ExportOptionWindow(self.old_image_pixmap.marking_store, (self.image_width_orig, self.image_height_orig), (self.image_width_scaled, self.image_height_scaled), self.orig_image_dir)
         self.export_option_window.show()
 
     ##########################################################################
     # Automation #############################################################
     ##########################################################################
     def generate_mask_with_cellpose(self):
-        self.cellpose_option_window = cellpose_option_window.CellposeOptionWindow(image_arr=self.old_image_pixmap.canvas_array, marking_info=self.old_image_pixmap.marking_info)
+        # A single window, so a segmentation still running keeps reporting to the window that started it
+        if self.cellpose_option_window is None:
+            self.cellpose_option_window = cellpose_option_window.CellposeOptionWindow(image_arr=self.old_image_pixmap.canvas_array, marking_store=self.old_image_pixmap.marking_store,
+                                                                                    simplify_tolerance=self.old_image_pixmap.simplify_tolerance, image_dir=self.orig_image_dir)
+            self.cellpose_option_window.cellpose_done_signal.connect(self.finish_generate_mask_with_cellpose)
+        else:
+            self.cellpose_option_window.set_image(self.old_image_pixmap.canvas_array, self.orig_image_dir)
         self.cellpose_option_window.show()
-        self.cellpose_option_window.cellpose_done_signal.connect(self.finish_generate_mask_with_cellpose)
+        self.cellpose_option_window.raise_()
 
     def finish_generate_mask_with_cellpose(self):
-        self.old_image_pixmap.marking_info = self.cellpose_option_window.marking_info
-        self.refresh_seg_label_list_table()
-        self.old_image_pixmap.refresh_pixmap_acc_to_vis()
+        # Table and canvas already follow the markings added to the store
         self.cellpose_option_window.close()
 
     ##########################################################################
@@ -418,15 +775,79 @@ class MainWindow(QMainWindow):
         #self.table_area_label_text.clear()
         #self.table_area_label_text.addItem("NO LABEL")
         self.label_drop_down_choices = self.preference_window.label
-        self.refresh_seg_label_list_table()
         #self.table_area_label_text.addItems(self.label_drop_down_choices)
 
     ##########################################################################
-    # Histogram Equalization #################################################
+    # Image Adjustment #######################################################
     ##########################################################################
     def run_hist_eq(self):
-        self.orig_image = cv2.cvtColor(self.orig_image, cv2.COLOR_BGR2GRAY)
-        self.orig_image = skimage.exposure.equalize_hist(self.orig_image)
-        self.orig_image = np.expand_dims(self.orig_image, -1)
-        self.orig_image = np.concatenate((self.orig_image, self.orig_image, self.orig_image), axis=-1) * 255.0
-        self.set_pixmap_from_array(self.orig_image)
\ No newline at end of file
+        self.apply_adjustments()
+
+    def toggle_gamma(self):
+        if self.gamma_action.isChecked():
+            gamma, accepted = QInputDialog.getDouble(self, "Gamma", "Gamma:", self.gamma_value, 0.1, 10.0, 2)
+            if not accepted:
+                self.gamma_action.setChecked(False)
+                return
+            self.gamma_value = gamma
+        self.apply_adjustments()
+
+    def build_adjustment_pipeline(self):
+        stages = []
+        if self.hist_eq_action.isChecked():
+            stages += [image_adjustment.Grayscale(), image_adjustment.HistogramEqualization()]
+        if self.clahe_action.isChecked():
+            stages.append(image_adjustment.CLAHE())
+        if self.percentile_window_action.isChecked():
+            stages.append(image_adjustment.PercentileWindow())
+        if self.gamma_action.isChecked():
+            stages.append(image_adjustment.Gamma(self.gamma_value))
+        return image_adjustment.AdjustmentPipeline(stages)
+
+    def apply_adjustments(self):
+        if self.source_image is None:
+            return
+        pipeline = self.build_adjustment_pipeline()
+        key = pipeline.key()
+        self.adjustment_generation += 1
+        generation = self.adjustment_generation
+        if len(pipeline) == 0:
+            self.show_adjusted_image(self.source_image, self.source_pyramid)
+        elif key in self.adjusted_images:
+            self.adjusted_images.move_to_end(key)
+            self.show_adjusted_image(*self.adjusted_images[key])
+        else:
+            # Preview: adjust the display-sized render of the original image right away
+            self.old_image_pixmap.display_adjustment = pipeline.apply
+            self.old_image_pixmap.set_image(self.source_image, self.pixmap_display_size, pyramid=self.source_pyramid, keep_view=True)
+            self.base_status_bar.showMessage("Adjusting full resolution image...")
+            # Full resolution in background
+            worker = background_worker.FunctionWorker(self._adjust_full_resolution, pipeline, self.source_image, self.old_image_pixmap.tile_cache)
+            worker.result_signal.connect(lambda result: self.finish_adjustments(result, generation))
+            worker.error_signal.connect(lambda message: self.adjustment_failed(message, generation))
+            worker.start()
+
+    @staticmethod
+    def _adjust_full_resolution(pipeline, image, tile_cache):
+        # Runs in a worker thread
+        adjusted = pipeline.apply(image)
+        return pipeline.key(), adjusted, image_pyramid.ImagePyramid(adjusted, tile_cache=tile_cache)
+
+    def finish_adjustments(self, result, generation):
+        # Input: generation = adjustment_generation when the worker was started
+        if generation != self.adjustment_generation:
+            return  # Another image or adjustment was chosen meanwhile, its own result is on the way
+        key, adjusted, pyramid = result
+        self.adjusted_images[key] = (adjusted, pyramid)
+        while len(self.adjusted_images) > ADJUSTED_IMAGE_CACHE_SIZE:
+            self.adjusted_images.popitem(last=False)
+        self.show_adjusted_image(adjusted, pyramid)
+        self.base_status_bar.clearMessage()
+
+    def adjustment_failed(self, message, generation):
+        if generation == self.adjustment_generation:
+            self.base_status_bar.showMessage(message)
+
+    def show_adjusted_image(self, image_arr, pyramid):
+        self.old_image_pixmap.display_adjustment = None
+        self.old_image_pixmap.set_image(image_arr, self.pixmap_display_size, pyramid=pyramid, keep_view=True)
@@ -0,0 +1,397 @@
+"""
+Array-backed storage for markings (contours and bounding boxes).
+
+All coordinates live in one contiguous int32 buffer in image (original) scale.
+Each marking is described by an offset into that buffer, a type code, a label
+code and a visibility bitmask, so thousands of Cellpose contours cost a few
+NumPy arrays instead of millions of QPoint objects.
+"""
+
+import numpy as np
+
+# Marking types
+CONTOUR = 0
+BOUNDING_BOX = 1
+MARKING_TYPES = ("Contour", "Bounding Box")
+
+# Visibility bitmask
+VISIBLE = 1
+NUMBER_VISIBLE = 2
+
+NO_LABEL = "NO LABEL"
+
+# Change notifications, sent to the listeners as (kind, indices)
+ADDED = "added"                        # indices = range of the new markings
+INSERTED = "inserted"                  # indices = new indices of markings inserted between existing ones
+ABOUT_TO_REMOVE = "about_to_remove"    # Sent before the markings are removed, while they can still be read
+REMOVED = "removed"                    # indices = former indices of the removed markings
+ABOUT_TO_UPDATE = "about_to_update"    # Sent before the points of the markings are replaced
+UPDATED = "updated"                    # Points replaced, indices unchanged
+ABOUT_TO_CHANGE_LABELS = "about_to_change_labels"
+LABELS_CHANGED = "labels_changed"
+ABOUT_TO_CHANGE_VISIBILITY = "about_to_change_visibility"
+VISIBILITY_CHANGED = "visibility_changed"
+ABOUT_TO_CLEAR = "about_to_clear"      # indices = range of every marking
+CLEARED = "cleared"                    # indices = empty range
+
+
+class MarkingStore:
+    __slots__ = ("_coords", "_offsets", "_type_codes", "_label_codes", "_flags",
+                 "_num_markings", "_num_points", "label_names", "_label_lookup", "_generation", "_listeners")
+
+    def __init__(self, point_capacity=1024, marking_capacity=64):
+        self._coords = np.empty((point_capacity, 2), dtype=np.int32)
+        self._offsets = np.zeros(marking_capacity + 1, dtype=np.int64)
+        self._type_codes = np.empty(marking_capacity, dtype=np.uint8)
+        self._label_codes = np.empty(marking_capacity, dtype=np.int32)
+        self._flags = np.empty(marking_capacity, dtype=np.uint8)
+        self._num_markings = 0
+        self._num_points = 0
+        self._generation = 0  # Increased whenever existing markings are removed or moved
+        # Label vocabulary, code 0 is always "NO LABEL"
+        self.label_names = [NO_LABEL]
+        self._label_lookup = {NO_LABEL: 0}
+        self._listeners = []
+
+    ##########################################################################
+    ## Change Notifications ##################################################
+    ##########################################################################
+    def add_listener(self, listener):
+        # Input: listener = function(kind, indices) called after each change (and before removals/updates)
+        # Views apply the change itself instead of rebuilding from the whole store
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, kind, indices):
+        for listener in list(self._listeners):
+            listener(kind, indices)
+
+    ##########################################################################
+    ## Basic Information #####################################################
+    ##########################################################################
+    def __len__(self):
+        return self._num_markings
+
+    @property
+    def generation(self):
+        # Caches built on the coordinates stay valid while the generation is unchanged
+        # (appending markings or changing labels/visibility does not change it)
+        return self._generation
+
+    @property
+    def num_points(self):
+        return self._num_points
+
+    @property
+    def coords(self):
+        # View of all coordinates, shape (num_points, 2)
+        return self._coords[:self._num_points]
+
+    @property
+    def offsets(self):
+        # View of the offsets, shape (num_markings + 1,)
+        return self._offsets[:self._num_markings + 1]
+
+    @property
+    def type_codes(self):
+        return self._type_codes[:self._num_markings]
+
+    @property
+    def label_codes(self):
+        return self._label_codes[:self._num_markings]
+
+    @property
+    def flags(self):
+        return self._flags[:self._num_markings]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def points(self, index):
+        # Zero-copy view of the points of one marking, shape (N, 2)
+        return self._coords[self._offsets[index]:self._offsets[index + 1]]
+
+    def marking_type(self, index):
+        return MARKING_TYPES[self._type_codes[index]]
+
+    def label(self, index):
+        return self.label_names[self._label_codes[index]]
+
+    def labels(self):
+        return [self.label_names[code] for code in self.label_codes]
+
+    def is_visible(self, index):
+        return bool(self._flags[index] & VISIBLE)
+
+    def is_number_visible(self, index):
+        return bool(self._flags[index] & NUMBER_VISIBLE)
+
+    def bounds(self):
+        # Output: (num_markings, 4) array of [MIN_X, MIN_Y, MAX_X, MAX_Y]
+        if self._num_markings == 0:
+            return np.empty((0, 4), dtype=np.int32)
+        starts = self.offsets[:-1]
+        coords = self.coords
+        return np.concatenate((np.minimum.reduceat(coords, starts, axis=0),
+                               np.maximum.reduceat(coords, starts, axis=0)), axis=1)
+
+    ##########################################################################
+    ## Labels ################################################################
+    ##########################################################################
+    def label_code(self, label):
+        # Register the label in the vocabulary if it is new
+        label = str(label)
+        code = self._label_lookup.get(label)
+        if code is None:
+            code = len(self.label_names)
+            self.label_names.append(label)
+            self._label_lookup[label] = code
+        return code
+
+    def set_label(self, index, label):
+        # Input: index = marking index or array of indices
+        indices = np.atleast_1d(np.asarray(index, dtype=np.int64))
+        self.set_label_codes(indices, np.full(len(indices), self.label_code(label), dtype=np.int32))
+
+    def set_label_codes(self, indices, codes):
+        # Input: codes = label code of each marking, from label_code()
+        self._notify(ABOUT_TO_CHANGE_LABELS, indices)
+        self._label_codes[indices] = codes
+        self._notify(LABELS_CHANGED, indices)
+
+    def set_visibility(self, index, visible, number_visible=None):
+        # Input: index = marking index or array of indices
+        indices = np.atleast_1d(np.asarray(index, dtype=np.int64))
+        flags = np.full(len(indices), VISIBLE if visible else 0, dtype=np.uint8)
+        if number_visible is None:
+            flags |= self._flags[indices] & NUMBER_VISIBLE
+        elif number_visible:
+            flags |= NUMBER_VISIBLE
+        self.set_flags(indices, flags)
+
+    def set_flags(self, indices, flags):
+        # Input: flags = visibility bitmask of each marking
+        self._notify(ABOUT_TO_CHANGE_VISIBILITY, indices)
+        self._flags[indices] = flags
+        self._notify(VISIBILITY_CHANGED, indices)
+
+    ##########################################################################
+    ## Append / Delete / Filter ##############################################
+    ##########################################################################
+    def _reserve(self, num_markings, num_points):
+        if num_points > self._coords.shape[0]:
+            capacity = max(num_points, 2 * self._coords.shape[0])
+            coords = np.empty((capacity, 2), dtype=np.int32)
+            coords[:self._num_points] = self._coords[:self._num_points]
+            self._coords = coords
+        if num_markings > self._type_codes.shape[0]:
+            capacity = max(num_markings, 2 * self._type_codes.shape[0])
+            offsets = np.zeros(capacity + 1, dtype=np.int64)
+            offsets[:self._num_markings + 1] = self.offsets
+            self._offsets = offsets
+            for name in ("_type_codes", "_label_codes", "_flags"):
+                old = getattr(self, name)
+                new = np.empty(capacity, dtype=old.dtype)
+                new[:self._num_markings] = old[:self._num_markings]
+                setattr(self, name, new)
+
+    @staticmethod
+    def _as_polygons(polygons):
+        # Output: [numpy.ndarray(N, 2) of int32, ...], a marking without points has no bounds and is rejected
+        polygons = [np.asarray(polygon, dtype=np.int32).reshape(-1, 2) for polygon in polygons]
+        if any(len(polygon) == 0 for polygon in polygons):
+            raise ValueError("A marking needs at least one point")
+        return polygons
+
+    @staticmethod
+    def _flags_from(visible, number_visible):
+        return (VISIBLE if visible else 0) | (NUMBER_VISIBLE if number_visible else 0)
+
+    def append(self, marking_type, label, points, visible=True, number_visible=True):
+        # Input: points = array-like of shape (N, 2) in real scale
+        # Output: index of the new marking
+        return self.extend(marking_type, label, [points], visible, number_visible)[0]
+
+    def extend(self, marking_type, label, polygons, visible=True, number_visible=True):
+        # Input: polygons = [array-like (N, 2), ...], all with the same type and label
+        # Output: range of the new marking indices
+        polygons = self._as_polygons(polygons)
+        start = self._num_markings
+        if len(polygons) == 0:
+            return range(start, start)
+        lengths = np.fromiter((len(polygon) for polygon in polygons), dtype=np.int64, count=len(polygons))
+        num_new_points = int(lengths.sum())
+        end = start + len(polygons)
+        self._reserve(end, self._num_points + num_new_points)
+        self._coords[self._num_points:self._num_points + num_new_points] = np.concatenate(polygons, axis=0)
+        self._offsets[start + 1:end + 1] = self._num_points + np.cumsum(lengths)
+        self._type_codes[start:end] = MARKING_TYPES.index(marking_type)
+        self._label_codes[start:end] = self.label_code(label)
+        self._flags[start:end] = self._flags_from(visible, number_visible)
+        self._num_markings = end
+        self._num_points += num_new_points
+        self._notify(ADDED, range(start, end))
+        return range(start, end)
+
+    def append_store(self, other):
+        # Append every marking of another store, keeping types, labels and visibility
+        start = self._num_markings
+        if len(other) == 0:
+            return range(start, start)
+        end = start + len(other)
+        self._reserve(end, self._num_points + other.num_points)
+        self._coords[self._num_points:self._num_points + other.num_points] = other.coords
+        self._offsets[start + 1:end + 1] = self._num_points + other.offsets[1:]
+        self._type_codes[start:end] = other.type_codes
+        code_map = np.array([self.label_code(name) for name in other.label_names], dtype=np.int32)
+        self._label_codes[start:end] = code_map[other.label_codes]
+        self._flags[start:end] = other.flags
+        self._num_markings = end
+        self._num_points += other.num_points
+        self._notify(ADDED, range(start, end))
+        return range(start, end)
+
+    def insert_store(self, indices, other):
+        # Input: indices = sorted indices the markings of other get once inserted (e.g. where they were deleted from)
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(other) == 0:
+            return
+        end = self._num_markings + len(other)
+        inserted = np.zeros(end, dtype=bool)
+        inserted[indices] = True
+        lengths = np.zeros(end, dtype=np.int64)
+        lengths[inserted] = other.lengths()
+        lengths[~inserted] = self.lengths()
+        self._reserve(end, self._num_points + other.num_points)
+        point_inserted = np.repeat(inserted, lengths)
+        coords = np.empty((self._num_points + other.num_points, 2), dtype=np.int32)
+        coords[point_inserted] = other.coords
+        coords[~point_inserted] = self.coords
+        self._coords[:len(coords)] = coords
+        self._offsets[1:end + 1] = np.cumsum(lengths)
+        code_map = np.array([self.label_code(name) for name in other.label_names], dtype=np.int32)
+        for name, values in (("_type_codes", other.type_codes), ("_label_codes", code_map[other.label_codes]), ("_flags", other.flags)):
+            array = getattr(self, name)
+            merged = np.empty(end, dtype=array.dtype)
+            merged[inserted] = values
+            merged[~inserted] = array[:self._num_markings]
+            array[:end] = merged
+        self._num_markings = end
+        self._num_points = len(coords)
+        self._generation += 1
+        self._notify(INSERTED, indices)
+
+    def replace_points(self, indices, polygons):
+        # Input: indices of existing markings and their new points [array-like (N, 2), ...]
+        # Coordinates of the following markings move, so the generation changes
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return
+        polygons = self._as_polygons(polygons)
+        self._notify(ABOUT_TO_UPDATE, indices)
+        old_offsets = self.offsets.copy()
+        old_lengths = np.diff(old_offsets)
+        replaced = np.zeros(self._num_markings, dtype=bool)
+        replaced[indices] = True
+        new_lengths = old_lengths.copy()
+        new_lengths[indices] = [len(polygon) for polygon in polygons]
+        new_offsets = np.zeros(self._num_markings + 1, dtype=np.int64)
+        new_offsets[1:] = np.cumsum(new_lengths)
+        coords = np.empty((max(int(new_offsets[-1]), 1), 2), dtype=np.int32)
+        # Unchanged markings are moved as a block, each point shifted by the size change before it
+        keep_points = np.repeat(~replaced, old_lengths)
+        shift = np.repeat(new_offsets[:-1] - old_offsets[:-1], old_lengths)
+        coords[np.flatnonzero(keep_points) + shift[keep_points]] = self.coords[keep_points]
+        for index, polygon in zip(indices.tolist(), polygons):
+            coords[new_offsets[index]:new_offsets[index + 1]] = polygon
+        self._coords = coords
+        self._offsets[:self._num_markings + 1] = new_offsets
+        self._num_points = int(new_offsets[-1])
+        self._generation += 1
+        self._notify(UPDATED, indices)
+
+    def delete(self, selected):
+        # Input: selected = boolean mask of length len(self), or a sequence of indices
+        selected = np.asarray(selected)
+        remove = np.zeros(self._num_markings, dtype=bool)
+        if selected.dtype == bool:
+            remove[:len(selected)] = selected
+        else:
+            remove[selected.astype(np.int64)] = True
+        if not remove.any():
+            return
+        removed = np.flatnonzero(remove)
+        self._notify(ABOUT_TO_REMOVE, removed)
+        keep = ~remove
+        point_keep = np.repeat(keep, self.lengths())
+        coords = self.coords[point_keep]
+        lengths = self.lengths()[keep]
+        num_markings = int(keep.sum())
+        self._coords[:len(coords)] = coords
+        self._offsets[1:num_markings + 1] = np.cumsum(lengths)
+        self._type_codes[:num_markings] = self.type_codes[keep]
+        self._label_codes[:num_markings] = self.label_codes[keep]
+        self._flags[:num_markings] = self.flags[keep]
+        self._num_markings = num_markings
+        self._num_points = len(coords)
+        self._generation += 1
+        self._notify(REMOVED, removed)
+
+    def clear(self):
+        self._notify(ABOUT_TO_CLEAR, range(self._num_markings))
+        self._num_markings = 0
+        self._num_points = 0
+        self._generation += 1
+        self._notify(CLEARED, range(0))
+
+    def filter(self, marking_type=None, label=None, visible=None):
+        # Output: indices of the markings matching every given condition
+        keep = np.ones(self._num_markings, dtype=bool)
+        if marking_type is not None:
+            keep &= self.type_codes == MARKING_TYPES.index(marking_type)
+        if label is not None:
+            code = self._label_lookup.get(str(label))
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            keep &= self.label_codes == code
+        if visible is not None:
+            keep &= ((self.flags & VISIBLE) != 0) == bool(visible)
+        return np.flatnonzero(keep)
+
+    @classmethod
+    def from_arrays(cls, coords, offsets, type_codes, label_codes, label_names, flags=None):
+        # Build a store directly from its arrays (as saved by annotation_io.save_npz)
+        num_markings = len(type_codes)
+        if np.any(np.diff(np.asarray(offsets, dtype=np.int64)) <= 0):
+            raise ValueError("A marking needs at least one point")
+        store = cls(max(len(coords), 1), max(num_markings, 1))
+        store._coords[:len(coords)] = coords
+        store._offsets[:num_markings + 1] = offsets
+        store._type_codes[:num_markings] = type_codes
+        code_map = np.array([store.label_code(name) for name in label_names], dtype=np.int32)
+        store._label_codes[:num_markings] = code_map[np.asarray(label_codes, dtype=np.int64)]
+        store._flags[:num_markings] = VISIBLE | NUMBER_VISIBLE if flags is None else flags
+        store._num_markings = num_markings
+        store._num_points = len(coords)
+        return store
+
+    def copy(self):
+        other = MarkingStore(max(self._num_points, 1), max(self._num_markings, 1))
+        other.append_store(self)
+        return other
+
+    def subset(self, indices):
+        # Output: new MarkingStore holding a copy of the given markings, in the given order
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.lengths()[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        # Index of every point of the selected markings in the coordinate buffer
+        starts = np.repeat(self.offsets[indices] - offsets[:-1], lengths)
+        coords = self.coords[starts + np.arange(offsets[-1])]
+        return MarkingStore.from_arrays(coords, offsets, self.type_codes[indices], self.label_codes[indices],
+                                        self.label_names, self.flags[indices])
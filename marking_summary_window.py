@@ -1,15 +1,23 @@
 from PyQt5 import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
+import numpy as np
+
+# Custom modules
+import marking_store
 
 class MarkingSummaryWindow(QMainWindow):
 
-    def __init__(self, marking_info):
+    def __init__(self, marking_store):
         super(MarkingSummaryWindow, self).__init__()
-        self.marking_info = marking_info
+        self.marking_store = marking_store
         self.label_summary_info = None
+        self.label_codes = None  # Label code of every marking when last counted
+        self.label_counts = None  # Number of markings per label code
         self.setWindowTitle('Summary')
         self.build_gui()
+        # Counts follow the store while the window is open
+        self.marking_store.add_listener(self.on_markings_changed)
 
     def build_gui(self):
         base_widget = QWidget(self)
@@ -30,11 +38,52 @@ class MarkingSummaryWindow(QMainWindow):
         main_v_layout.addWidget(self.label_summary_table)
 
     def aggregate_statistics(self):
-        # self.marking_info = [TYPE, LABEL, [POINTS/CORNERS], VISUALIZATION]
-        label_set = list(set([self.marking_info[i][1] for i in range(0, len(self.marking_info))]))
-        self.label_summary_info = dict.fromkeys(label_set, 0)
-        for i in range(0, len(self.marking_info)):
-            self.label_summary_info[self.marking_info[i][1]] += 1
+        self.label_codes = self.marking_store.label_codes.copy()
+        self.label_counts = np.bincount(self.label_codes, minlength=len(self.marking_store.label_names))
+        self.update_label_summary_info()
+
+    def update_label_summary_info(self):
+        self.label_summary_info = {self.marking_store.label_names[code]: int(self.label_counts[code]) for code in np.flatnonzero(self.label_counts)}
+
+    def count_codes(self, codes):
+        # Output: number of markings per label code, sized for the whole vocabulary
+        num_labels = len(self.marking_store.label_names)
+        if len(self.label_counts) < num_labels:
+            self.label_counts = np.concatenate((self.label_counts, np.zeros(num_labels - len(self.label_counts), dtype=self.label_counts.dtype)))
+        return np.bincount(codes, minlength=num_labels)
+
+    def on_markings_changed(self, kind, indices):
+        # Only the added, removed or relabelled markings are counted again
+        if kind == marking_store.ADDED:
+            codes = self.marking_store.label_codes[indices[0]:indices[-1] + 1] if len(indices) > 0 else self.label_codes[:0]
+            added = self.count_codes(codes)
+            self.label_counts = self.label_counts + added
+            self.label_codes = np.concatenate((self.label_codes, codes))
+        elif kind == marking_store.INSERTED:
+            codes = self.marking_store.label_codes[indices]
+            added = self.count_codes(codes)
+            self.label_counts = self.label_counts + added
+            self.label_codes = np.insert(self.label_codes, indices - np.arange(len(indices)), codes)
+        elif kind == marking_store.REMOVED:
+            removed = self.count_codes(self.label_codes[indices])
+            self.label_counts = self.label_counts - removed
+            self.label_codes = np.delete(self.label_codes, indices)
+        elif kind == marking_store.LABELS_CHANGED:
+            codes = self.marking_store.label_codes[indices]
+            removed, added = self.count_codes(self.label_codes[indices]), self.count_codes(codes)
+            self.label_counts = self.label_counts - removed + added
+            self.label_codes[indices] = codes
+        elif kind == marking_store.CLEARED:
+            self.label_codes = self.label_codes[:0]
+            self.label_counts = np.zeros_like(self.label_counts)
+        else:
+            return
+        self.update_label_summary_info()
+        self.populate_label_summary_table()
+
+    def closeEvent(self, event):
+        self.marking_store.remove_listener(self.on_markings_changed)
+        super(MarkingSummaryWindow, self).closeEvent(event)
 
     def populate_label_summary_table(self):
         self.label_summary_table.clearContents()
@@ -54,6 +103,7 @@ if __name__ == '__main__':
     import sys
     import PyQt5
     app = PyQt5.QtWidgets.QApplication(sys.argv)
-    window = MarkingSummaryWindow(1)
+    import marking_store
+    window = MarkingSummaryWindow(marking_store.MarkingStore())
     window.show()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,189 @@
+"""
+Table model of the markings, read directly from the MarkingStore.
+
+QTableView only asks for the rows it shows, and the model follows the change
+notifications of the store (inserted rows, removed rows, changed cells), so
+updating after a new marking costs the same with 10 or 10,000 markings. Check boxes are check-state roles
+of the model and the label column is edited through a combo box delegate,
+which updates the store in place.
+"""
+
+import numpy as np
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PyQt5.QtWidgets import QStyledItemDelegate, QComboBox
+
+# Custom modules
+import marking_store
+
+SELECT_COLUMN = 0
+SHOW_COLUMN = 1
+TYPE_COLUMN = 2
+LABEL_COLUMN = 3
+HEADERS = ["Select", "Show", "Type", "Label"]
+
+
+class MarkingTableModel(QAbstractTableModel):
+    def __init__(self, marking_store, parent=None):
+        super(MarkingTableModel, self).__init__(parent)
+        self.marking_store = marking_store
+        self.selected = np.zeros(len(marking_store), dtype=bool)  # "Select" column, not part of the store
+        self._num_rows = len(marking_store)
+        self._removing_rows = False  # Removal announced with beginRemoveRows rather than a reset
+        self.marking_store.add_listener(self.on_markings_changed)
+
+    ##########################################################################
+    ## Change Notifications ##################################################
+    ##########################################################################
+    def on_markings_changed(self, kind, indices):
+        # Input: (kind, indices) as sent by MarkingStore listeners
+        if kind == marking_store.ADDED and len(indices) > 0:
+            self.beginInsertRows(QModelIndex(), indices[0], indices[-1])
+            self.selected = np.concatenate((self.selected, np.zeros(len(indices), dtype=bool)))
+            self._num_rows += len(indices)
+            self.endInsertRows()
+        elif kind == marking_store.INSERTED and len(indices) > 0:
+            # Rows of the inserted markings (e.g. an undone deletion), the store has already changed
+            contiguous = indices[-1] - indices[0] + 1 == len(indices)
+            if contiguous:
+                self.beginInsertRows(QModelIndex(), int(indices[0]), int(indices[-1]))
+            else:
+                self.beginResetModel()
+            self.selected = np.insert(self.selected, indices - np.arange(len(indices)), False)
+            self._num_rows = len(self.selected)
+            if contiguous:
+                self.endInsertRows()
+                self.headerDataChanged.emit(Qt.Vertical, int(indices[0]), self._num_rows - 1)
+            else:
+                self.endResetModel()
+        elif kind == marking_store.ABOUT_TO_REMOVE:
+            # A contiguous block keeps the scroll position and the selection of the other rows
+            self._removing_rows = indices[-1] - indices[0] + 1 == len(indices)
+            if self._removing_rows:
+                self.beginRemoveRows(QModelIndex(), int(indices[0]), int(indices[-1]))
+            else:
+                self.beginResetModel()
+        elif kind == marking_store.REMOVED:
+            self.selected = np.delete(self.selected, indices)
+            self._num_rows = len(self.selected)
+            if self._removing_rows:
+                self.endRemoveRows()
+            else:
+                self.endResetModel()
+            # Following markings are renumbered
+            if self._num_rows > 0:
+                self.headerDataChanged.emit(Qt.Vertical, int(indices[0]) if indices[0] < self._num_rows else self._num_rows - 1, self._num_rows - 1)
+        elif kind == marking_store.CLEARED:
+            self.beginResetModel()
+            self.selected = np.zeros(0, dtype=bool)
+            self._num_rows = 0
+            self.endResetModel()
+        elif kind == marking_store.LABELS_CHANGED and len(indices) > 0:
+            self.dataChanged.emit(self.index(int(indices.min()), LABEL_COLUMN), self.index(int(indices.max()), LABEL_COLUMN))
+        elif kind == marking_store.VISIBILITY_CHANGED and len(indices) > 0:
+            self.dataChanged.emit(self.index(int(indices.min()), SHOW_COLUMN), self.index(int(indices.max()), SHOW_COLUMN))
+
+    ##########################################################################
+    ## Selection #############################################################
+    ##########################################################################
+    def selected_markings(self):
+        return self.selected.copy()
+
+    def toggle_selected(self, row):
+        self.setData(self.index(row, SELECT_COLUMN), Qt.Unchecked if self.selected[row] else Qt.Checked, Qt.CheckStateRole)
+
+    ##########################################################################
+    ## QAbstractTableModel ###################################################
+    ##########################################################################
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._num_rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return str(section + 1)  # Same numbering as the markings on the canvas
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        column = index.column()
+        if column == SELECT_COLUMN:
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+        if column == SHOW_COLUMN:
+            # Cycles through hidden, shown with number and shown without number
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemIsUserTristate
+        if column == LABEL_COLUMN:
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsEditable
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.marking_store):
+            return None
+        row, column = index.row(), index.column()
+        if role == Qt.CheckStateRole:
+            if column == SELECT_COLUMN:
+                return Qt.Checked if self.selected[row] else Qt.Unchecked
+            if column == SHOW_COLUMN:
+                if not self.marking_store.is_visible(row):
+                    return Qt.Unchecked
+                return Qt.PartiallyChecked if self.marking_store.is_number_visible(row) else Qt.Checked
+        elif role in (Qt.DisplayRole, Qt.EditRole):
+            if column == TYPE_COLUMN:
+                return self.marking_store.marking_type(row)
+            if column == LABEL_COLUMN:
+                return self.marking_store.label(row)
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid():
+            return False
+        row, column = index.row(), index.column()
+        if role == Qt.CheckStateRole and column == SELECT_COLUMN:
+            self.selected[row] = value == Qt.Checked
+        elif role == Qt.CheckStateRole and column == SHOW_COLUMN:
+            # The store notifies the views (this model included) of the change
+            if value == Qt.Checked:
+                self.marking_store.set_visibility(row, True, number_visible=False)
+            elif value == Qt.PartiallyChecked:
+                self.marking_store.set_visibility(row, True, number_visible=True)
+            else:
+                self.marking_store.set_visibility(row, False)
+            return True
+        elif role == Qt.EditRole and column == LABEL_COLUMN:
+            if value == self.marking_store.label(row):
+                return False
+            self.marking_store.set_label(row, value)
+            return True
+        else:
+            return False
+        self.dataChanged.emit(index, index)
+        return True
+
+
+class LabelDelegate(QStyledItemDelegate):
+    # Combo box of the label choices, created only for the cell being edited
+    def __init__(self, label_choices, parent=None):
+        # Input: label_choices = function returning the current list of labels
+        super(LabelDelegate, self).__init__(parent)
+        self.label_choices = label_choices
+
+    def createEditor(self, parent, option, index):
+        editor = QComboBox(parent)
+        editor.addItem(marking_store.NO_LABEL)
+        editor.addItems([label for label in self.label_choices() if label != marking_store.NO_LABEL])
+        # Apply the choice as soon as it is made, as the previous per-row combo boxes did
+        editor.activated.connect(lambda _: self.commitData.emit(editor))
+        return editor
+
+    def setEditorData(self, editor, index):
+        label = index.data(Qt.EditRole)
+        if editor.findText(label) < 0:
+            editor.addItem(label)
+        editor.setCurrentText(label)
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText(), Qt.EditRole)
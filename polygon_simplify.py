@@ -0,0 +1,67 @@
+"""
+Polygon simplification for drawn and Cellpose contours (no Qt dependency).
+
+Douglas-Peucker (cv2.approxPolyDP) removes the vertices closer than the
+tolerance to the simplified outline, then repeated and collinear vertices are
+dropped. Tolerances are in image pixels, 0 disables simplification.
+"""
+
+import cv2
+import numpy as np
+
+# Custom modules
+import marking_store
+
+DEFAULT_TOLERANCE = 1.0
+
+
+def remove_collinear(points):
+    # Input: numpy.ndarray(N, 2) closed polygon
+    # Output: the polygon without repeated vertices and vertices lying on the segment between their neighbours
+    repeated = np.all(points == np.roll(points, 1, axis=0), axis=1)
+    if repeated.all():
+        return points[:1]
+    points = points[~repeated]
+    while len(points) > 3:
+        previous = np.roll(points, 1, axis=0)
+        following = np.roll(points, -1, axis=0)
+        incoming = (points - previous).astype(np.int64)
+        outgoing = (following - points).astype(np.int64)
+        cross = incoming[:, 0] * outgoing[:, 1] - incoming[:, 1] * outgoing[:, 0]
+        # A vertex is redundant when the outline goes straight on through it
+        straight = (cross == 0) & ((incoming * outgoing).sum(axis=1) > 0)
+        if not straight.any():
+            break
+        points = points[~straight]
+    return points
+
+
+def simplify_polygon(points, tolerance=DEFAULT_TOLERANCE):
+    # Input: array-like (N, 2) of [X, Y] in real scale
+    # Output: numpy.ndarray(M, 2) of int32, the original points if simplification would leave less than 3
+    points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+    if not tolerance or tolerance <= 0 or len(points) <= 3:
+        return points
+    simplified = cv2.approxPolyDP(points.reshape(-1, 1, 2), float(tolerance), True).reshape(-1, 2)
+    simplified = remove_collinear(simplified)
+    return simplified if len(simplified) >= 3 else points
+
+
+def simplify_polygons(polygons, tolerance=DEFAULT_TOLERANCE):
+    return [simplify_polygon(polygon, tolerance) for polygon in polygons]
+
+
+def simplify_markings(store, indices, tolerance=DEFAULT_TOLERANCE):
+    # Simplify the contours among the given markings in place (bounding boxes are left untouched)
+    # Output: indices of the markings whose points changed
+    indices = np.asarray(indices, dtype=np.int64)
+    contours = indices[store.type_codes[indices] == marking_store.CONTOUR]
+    changed, polygons = [], []
+    for i in contours.tolist():
+        points = store.points(i)
+        simplified = simplify_polygon(points, tolerance)
+        if len(simplified) != len(points):
+            changed.append(i)
+            polygons.append(simplified)
+    store.replace_points(changed, polygons)
+    return np.array(changed, dtype=np.int64)
@@ -0,0 +1,131 @@
+"""
+Uniform grid over the bounding boxes of the markings in a MarkingStore.
+
+Used by the canvas to draw only the markings intersecting the viewport and to
+find the marking under the mouse. The grid is stored as flat arrays (marking
+ids sorted by cell and one start offset per cell). Markings appended after the
+last build are kept in a small pending list and the grid is rebuilt lazily
+when the store removes or replaces markings.
+"""
+
+import numpy as np
+
+# Custom modules
+import marking_store
+
+MIN_CELL_SIZE = 32  # Real scale (pixels)
+MAX_PENDING = 4096  # Rebuild once this many markings were appended since the last build
+
+
+def point_in_polygon(x, y, polygon):
+    # Input: (x, y) in real scale, polygon = numpy.ndarray(N, 2)
+    # Output: True if the point is inside the polygon (even-odd rule)
+    px = polygon[:, 0].astype(np.float64)
+    py = polygon[:, 1].astype(np.float64)
+    qx = np.roll(px, -1)
+    qy = np.roll(py, -1)
+    crosses = (py > y) != (qy > y)
+    if not crosses.any():
+        return False
+    px, py, qx, qy = px[crosses], py[crosses], qx[crosses], qy[crosses]
+    x_intersect = px + (y - py) * (qx - px) / (qy - py)
+    return bool(np.count_nonzero(x < x_intersect) % 2)
+
+
+class MarkingSpatialIndex:
+    def __init__(self, store):
+        self.store = store
+        self.bounds = np.empty((0, 4), dtype=np.int32)  # [MIN_X, MIN_Y, MAX_X, MAX_Y] per marking
+        self.cell_size = MIN_CELL_SIZE
+        self.grid_origin = (0, 0)  # (X, Y) of cell (0, 0)
+        self.grid_shape = (0, 0)  # (Columns, Rows)
+        self._cell_ids = np.empty(0, dtype=np.int64)
+        self._cell_start = np.zeros(1, dtype=np.int64)
+        self._num_indexed = 0  # Markings [0, _num_indexed) are in the grid
+        self._generation = None
+
+    ##########################################################################
+    ## Synchronization #######################################################
+    ##########################################################################
+    def sync(self):
+        # Bring the index up to date with the store
+        if self._generation != self.store.generation or len(self.store) < len(self.bounds):
+            self.rebuild()
+        elif len(self.store) > len(self.bounds):
+            start = len(self.bounds)
+            starts = self.store.offsets[start:-1]
+            coords = self.store.coords
+            new_bounds = np.concatenate((np.minimum.reduceat(coords, starts, axis=0),
+                                         np.maximum.reduceat(coords, starts, axis=0)), axis=1)
+            self.bounds = np.concatenate((self.bounds, new_bounds), axis=0)
+            if len(self.bounds) - self._num_indexed > MAX_PENDING:
+                self.rebuild()
+
+    def rebuild(self):
+        self._generation = self.store.generation
+        self.bounds = self.store.bounds()
+        self._num_indexed = len(self.bounds)
+        if self._num_indexed == 0:
+            self.grid_shape = (0, 0)
+            self._cell_ids = np.empty(0, dtype=np.int64)
+            self._cell_start = np.zeros(1, dtype=np.int64)
+            return
+        # Cells about twice the typical marking size, so most markings touch few cells
+        sizes = np.maximum(self.bounds[:, 2] - self.bounds[:, 0], self.bounds[:, 3] - self.bounds[:, 1])
+        self.cell_size = max(MIN_CELL_SIZE, int(2 * np.median(sizes)))
+        self.grid_origin = (int(self.bounds[:, 0].min()), int(self.bounds[:, 1].min()))
+        self.grid_shape = (0, 0)
+        cells = self.cell_ranges(self.bounds)
+        self.grid_shape = (int(cells[:, 2].max()) + 1, int(cells[:, 3].max()) + 1)
+        # Expand every marking into the cells it spans
+        num_x = cells[:, 2] - cells[:, 0] + 1
+        num_y = cells[:, 3] - cells[:, 1] + 1
+        counts = num_x * num_y
+        ids = np.repeat(np.arange(len(cells), dtype=np.int64), counts)
+        local = np.arange(len(ids), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_x = cells[ids, 0] + local % num_x[ids]
+        cell_y = cells[ids, 1] + local // num_x[ids]
+        cell = cell_y * self.grid_shape[0] + cell_x
+        order = np.argsort(cell, kind="stable")
+        self._cell_ids = ids[order]
+        self._cell_start = np.searchsorted(cell[order], np.arange(self.grid_shape[0] * self.grid_shape[1] + 1))
+
+    def cell_ranges(self, rects):
+        # Input: numpy.ndarray(N, 4) of [MIN_X, MIN_Y, MAX_X, MAX_Y] in real scale
+        # Output: numpy.ndarray(N, 4) of [MIN_COL, MIN_ROW, MAX_COL, MAX_ROW], clipped to the grid
+        origin = np.array(self.grid_origin * 2)
+        cells = (np.asarray(rects, dtype=np.int64) - origin) // self.cell_size
+        if self.grid_shape != (0, 0):
+            limit = np.array([self.grid_shape[0] - 1, self.grid_shape[1] - 1] * 2)
+            cells = np.clip(cells, 0, limit)
+        return cells
+
+    ##########################################################################
+    ## Queries ###############################################################
+    ##########################################################################
+    def query(self, x_min, y_min, x_max, y_max):
+        # Output: sorted indices of the markings whose bounding box intersects the rectangle (real scale)
+        self.sync()
+        candidates = [np.arange(self._num_indexed, len(self.bounds), dtype=np.int64)]
+        if self._num_indexed > 0:
+            col_min, row_min, col_max, row_max = self.cell_ranges([[x_min, y_min, x_max, y_max]])[0]
+            for row in range(row_min, row_max + 1):
+                first = row * self.grid_shape[0]
+                candidates.append(self._cell_ids[self._cell_start[first + col_min]:self._cell_start[first + col_max + 1]])
+        candidates = np.unique(np.concatenate(candidates))
+        bounds = self.bounds[candidates]
+        overlap = ((bounds[:, 0] <= x_max) & (bounds[:, 2] >= x_min) &
+                   (bounds[:, 1] <= y_max) & (bounds[:, 3] >= y_min))
+        return candidates[overlap]
+
+    def hit_test(self, x, y, visible_only=True):
+        # Output: index of the topmost marking containing the point (real scale), or None
+        candidates = self.query(x, y, x, y)
+        if visible_only and len(candidates) > 0:
+            candidates = candidates[(self.store.flags[candidates] & marking_store.VISIBLE) != 0]
+        for i in candidates[::-1]:
+            if self.store.type_codes[i] == marking_store.BOUNDING_BOX:
+                return int(i)
+            if point_in_polygon(x, y, self.store.points(i)):
+                return int(i)
+        return None
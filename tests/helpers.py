@@ -0,0 +1,37 @@
+"""
+Store builders and checks shared by the tests.
+"""
+
+import numpy as np
+
+# Custom modules
+import marking_store
+
+
+def random_polygon(rng, num_points=None, size=1000):
+    num_points = num_points or int(rng.integers(3, 12))
+    return rng.integers(0, size, (num_points, 2)).astype(np.int32)
+
+
+def random_store(rng, num_markings=20, labels=("A", "B", "C")):
+    store = marking_store.MarkingStore(point_capacity=4, marking_capacity=2)  # Small capacities exercise the growth path
+    for _ in range(num_markings):
+        if rng.random() < 0.3:
+            corners = np.sort(rng.integers(0, 1000, (2, 2)), axis=0)
+            store.append("Bounding Box", rng.choice(labels), corners, visible=bool(rng.random() < 0.8))
+        else:
+            store.append("Contour", rng.choice(labels), random_polygon(rng), visible=bool(rng.random() < 0.8))
+    return store
+
+
+def store_snapshot(store):
+    # Output: comparable content of a store (label names instead of codes)
+    return ([store.points(i).tolist() for i in range(len(store))], store.type_codes.tolist(), store.labels(), store.flags.tolist())
+
+
+def assert_consistent(store):
+    offsets = store.offsets
+    assert offsets[0] == 0
+    assert offsets[-1] == store.num_points
+    assert np.all(np.diff(offsets) >= 0)
+    assert len(store.type_codes) == len(store.label_codes) == len(store.flags) == len(store)
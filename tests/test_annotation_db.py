@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+# Custom modules
+import annotation_db
+import annotation_export
+import image_io
+import marking_store
+from tests.helpers import random_store, store_snapshot
+
+
+@pytest.fixture
+def db(tmp_path):
+    with annotation_db.AnnotationDB(str(tmp_path / annotation_db.DB_NAME)) as db:
+        yield db
+
+
+def test_marking_geometry():
+    store = marking_store.MarkingStore()
+    store.append("Contour", "A", [[0, 0], [10, 0], [10, 10], [0, 10]])
+    store.append("Bounding Box", "B", [[25, 15], [5, 5]])
+    store.append("Contour", "A", [[0, 0], [4, 0], [0, 3]])
+    areas, x_min, y_min, x_max, y_max = annotation_db.marking_geometry(store)
+    np.testing.assert_allclose(areas, [100, 200, 6])
+    assert (x_min.tolist(), y_min.tolist(), x_max.tolist(), y_max.tolist()) == ([0, 5, 0], [0, 5, 0], [10, 25, 4], [10, 15, 3])
+
+
+def test_write_and_read_back(db, rng):
+    store = random_store(rng, 50)
+    db.write_image("a.png", store, (1000, 1000))
+    assert store_snapshot(db.read_image("a.png")) == store_snapshot(store)
+    assert db.read_image("missing.png") is None
+    # Writing again replaces the markings of the image
+    db.write_image("a.png", store.subset([0, 1]))
+    assert len(db.read_image("a.png")) == 2
+
+
+def test_summary_and_find(db):
+    first = marking_store.MarkingStore()
+    first.append("Contour", "cell", [[0, 0], [10, 0], [10, 10], [0, 10]])
+    first.append("Contour", "cell", [[0, 0], [20, 0], [20, 20], [0, 20]])
+    first.append("Bounding Box", "debris", [[0, 0], [5, 2]])
+    second = marking_store.MarkingStore()
+    second.append("Contour", "cell", [[0, 0], [10, 0], [10, 10], [0, 10]])
+    db.write_image("/data/first.png", first, (100, 100))
+    db.write_image("/data/second.png", second, (100, 100))
+    summary = {row[0]: row[1:] for row in db.label_summary()}
+    assert summary["cell"] == (3, 2, 600.0, pytest.approx(600 / 20000))
+    assert summary["debris"] == (1, 1, 10.0, pytest.approx(10 / 10000))
+    assert [row[0] for row in db.label_summary("Bounding Box")] == ["debris"]
+    assert db.images_with_label("cell") == [("/data/first.png", 2), ("/data/second.png", 1)]
+    assert db.images_with_label("cell", "Bounding Box") == []
+    assert db.images_with_label("unknown") == []
+    db.remove_image("/data/first.png")
+    assert db.label_names() == ["cell"]
+    assert db.image_paths() == ["/data/second.png"]
+
+
+def test_unknown_image_size_has_no_coverage(db, rng):
+    db.write_image("a.png", random_store(rng, 3, labels=("A",)))
+    assert db.label_summary()[0][4] is None
+
+
+def test_label_search_uses_index(db):
+    plan = db.connection.execute("EXPLAIN QUERY PLAN SELECT image_id, COUNT(*) FROM markings WHERE label_id = 1 GROUP BY image_id").fetchall()
+    assert "markings_label" in " ".join(str(step) for step in plan)
+
+
+def test_reopen_and_newer_schema(tmp_path, rng):
+    path = str(tmp_path / "annotations.sqlite")
+    with annotation_db.AnnotationDB(path) as db:
+        db.write_image("a.png", random_store(rng, 5), (10, 10))
+    with annotation_db.AnnotationDB(path) as db:
+        assert len(db.read_image("a.png")) == 5
+        db.connection.execute(f"PRAGMA user_version = {annotation_db.SCHEMA_VERSION + 1}")
+    with pytest.raises(ValueError):
+        annotation_db.AnnotationDB(path)
+
+
+def test_import_points_json_follows_batch_names(db, tmp_path, rng):
+    image_dir, json_dir = tmp_path / "images", tmp_path / "exported"
+    image_dir.mkdir(), json_dir.mkdir()
+    stores = {}
+    for file_name in ("cell.png", "cell.bmp", "sample.01.png", "sample.02.png"):
+        Image.fromarray(np.zeros((30, 40, 3), dtype=np.uint8)).save(image_dir / file_name)
+    for image_path, name in image_io.output_names(image_io.list_images(str(image_dir))).items():
+        stores[image_path] = marking_store.MarkingStore()
+        for _ in range(int(rng.integers(1, 6))):
+            x, y = rng.integers(0, 30), rng.integers(0, 20)
+            stores[image_path].append("Contour", str(rng.choice(["A", "B"])), [[x, y], [x + 8, y], [x + 4, y + 8]])
+        annotation_export.export_annotations(stores[image_path], str(json_dir), name, (40, 30), ["contour_points"])
+    assert annotation_db.import_points_json(db, str(image_dir), str(json_dir)) == 4
+    for image_path, store in stores.items():
+        imported = db.read_image(image_path)
+        # The points JSON groups markings by label
+        assert sorted(zip(imported.labels(), store_snapshot(imported)[0])) == sorted(zip(store.labels(), store_snapshot(store)[0]))
@@ -0,0 +1,117 @@
+import json
+import cv2
+import numpy as np
+import pytest
+
+# Custom modules
+import annotation_export
+import annotation_io
+import marking_store
+
+WIDTH, HEIGHT = 64, 48
+
+
+@pytest.fixture
+def store():
+    store = marking_store.MarkingStore()
+    store.append("Contour", "cell", [[2, 2], [20, 2], [20, 15], [2, 15]])
+    store.append("Contour", "nucleus", [[30, 5], [45, 5], [38, 30]])
+    store.append("Contour", "cell", [[10, 30], [70, 30], [70, 60], [10, 60]])  # Clipped by the image border
+    store.append("Contour", "cell", [[0, 0], [0, 47], [1, 47], [1, 0]])  # Full height, first column
+    store.append("Bounding Box", "box", [[50, 40], [40, 10]])
+    return store
+
+
+def filled(points):
+    mask = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    cv2.fillPoly(mask, [np.clip(points, 0, [WIDTH - 1, HEIGHT - 1]).astype(np.int32)], 1)
+    return mask.astype(bool)
+
+
+def decode_rle(counts):
+    flat = np.zeros(WIDTH * HEIGHT, dtype=bool)
+    position = 0
+    for run, length in enumerate(counts):
+        flat[position:position + length] = run % 2 == 1
+        position += length
+    assert position == WIDTH * HEIGHT
+    return flat.reshape(WIDTH, HEIGHT).T  # Column-major
+
+
+def export(store, tmp_path, formats, **options):
+    return annotation_export.export_annotations(store, str(tmp_path), "image", (WIDTH, HEIGHT), formats, **options)
+
+
+def test_points_json_round_trip(store, tmp_path):
+    exported = export(store, tmp_path, ["contour_points", "box_corners"])
+    reread = annotation_io.read_points_json(exported["contour_points"])
+    contours = store.filter(marking_type="Contour")
+    assert len(reread) == len(contours)
+    for label in ("cell", "nucleus"):
+        expected = [np.clip(store.points(i), 0, [WIDTH - 1, HEIGHT - 1]).tolist() for i in store.filter(marking_type="Contour", label=label)]
+        assert [reread.points(i).tolist() for i in reread.filter(label=label)] == expected
+    with open(exported["box_corners"]) as json_file:
+        assert json.load(json_file) == {"box": [[[50, 40], [40, 10]]]}
+
+
+@pytest.mark.parametrize("bit_packed", [True, False])
+def test_semantic_masks_round_trip(store, tmp_path, bit_packed):
+    path = export(store, tmp_path, ["mask"], bit_packed=bit_packed)["mask"]
+    labels, masks = annotation_export.load_mask(path)
+    assert labels == ["cell", "nucleus"]
+    assert masks.shape == (2, HEIGHT, WIDTH)
+    for label, mask in zip(labels, masks):
+        expected = np.zeros((HEIGHT, WIDTH), dtype=bool)
+        for i in store.filter(marking_type="Contour", label=label):
+            expected |= filled(store.points(i))
+        np.testing.assert_array_equal(mask, expected)
+
+
+def test_coco_rle_matches_filled_polygons(store, tmp_path):
+    with open(export(store, tmp_path, ["coco_rle"])["coco_rle"]) as json_file:
+        coco = json.load(json_file)
+    contours = store.filter(marking_type="Contour")
+    assert len(coco["annotations"]) == len(contours)
+    categories = {category["id"]: category["name"] for category in coco["categories"]}
+    for annotation, i in zip(coco["annotations"], contours):
+        assert annotation["segmentation"]["size"] == [HEIGHT, WIDTH]
+        mask = decode_rle(annotation["segmentation"]["counts"])
+        np.testing.assert_array_equal(mask, filled(store.points(i)))
+        assert annotation["area"] == int(mask.sum())
+        assert categories[annotation["category_id"]] == store.label(i)
+
+
+def test_rle_counts_of_full_height_columns():
+    crop = np.ones((HEIGHT, 3), dtype=np.uint8)
+    counts = annotation_export.rle_counts(5, 0, crop, HEIGHT)
+    # Adjacent full columns form one run
+    assert counts == [5 * HEIGHT, 3 * HEIGHT]
+
+
+def test_instance_map_and_png(store, tmp_path):
+    exported = export(store, tmp_path, ["instance_map", "instance_png"])
+    with np.load(exported["instance_map"]) as archive:
+        instances = archive["instances"]
+        assert archive["labels"].tolist() == ["cell", "nucleus", "cell", "cell"]
+    for instance_id, i in enumerate(store.filter(marking_type="Contour"), start=1):
+        # Later contours are drawn on top
+        assert np.all(filled(store.points(i))[instances == instance_id])
+    np.testing.assert_array_equal(cv2.imread(exported["instance_png"], -1), instances)
+
+
+def test_yolo_lines(store, tmp_path):
+    exported = export(store, tmp_path, ["yolo", "yolo_seg", "npz"], yolo_types=["Bounding Box"])
+    with open(exported["yolo"]) as text_file:
+        label, *values = text_file.read().split()
+    assert label == "box"
+    np.testing.assert_allclose([float(value) for value in values], [45 / WIDTH, 25 / HEIGHT, 10 / WIDTH, 30 / HEIGHT])
+    with open(exported["yolo_seg"]) as text_file:
+        assert len(text_file.read().splitlines()) == 4
+    assert len(annotation_io.load_npz(exported["npz"])) == len(store)
+
+
+def test_nothing_to_write(tmp_path):
+    exported = export(marking_store.MarkingStore(), tmp_path, ["yolo"])
+    assert exported["yolo"] is None
+    with pytest.raises(ValueError):
+        export(marking_store.MarkingStore(), tmp_path, ["unknown"])
@@ -0,0 +1,73 @@
+import json
+import numpy as np
+import pytest
+
+# Custom modules
+import annotation_io
+import marking_store
+from tests.helpers import random_polygon, random_store, store_snapshot
+
+
+def test_grouped_json_round_trip(tmp_path, rng):
+    groups = [("cell", [random_polygon(rng) for _ in range(30)]), ("nucleus \"quoted\"", [random_polygon(rng, 3)]), ("empty", [])]
+    path = annotation_io.write_grouped_json(str(tmp_path / "points.json"), groups)
+    with open(path) as json_file:
+        assert json.load(json_file) == {label: [polygon.tolist() for polygon in polygons] for label, polygons in groups}
+    read = [(label, points.astype(np.int32).tolist()) for label, points in annotation_io.iter_points_json(path)]
+    assert read == [(label, polygon.tolist()) for label, polygons in groups for polygon in polygons]
+
+
+def test_reader_across_buffer_boundaries(tmp_path, rng, monkeypatch):
+    # Polygons, labels and separators cut by the end of the read buffer
+    monkeypatch.setattr(annotation_io, "READ_CHUNK", 7)
+    polygons = [random_polygon(rng, 20) for _ in range(10)]
+    path = str(tmp_path / "points.json")
+    with open(path, "w") as json_file:
+        json.dump({"a long label name": [polygon.tolist() for polygon in polygons]}, json_file, indent=3)
+    read = list(annotation_io.iter_points_json(path))
+    assert [label for label, _ in read] == ["a long label name"] * 10
+    for (_, points), polygon in zip(read, polygons):
+        np.testing.assert_array_equal(points, polygon)
+
+
+def test_reader_accepts_floats_and_unusual_nesting(tmp_path):
+    path = str(tmp_path / "points.json")
+    with open(path, "w") as json_file:
+        json_file.write('{"A": [[[1.5, 2], [3, 4e1]], [[ 5 , 6 ]]], "B": [], "C": [[]]}')
+    read = list(annotation_io.iter_points_json(path))
+    np.testing.assert_array_equal(read[0][1], [[1.5, 2], [3, 40]])
+    np.testing.assert_array_equal(read[1][1], [[5, 6]])
+    assert read[2][0] == "C" and read[2][1].shape == (0, 2)
+    store = annotation_io.read_points_json(path)
+    assert store.labels() == ["A", "A"]
+    assert [store.marking_type(i) for i in range(2)] == ["Bounding Box", "Bounding Box"]
+
+
+def test_empty_and_malformed_files(tmp_path):
+    path = str(tmp_path / "points.json")
+    with open(path, "w") as json_file:
+        json_file.write(" { } ")
+    assert list(annotation_io.iter_points_json(path)) == []
+    with open(path, "w") as json_file:
+        json_file.write('["not", "a", "dict"]')
+    with pytest.raises(ValueError):
+        list(annotation_io.iter_points_json(path))
+
+
+def test_read_points_json_types(tmp_path):
+    path = annotation_io.write_json(str(tmp_path / "points.json"), {"A": [[[0, 0], [5, 0], [5, 5]], [[1, 1], [2, 2]]]})
+    store = annotation_io.read_points_json(path)
+    assert [store.marking_type(i) for i in range(len(store))] == ["Contour", "Bounding Box"]
+
+
+def test_npz_round_trip(tmp_path, rng):
+    store = random_store(rng, 40)
+    path = annotation_io.save_npz(str(tmp_path / "markings.npz"), store)
+    assert store_snapshot(annotation_io.load_npz(path)) == store_snapshot(store)
+    empty = annotation_io.save_npz(str(tmp_path / "empty.npz"), marking_store.MarkingStore())
+    assert len(annotation_io.load_npz(empty)) == 0
+
+
+def test_dumps_without_orjson(monkeypatch):
+    monkeypatch.setattr(annotation_io, "orjson", None)
+    assert annotation_io.dumps(np.array([[1, 2], [3, 4]])) == "[[1,2],[3,4]]"
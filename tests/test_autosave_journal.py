@@ -0,0 +1,158 @@
+import os
+import numpy as np
+
+# Custom modules
+import autosave_journal
+import marking_store
+from tests.helpers import random_polygon, random_store, store_snapshot
+
+
+def image_path(tmp_path):
+    path = str(tmp_path / "image.png")
+    open(path, "wb").close()
+    return path
+
+
+def edit(rng, store):
+    store.extend("Contour", "A", [random_polygon(rng) for _ in range(3)])
+    store.extend("Bounding Box", "new label", [[[0, 0], [4, 4]]])
+    store.delete([0])
+    store.replace_points([len(store) - 1], [random_polygon(rng, 7)])
+    store.set_label(0, "B")
+    store.set_visibility([0, 1], False)
+    removed = store.subset([1])
+    store.delete([1])
+    store.insert_store([1], removed)
+
+
+def test_replay_matches_store(tmp_path, rng):
+    path = image_path(tmp_path)
+    store = marking_store.MarkingStore()
+    journal = autosave_journal.AutosaveJournal(path, store)
+    for _ in range(5):
+        edit(rng, store)
+    journal.close()
+    recovered, num_records = autosave_journal.recover(path)
+    assert num_records > 0
+    assert store_snapshot(recovered) == store_snapshot(store)
+
+
+def test_start_from_existing_markings_and_clear(tmp_path, rng):
+    path = image_path(tmp_path)
+    store = random_store(rng, 10)
+    journal = autosave_journal.AutosaveJournal(path, store)
+    edit(rng, store)
+    journal.sync()
+    assert store_snapshot(autosave_journal.recover(path)[0]) == store_snapshot(store)
+    store.clear()
+    store.append("Contour", "C", random_polygon(rng))
+    journal.close()
+    assert store_snapshot(autosave_journal.recover(path)[0]) == store_snapshot(store)
+
+
+def test_replay_across_compactions(tmp_path, rng):
+    path = image_path(tmp_path)
+    store = random_store(rng, 5)
+    journal = autosave_journal.AutosaveJournal(path, store, compact_min_bytes=0)
+    epochs = set()
+    for _ in range(20):
+        edit(rng, store)
+        with open(journal.journal_path, "rb") as journal_file:
+            epochs.add(journal_file.read(len(autosave_journal.MAGIC) + autosave_journal.EPOCH_SIZE))
+    journal.close()
+    assert len(epochs) > 1  # The journal was compacted
+    assert store_snapshot(autosave_journal.recover(path)[0]) == store_snapshot(store)
+
+
+def test_stale_journal_from_before_compaction_is_ignored(tmp_path, rng):
+    path = image_path(tmp_path)
+    store = random_store(rng, 5)
+    journal = autosave_journal.AutosaveJournal(path, store)
+    store.append("Contour", "A", random_polygon(rng))
+    journal.sync()
+    with open(journal.journal_path, "rb") as journal_file:
+        old_journal = journal_file.read()
+    journal.compact()
+    journal.close()
+    # Crash between the snapshot and the new journal: the old journal is already in the snapshot
+    with open(journal.journal_path, "wb") as journal_file:
+        journal_file.write(old_journal)
+    recovered, num_records = autosave_journal.recover(path)
+    assert num_records == 0
+    assert store_snapshot(recovered) == store_snapshot(store)
+
+
+def journal_with_records(tmp_path, rng, num_edits=3):
+    path = image_path(tmp_path)
+    store = marking_store.MarkingStore()
+    journal = autosave_journal.AutosaveJournal(path, store)
+    states = []
+    for _ in range(num_edits):
+        store.append("Contour", "A", random_polygon(rng))
+        states.append(store_snapshot(store))
+    journal.close()
+    return path, journal.journal_path, states
+
+
+def test_truncated_tail_is_dropped(tmp_path, rng):
+    path, journal_path, states = journal_with_records(tmp_path, rng)
+    size = os.path.getsize(journal_path)
+    # Every cut inside the last record gives back the state before it
+    for cut in range(1, 20):
+        with open(journal_path, "r+b") as journal_file:
+            journal_file.truncate(size - cut)
+        recovered, num_records = autosave_journal.recover(path)
+        assert num_records == 3  # Name of the label and 2 markings
+        assert store_snapshot(recovered) == states[1]
+
+
+def test_corrupted_record_stops_replay(tmp_path, rng):
+    path, journal_path, states = journal_with_records(tmp_path, rng)
+    _, records = autosave_journal._read_records(journal_path)
+    assert [kind for kind, _ in records] == [autosave_journal.LABEL_NAME] + [autosave_journal.ADD] * 3
+    with open(journal_path, "r+b") as journal_file:
+        data = bytearray(journal_file.read())
+        # Flip a byte in the payload of the second marking
+        position = len(autosave_journal.MAGIC) + autosave_journal.EPOCH_SIZE
+        for _, payload in records[:2]:
+            position += autosave_journal._RECORD_HEADER.size + len(payload) + autosave_journal._CRC.size
+        data[position + autosave_journal._RECORD_HEADER.size + 3] ^= 0xFF
+        journal_file.seek(0)
+        journal_file.write(data)
+    recovered, num_records = autosave_journal.recover(path)
+    assert num_records == 2
+    assert store_snapshot(recovered) == states[0]
+
+
+def test_garbage_journal_and_discard(tmp_path, rng):
+    path = image_path(tmp_path)
+    journal_path, snapshot_path = autosave_journal.journal_paths(path)
+    with open(journal_path, "wb") as journal_file:
+        journal_file.write(b"not a journal")
+    recovered, num_records = autosave_journal.recover(path)
+    assert len(recovered) == 0 and num_records == 0
+    assert autosave_journal.has_journal(path)
+    autosave_journal.discard(path)
+    assert not autosave_journal.has_journal(path)
+
+
+def test_new_journal_on_empty_store_discards_old_files(tmp_path, rng):
+    path = image_path(tmp_path)
+    store = random_store(rng, 3)
+    autosave_journal.AutosaveJournal(path, store).close()
+    autosave_journal.AutosaveJournal(path, marking_store.MarkingStore()).close()
+    assert not autosave_journal.has_journal(path)
+
+
+def test_disk_error_stops_autosave(tmp_path, rng):
+    path = image_path(tmp_path)
+    store = marking_store.MarkingStore()
+    journal = autosave_journal.AutosaveJournal(path, store)
+
+    def fail(kind, payload):
+        raise OSError("disk full")
+    journal.write_record = fail
+    store.append("Contour", "A", random_polygon(rng))
+    assert isinstance(journal.error, OSError)
+    store.append("Contour", "A", random_polygon(rng))  # No longer recorded, no exception
+    journal.close()
@@ -0,0 +1,119 @@
+import concurrent.futures
+import threading
+import time
+import cv2
+import numpy as np
+import pytest
+
+# Custom modules
+import cellpose_segmentation
+
+
+def disk_labels(shape, rng, num_cells=40, max_radius=12):
+    # Output: label map of non-overlapping disks, 1..N
+    labels = np.zeros(shape, dtype=np.int32)
+    next_label = 1
+    for _ in range(num_cells):
+        radius = int(rng.integers(3, max_radius))
+        center = (int(rng.integers(0, shape[1])), int(rng.integers(0, shape[0])))
+        disk = np.zeros(shape, dtype=np.uint8)
+        cv2.circle(disk, center, radius, 1, -1)
+        disk = disk.astype(bool) & (labels == 0)
+        if disk.sum() > 10:
+            labels[disk] = next_label
+            next_label += 1
+    return labels
+
+
+def relabel(masks):
+    # Output: consecutive labels 1..N of a tile, as Cellpose would number them
+    ids = np.unique(masks)
+    lut = np.zeros(int(masks.max()) + 1, dtype=np.int32)
+    lut[ids[ids > 0]] = np.arange(1, np.count_nonzero(ids) + 1)
+    return lut[masks]
+
+
+def same_partition(labels_a, labels_b):
+    # Output: True if the two label maps are equal up to renumbering
+    if not np.array_equal(labels_a > 0, labels_b > 0):
+        return False
+    pairs = np.unique(np.stack((labels_a.ravel(), labels_b.ravel())), axis=1)
+    return len(np.unique(pairs[0])) == len(np.unique(pairs[1])) == pairs.shape[1]
+
+
+@pytest.mark.parametrize("shape", [(100, 100), (64, 257), (300, 180)])
+def test_tile_grid_covers_image(shape):
+    grid = cellpose_segmentation.tile_grid(shape, tile_size=64, overlap=16)
+    covered = np.zeros(shape, dtype=np.int32)
+    for (ty0, ty1, tx0, tx1), (cy0, cy1, cx0, cx1) in grid:
+        assert ty1 - ty0 <= 64 and tx1 - tx0 <= 64
+        assert ty0 <= cy0 < cy1 <= ty1 and tx0 <= cx0 < cx1 <= tx1
+        covered[cy0:cy1, cx0:cx1] += 1
+    # The cores partition the image
+    assert np.all(covered == 1)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_stitch_tiles_recovers_cells_cut_by_tiles(seed):
+    rng = np.random.default_rng(seed)
+    labels = disk_labels((200, 230), rng)
+    grid = cellpose_segmentation.tile_grid(labels.shape, tile_size=80, overlap=32)
+    tile_masks = [relabel(labels[ty0:ty1, tx0:tx1]) for (ty0, ty1, tx0, tx1), _ in grid]
+    stitched = cellpose_segmentation.stitch_tiles(labels.shape, grid, tile_masks)
+    assert same_partition(stitched, labels)
+    assert stitched.max() == len(np.unique(labels)) - 1  # Consecutive ids
+
+
+def test_stitch_single_tile():
+    labels = np.zeros((20, 20), dtype=np.int32)
+    labels[2:5, 2:5] = 7
+    grid = cellpose_segmentation.tile_grid(labels.shape, tile_size=64)
+    stitched = cellpose_segmentation.stitch_tiles(labels.shape, grid, [labels])
+    assert stitched.max() == 1 and same_partition(stitched, labels)
+
+
+@pytest.mark.parametrize("num_threads", [None, 2])
+def test_masks_to_contours(rng, monkeypatch, num_threads):
+    if num_threads:
+        monkeypatch.setattr(cellpose_segmentation, "THREAD_POOL_MIN_LABELS", 1)
+        monkeypatch.setattr(cellpose_segmentation, "CONTOUR_CHUNK_SIZE", 3)
+    # Separate disks, so each label has a single outer contour
+    labels = np.zeros((150, 150), dtype=np.int32)
+    for label, (x, y) in enumerate([(x, y) for x in range(15, 150, 30) for y in range(15, 150, 30)], start=1):
+        cv2.circle(labels, (x, y), int(rng.integers(3, 13)), label, -1)
+    progress = []
+    contours, failed = cellpose_segmentation.masks_to_contours(labels, progress=lambda percent, message: progress.append(percent),
+                                                               num_threads=num_threads)
+    assert failed == []
+    assert len(contours) == labels.max()
+    for label, contour in enumerate(contours, start=1):
+        filled = np.zeros(labels.shape, dtype=np.uint8)
+        cv2.fillPoly(filled, [contour.astype(np.int32)], 1)
+        assert np.array_equal(filled.astype(bool), labels == label)
+    assert progress[-1] == 100
+
+
+def test_masks_to_contours_cancelled():
+    labels = np.zeros((10, 10), dtype=np.int32)
+    labels[2:4, 2:4] = 1
+    with pytest.raises(cellpose_segmentation.Cancelled):
+        cellpose_segmentation.masks_to_contours(labels, is_cancelled=lambda: True)
+
+
+def test_segment_tiled_cancel_does_not_wait_for_running_tiles(monkeypatch):
+    release = threading.Event()
+
+    def slow_tile(tile_arr, *args):
+        release.wait(10)
+        return np.zeros(tile_arr.shape[:2], dtype=np.uint16)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(cellpose_segmentation, "tile_pool", lambda num_workers, torch_threads: executor)
+    monkeypatch.setattr(cellpose_segmentation, "eval_tile", slow_tile)
+    start_time = time.time()
+    with pytest.raises(cellpose_segmentation.Cancelled):
+        cellpose_segmentation.segment_tiled(np.zeros((300, 300, 3), dtype=np.uint8), "cyto3", None, 0.4, False, 128, 32, 2, 1,
+                                            None, lambda: time.time() - start_time > 0.3)
+    assert time.time() - start_time < 5
+    release.set()
+    executor.shutdown()
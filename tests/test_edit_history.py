@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+# Custom modules
+import edit_history
+import marking_store
+from tests.helpers import random_polygon, random_store, store_snapshot, assert_consistent
+
+
+def random_edit(rng, store, history):
+    action = rng.integers(0, 7)
+    if action == 0 or len(store) == 0:
+        store.extend("Contour", rng.choice(["A", "B"]), [random_polygon(rng) for _ in range(int(rng.integers(1, 4)))])
+    elif action == 1:
+        store.delete(rng.choice(len(store), size=min(len(store), int(rng.integers(1, 4))), replace=False))
+    elif action == 2:
+        indices = np.unique(rng.choice(len(store), size=min(len(store), 2)))
+        store.replace_points(indices, [random_polygon(rng) for _ in indices])
+    elif action == 3:
+        store.set_label(int(rng.integers(len(store))), rng.choice(["A", "B", "new"]))
+    elif action == 4:
+        store.set_visibility(int(rng.integers(len(store))), bool(rng.random() < 0.5))
+    elif action == 5:
+        with history.group("Grouped"):
+            store.append("Bounding Box", "C", [[0, 0], [10, 10]])
+            store.delete([0])
+    else:
+        store.clear()
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_undo_redo_round_trip(seed):
+    rng = np.random.default_rng(seed)
+    store = random_store(rng, 8)
+    history = edit_history.EditHistory(store, max_depth=1000)
+    states = [store_snapshot(store)]
+    for _ in range(80):
+        random_edit(rng, store, history)
+        assert_consistent(store)
+        if store_snapshot(store) != states[-1]:
+            states.append(store_snapshot(store))
+    # Every recorded step is undone back to the initial state, then redone to the final one
+    # (edits that change nothing, e.g. the same label again, are steps without a visible state)
+    undone = [store_snapshot(store)]
+    while history.can_undo():
+        history.undo()
+        assert_consistent(store)
+        if store_snapshot(store) != undone[-1]:
+            undone.append(store_snapshot(store))
+    assert undone == states[::-1]
+    while history.can_redo():
+        history.redo()
+    assert store_snapshot(store) == states[-1]
+
+
+def test_group_is_one_step(rng):
+    store = random_store(rng, 3)
+    history = edit_history.EditHistory(store)
+    before = store_snapshot(store)
+    with history.group("Paste"):
+        store.append("Contour", "A", random_polygon(rng))
+        store.set_label(0, "B")
+        store.delete([1])
+    assert len(history.undo_stack) == 1
+    assert history.undo() == "Paste"
+    assert store_snapshot(store) == before
+
+
+def test_new_edit_clears_redo_and_depth_is_bounded(rng):
+    store = marking_store.MarkingStore()
+    history = edit_history.EditHistory(store, max_depth=5)
+    for _ in range(10):
+        store.append("Contour", "A", random_polygon(rng))
+    assert len(history.undo_stack) == 5
+    history.undo()
+    assert history.can_redo()
+    store.append("Contour", "A", random_polygon(rng))
+    assert not history.can_redo()
+    history.set_max_depth(2)
+    assert len(history.undo_stack) == 2
+
+
+def test_replayed_changes_are_not_recorded(rng):
+    store = random_store(rng, 4)
+    history = edit_history.EditHistory(store)
+    store.set_label(0, "X")
+    history.undo()
+    history.redo()
+    assert len(history.undo_stack) == 1 and len(history.redo_stack) == 0
+    assert history.undo_name() == "Change Labels"
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+# Custom modules
+import image_io
+
+
+def old_process_tif(tif_image):
+    # Whole-image normalization of the original main window, BGR input
+    def normalize_image(image):
+        imin, imax = np.min(image), np.max(image)
+        irange = abs(imax - imin)
+        if irange == 0:
+            return image
+        else:
+            return (image - imin) / irange
+    tif_red = tif_image[:, :, 2]
+    tif_green = tif_image[:, :, 1]
+    tif_blue = tif_image[:, :, 0]
+    return (normalize_image(np.stack((tif_red, tif_green, tif_blue), axis=2)) * 255.0).astype('uint8')
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.int32, np.float32, np.float64])
+def test_process_tif_matches_whole_image_normalization(rng, dtype):
+    image = (rng.random((97, 61, 3)) * 3000 - 500).astype(dtype) if np.issubdtype(dtype, np.floating) else rng.integers(0, np.iinfo(dtype).max // 2, (97, 61, 3)).astype(dtype)
+    np.testing.assert_array_equal(image_io.process_tif(image, "BGR", strip_rows=10), old_process_tif(image))
+
+
+@pytest.mark.parametrize("dtype, value", [(np.uint16, 0), (np.uint8, 1), (np.float32, 0.5)])
+def test_process_tif_constant_image(dtype, value):
+    image = np.full((20, 30, 3), value, dtype=dtype)
+    np.testing.assert_array_equal(image_io.process_tif(image, "BGR", strip_rows=7), old_process_tif(image))
+
+
+def test_process_tif_grayscale_and_rgb(rng):
+    gray = rng.integers(0, 4096, (40, 50)).astype(np.uint16)
+    expected = old_process_tif(np.stack((gray, gray, gray), axis=2))
+    np.testing.assert_array_equal(image_io.process_tif(gray, strip_rows=9), expected)
+    rgb = rng.integers(0, 4096, (40, 50, 4)).astype(np.uint16)
+    np.testing.assert_array_equal(image_io.process_tif(rgb, "RGB", strip_rows=9), old_process_tif(rgb[:, :, [2, 1, 0]]))
+
+
+def test_output_names():
+    assert image_io.output_name("/data/sample.01.tif") == "sample.01"
+    names = image_io.output_names(["/data/cell.png", "/data/cell.tif", "/data/sample.01.tif", "/data/sample.02.tif", "/other/cell.png"])
+    assert names == {"/data/cell.png": "cell_png", "/data/cell.tif": "cell_tif", "/data/sample.01.tif": "sample.01",
+                     "/data/sample.02.tif": "sample.02", "/other/cell.png": "cell_png_2"}
@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+from PyQt5.QtCore import QSettings
+
+# Custom modules
+import autosave_journal
+
+
+@pytest.fixture
+def window(tmp_path, monkeypatch):
+    # Settings and thumbnails of the test stay in its temporary folder
+    QSettings.setPath(QSettings.NativeFormat, QSettings.UserScope, str(tmp_path / "settings"))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    import main_window
+    window = main_window.MainWindow()
+    yield window
+    window.close()
+    app.processEvents()
+
+
+def write_image(path, rng):
+    Image.fromarray(rng.integers(0, 255, (80, 120, 3)).astype(np.uint8)).save(path)
+    return str(path)
+
+
+def test_next_image_journal_starts_without_previous_markings(window, tmp_path, rng):
+    first_dir, second_dir = write_image(tmp_path / "a.png", rng), write_image(tmp_path / "b.png", rng)
+    window.open_image(first_dir, restore_autosave=False)
+    window.marking_store.append("Contour", "A", [[10, 10], [50, 10], [10, 50]])
+    window.sync_autosave()
+    window.open_image(second_dir, restore_autosave=False)
+    assert len(window.marking_store) == 0
+    assert not window.edit_history.can_undo()
+    window.marking_store.append("Bounding Box", "B", [[60, 60], [90, 70]])
+    window.sync_autosave()
+    recovered, _ = autosave_journal.recover(second_dir)
+    assert recovered.labels() == ["B"]
+    # The markings of the first image are still in its own journal
+    recovered, _ = autosave_journal.recover(first_dir)
+    assert recovered.labels() == ["A"]
+    window.stop_autosave()
+
+
+def test_unreadable_image_keeps_markings(window, tmp_path, rng):
+    window.open_image(write_image(tmp_path / "a.png", rng), restore_autosave=False)
+    window.marking_store.append("Contour", "A", [[10, 10], [50, 10], [10, 50]])
+    bad_dir = tmp_path / "bad.png"
+    bad_dir.write_bytes(b"not an image")
+    with pytest.raises(OSError):
+        window.open_image(str(bad_dir), restore_autosave=False)
+    assert window.marking_store.labels() == ["A"]
+    window.stop_autosave()
+
+
+def test_session_save_error_is_reported(window, tmp_path, rng, monkeypatch):
+    warnings = []
+    monkeypatch.setattr(QtWidgets.QMessageBox, "warning", lambda parent, title, text: warnings.append(text))
+    window.open_image(write_image(tmp_path / "a.png", rng), restore_autosave=False)
+    window.write_session(str(tmp_path / "missing" / "work.session.npz"))
+    assert len(warnings) == 1 and window.session_dir is None
+    window.write_session(str(tmp_path / "work.session.npz"))
+    assert window.session_dir == str(tmp_path / "work.session.npz")
+    window.stop_autosave()
+
+
+def test_dataset_navigation_records_previous_image(window, tmp_path, rng):
+    image_dirs = [write_image(tmp_path / "a.png", rng), write_image(tmp_path / "b.png", rng)]
+    window.open_annotation_db(str(tmp_path))
+    window.dataset_images = image_dirs
+    window.show_dataset_image(0)
+    window.marking_store.append("Contour", "A", [[10, 10], [50, 10], [10, 50]])
+    window.next_image()
+    assert window.dataset_index == 1 and len(window.marking_store) == 0
+    assert window.annotation_db.read_image(image_dirs[0]).labels() == ["A"]
+    window.stop_autosave()
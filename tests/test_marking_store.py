@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+
+# Custom modules
+import marking_store
+from tests.helpers import random_polygon, random_store, store_snapshot, assert_consistent
+
+
+def test_append_and_read_back(rng):
+    store = marking_store.MarkingStore(point_capacity=1, marking_capacity=1)
+    polygons = [random_polygon(rng) for _ in range(50)]
+    for polygon in polygons:
+        store.append("Contour", "cell", polygon)
+    assert_consistent(store)
+    assert len(store) == 50
+    for i, polygon in enumerate(polygons):
+        np.testing.assert_array_equal(store.points(i), polygon)
+    assert store.labels() == ["cell"] * 50
+    assert store.label_names[0] == marking_store.NO_LABEL
+
+
+def test_extend_returns_range_and_notifies(rng):
+    store = marking_store.MarkingStore()
+    events = []
+    store.add_listener(lambda kind, indices: events.append((kind, list(indices))))
+    store.append("Contour", "A", random_polygon(rng))
+    added = store.extend("Bounding Box", "B", [[[0, 0], [5, 5]], [[1, 1], [2, 2]]])
+    assert added == range(1, 3)
+    assert events == [(marking_store.ADDED, [0]), (marking_store.ADDED, [1, 2])]
+    assert store.extend("Contour", "A", []) == range(3, 3)
+
+
+def test_delete_keeps_offsets_consistent(rng):
+    store = random_store(rng, 30)
+    before = store_snapshot(store)
+    remove = np.array([0, 3, 4, 17, 29])
+    store.delete(remove)
+    assert_consistent(store)
+    keep = [i for i in range(30) if i not in remove]
+    assert store_snapshot(store) == tuple([values[i] for i in keep] for values in before)
+
+
+def test_delete_with_mask_and_nothing_selected(rng):
+    store = random_store(rng, 10)
+    generation = store.generation
+    store.delete(np.zeros(10, dtype=bool))
+    assert len(store) == 10 and store.generation == generation
+    mask = np.zeros(10, dtype=bool)
+    mask[[1, 2]] = True
+    store.delete(mask)
+    assert len(store) == 8 and store.generation == generation + 1
+
+
+def test_insert_store_restores_deleted_markings(rng):
+    store = random_store(rng, 25)
+    before = store_snapshot(store)
+    indices = np.array([0, 5, 6, 24])
+    removed = store.subset(indices)
+    store.delete(indices)
+    store.insert_store(indices, removed)
+    assert_consistent(store)
+    assert store_snapshot(store) == before
+
+
+def test_insert_store_with_new_labels(rng):
+    store = random_store(rng, 5, labels=("A",))
+    other = marking_store.MarkingStore()
+    other.append("Contour", "new label", random_polygon(rng))
+    store.insert_store([2], other)
+    assert store.label(2) == "new label"
+    assert len(store) == 6
+
+
+def test_replace_points_moves_following_markings(rng):
+    store = random_store(rng, 10)
+    before = store_snapshot(store)
+    new_polygons = [random_polygon(rng, 25), random_polygon(rng, 3)]
+    store.replace_points([2, 7], new_polygons)
+    assert_consistent(store)
+    points, types, labels, flags = store_snapshot(store)
+    for i in range(10):
+        expected = new_polygons[0] if i == 2 else new_polygons[1] if i == 7 else before[0][i]
+        assert points[i] == np.asarray(expected).tolist()
+    assert (types, labels, flags) == before[1:]
+
+
+def test_labels_and_visibility(rng):
+    store = random_store(rng, 6)
+    store.set_label([1, 4], "X")
+    assert store.label(1) == store.label(4) == "X"
+    store.set_visibility(np.arange(6), False)
+    assert not any(store.is_visible(i) for i in range(6))
+    store.set_visibility(2, True, number_visible=False)
+    assert store.is_visible(2) and not store.is_number_visible(2)
+    np.testing.assert_array_equal(store.filter(visible=True), [2])
+    np.testing.assert_array_equal(store.filter(label="X"), [1, 4])
+    assert len(store.filter(label="missing")) == 0
+
+
+def test_bounds(rng):
+    store = random_store(rng, 8)
+    for i, bounds in enumerate(store.bounds()):
+        points = store.points(i)
+        assert bounds.tolist() == points.min(axis=0).tolist() + points.max(axis=0).tolist()
+    assert marking_store.MarkingStore().bounds().shape == (0, 4)
+
+
+def test_markings_without_points_are_rejected(rng):
+    store = random_store(rng, 5)
+    before = store_snapshot(store)
+    with pytest.raises(ValueError):
+        store.append("Contour", "A", [])
+    with pytest.raises(ValueError):
+        store.extend("Contour", "A", [[[1, 2], [3, 4], [5, 6]], np.empty((0, 2))])
+    with pytest.raises(ValueError):
+        store.replace_points([1], [[]])
+    with pytest.raises(ValueError):
+        marking_store.MarkingStore.from_arrays(np.zeros((3, 2), dtype=np.int32), [0, 3, 3], [0, 0], [0, 0], ["A"])
+    assert store_snapshot(store) == before
+    assert len(store.bounds()) == len(store)
+
+
+def test_subset_copy_and_from_arrays(rng):
+    store = random_store(rng, 12)
+    indices = np.array([9, 1, 4])
+    subset = store.subset(indices)
+    points, types, labels, flags = store_snapshot(store)
+    assert store_snapshot(subset) == ([points[i] for i in indices], [types[i] for i in indices],
+                                      [labels[i] for i in indices], [flags[i] for i in indices])
+    assert store_snapshot(store.copy()) == store_snapshot(store)
+    rebuilt = marking_store.MarkingStore.from_arrays(store.coords, store.offsets, store.type_codes, store.label_codes,
+                                                     store.label_names, store.flags)
+    assert store_snapshot(rebuilt) == store_snapshot(store)
+
+
+def test_clear_notifications(rng):
+    store = random_store(rng, 4)
+    events = []
+    store.add_listener(lambda kind, indices: events.append((kind, len(indices))))
+    store.clear()
+    assert events == [(marking_store.ABOUT_TO_CLEAR, 4), (marking_store.CLEARED, 0)]
+    assert len(store) == 0 and store.num_points == 0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_edit_sequence_stays_consistent(seed):
+    rng = np.random.default_rng(seed)
+    store = random_store(rng, 10)
+    for _ in range(60):
+        action = rng.integers(0, 4)
+        if action == 0:
+            store.append("Contour", "A", random_polygon(rng))
+        elif action == 1 and len(store) > 0:
+            store.delete(rng.choice(len(store), size=min(len(store), 3), replace=False))
+        elif action == 2 and len(store) > 0:
+            store.replace_points([int(rng.integers(len(store)))], [random_polygon(rng)])
+        elif action == 3 and len(store) > 1:
+            indices = np.sort(rng.choice(len(store), size=2, replace=False))
+            removed = store.subset(indices)
+            store.delete(indices)
+            store.insert_store(indices, removed)
+        assert_consistent(store)
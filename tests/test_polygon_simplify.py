@@ -0,0 +1,46 @@
+import numpy as np
+
+# Custom modules
+import marking_store
+import polygon_simplify
+
+
+def circle(num_points=200, radius=50):
+    angles = np.linspace(0, 2 * np.pi, num_points, endpoint=False)
+    return np.round(np.stack((100 + radius * np.cos(angles), 100 + radius * np.sin(angles)), axis=1)).astype(np.int32)
+
+
+def test_remove_collinear():
+    square = np.array([[0, 0], [5, 0], [10, 0], [10, 10], [10, 10], [0, 10], [0, 5]])
+    np.testing.assert_array_equal(polygon_simplify.remove_collinear(square), [[0, 0], [10, 0], [10, 10], [0, 10]])
+    # A spike going back on itself is not straight
+    spike = np.array([[0, 0], [10, 0], [5, 0], [5, 5]])
+    assert len(polygon_simplify.remove_collinear(spike)) == 4
+    np.testing.assert_array_equal(polygon_simplify.remove_collinear(np.array([[3, 3], [3, 3]])), [[3, 3]])
+
+
+def test_simplify_polygon_stays_close():
+    points = circle()
+    simplified = polygon_simplify.simplify_polygon(points, 1.0)
+    assert 3 <= len(simplified) < len(points)
+    # Every simplified vertex is an original vertex
+    assert set(map(tuple, simplified.tolist())) <= set(map(tuple, points.tolist()))
+
+
+def test_simplify_polygon_disabled_or_degenerate():
+    points = circle()
+    np.testing.assert_array_equal(polygon_simplify.simplify_polygon(points, 0), points)
+    triangle = np.array([[0, 0], [4, 0], [0, 4]])
+    np.testing.assert_array_equal(polygon_simplify.simplify_polygon(triangle, 5), triangle)
+    line = np.array([[0, 0], [1, 0], [2, 0], [3, 0], [4, 0]])
+    np.testing.assert_array_equal(polygon_simplify.simplify_polygon(line, 1), line)
+
+
+def test_simplify_markings_skips_boxes():
+    store = marking_store.MarkingStore()
+    store.append("Contour", "A", circle())
+    store.append("Bounding Box", "A", [[0, 0], [10, 10]])
+    store.append("Contour", "A", [[0, 0], [4, 0], [0, 4]])
+    changed = polygon_simplify.simplify_markings(store, np.arange(3))
+    np.testing.assert_array_equal(changed, [0])
+    assert len(store.points(1)) == 2 and len(store.points(2)) == 3
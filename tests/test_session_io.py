@@ -0,0 +1,86 @@
+import os
+import numpy as np
+import pytest
+
+# Custom modules
+import session_io
+from tests.helpers import random_store, store_snapshot
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = tmp_path / "images" / "cells.png"
+    path.parent.mkdir()
+    path.write_bytes(b"image content")
+    return str(path)
+
+
+def test_round_trip(tmp_path, rng, image_path):
+    store = random_store(rng, 30)
+    path = session_io.save_session(str(tmp_path / "work"), store, image_path, (640, 480), ["A", "B"])
+    assert path.endswith(session_io.SESSION_SUFFIX)
+    session = session_io.load_session(path)
+    assert store_snapshot(session.markings) == store_snapshot(store)
+    assert session.image_path == os.path.abspath(image_path)
+    assert session.image_size == (640, 480)
+    assert session.label_choices == ["A", "B"]
+    assert session_io.image_matches(session, image_path)
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_without_image(tmp_path, rng):
+    session = session_io.load_session(session_io.save_session(str(tmp_path / "empty.npz"), random_store(rng, 0)))
+    assert session.image_path is None and session.image_size is None and session.image_hash is None
+    assert len(session.markings) == 0
+
+
+def test_moved_folder_and_changed_image(tmp_path, rng, image_path):
+    path = session_io.save_session(str(tmp_path / "images" / "work"), random_store(rng, 3), image_path)
+    moved = tmp_path / "moved"
+    os.rename(tmp_path / "images", moved)
+    session_path = str(moved / os.path.basename(path))
+    session = session_io.load_session(session_path)
+    resolved = session_io.resolve_image_path(session, session_path)
+    assert resolved == os.path.normpath(str(moved / "cells.png"))
+    with open(resolved, "ab") as image_file:
+        image_file.write(b" edited")
+    assert not session_io.image_matches(session, resolved)
+    os.remove(resolved)
+    assert session_io.resolve_image_path(session, session_path) is None
+
+
+def test_rejects_other_files_and_newer_versions(tmp_path, rng):
+    other = str(tmp_path / "other.npz")
+    np.savez(other, coords=np.zeros((0, 2)))
+    with pytest.raises(ValueError):
+        session_io.load_session(other)
+    path = session_io.save_session(str(tmp_path / "new"), random_store(rng, 1))
+    with np.load(path) as archive:
+        arrays = dict(archive)
+    arrays["version"] = np.array(session_io.SESSION_VERSION + 1)
+    np.savez(path, **arrays)
+    with pytest.raises(ValueError):
+        session_io.load_session(path)
+
+
+def test_image_on_another_drive(tmp_path, rng, image_path, monkeypatch):
+    def relpath(path, start):
+        raise ValueError("path is on mount 'D:', start on mount 'C:'")
+    monkeypatch.setattr(session_io.os.path, "relpath", relpath)
+    path = session_io.save_session(str(tmp_path / "work"), random_store(rng, 3), image_path)
+    session = session_io.load_session(path)
+    assert session.image_relative_path == os.path.abspath(image_path)
+    assert session_io.resolve_image_path(session, path) == os.path.abspath(image_path)
+
+
+def test_failed_save_keeps_previous_session(tmp_path, rng, monkeypatch):
+    path = session_io.save_session(str(tmp_path / "work"), random_store(rng, 3))
+
+    def replace(source, destination):
+        raise OSError("disk full")
+    monkeypatch.setattr(session_io.os, "replace", replace)
+    with pytest.raises(OSError):
+        session_io.save_session(path, random_store(rng, 5))
+    monkeypatch.undo()
+    assert len(session_io.load_session(path).markings) == 3
+    assert not os.path.exists(path + ".tmp")
@@ -0,0 +1,53 @@
+import numpy as np
+
+# Custom modules
+import marking_store
+import spatial_index
+from tests.helpers import random_store
+
+
+def brute_force_query(store, x_min, y_min, x_max, y_max):
+    bounds = store.bounds()
+    overlap = (bounds[:, 0] <= x_max) & (bounds[:, 2] >= x_min) & (bounds[:, 1] <= y_max) & (bounds[:, 3] >= y_min)
+    return np.flatnonzero(overlap)
+
+
+def test_query_matches_brute_force(rng):
+    store = random_store(rng, 200)
+    index = spatial_index.MarkingSpatialIndex(store)
+    for _ in range(50):
+        x0, y0 = rng.integers(-100, 1000, 2)
+        x1, y1 = x0 + rng.integers(0, 400), y0 + rng.integers(0, 400)
+        np.testing.assert_array_equal(index.query(x0, y0, x1, y1), brute_force_query(store, x0, y0, x1, y1))
+
+
+def test_query_follows_appends_and_deletes(rng):
+    store = random_store(rng, 50)
+    index = spatial_index.MarkingSpatialIndex(store)
+    index.query(0, 0, 1000, 1000)
+    store.append("Contour", "A", [[2000, 2000], [2010, 2000], [2010, 2010]])
+    np.testing.assert_array_equal(index.query(1990, 1990, 2020, 2020), [50])
+    store.delete([0, 1, 2])
+    np.testing.assert_array_equal(index.query(1990, 1990, 2020, 2020), [47])
+    np.testing.assert_array_equal(index.query(0, 0, 1000, 1000), brute_force_query(store, 0, 0, 1000, 1000))
+
+
+def test_point_in_polygon():
+    square = np.array([[0, 0], [10, 0], [10, 10], [0, 10]])
+    assert spatial_index.point_in_polygon(5, 5, square)
+    assert not spatial_index.point_in_polygon(15, 5, square)
+    concave = np.array([[0, 0], [10, 0], [10, 10], [5, 2], [0, 10]])
+    assert not spatial_index.point_in_polygon(5, 8, concave)
+
+
+def test_hit_test_returns_topmost_visible():
+    store = marking_store.MarkingStore()
+    store.append("Contour", "A", [[0, 0], [100, 0], [100, 100], [0, 100]])
+    store.append("Bounding Box", "B", [[10, 10], [50, 50]])
+    index = spatial_index.MarkingSpatialIndex(store)
+    assert index.hit_test(20, 20) == 1
+    assert index.hit_test(80, 80) == 0
+    store.set_visibility(1, False)
+    assert index.hit_test(20, 20) == 0
+    assert index.hit_test(20, 20, visible_only=False) == 1
+    assert index.hit_test(500, 500) is None
@@ -0,0 +1,36 @@
+import numpy as np
+from PIL import Image
+
+# Custom modules
+import thumbnail_cache
+
+
+def write_images(folder, rng, count):
+    paths = []
+    for i in range(count):
+        path = folder / f"image_{i:03d}.png"
+        Image.fromarray(rng.integers(0, 255, (120, 200, 3)).astype(np.uint8)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_generate_and_reuse(tmp_path, rng):
+    image_dirs = write_images(tmp_path, rng, 5)
+    bad_dir = tmp_path / "bad.png"
+    bad_dir.write_bytes(b"not an image")
+    cache = thumbnail_cache.ThumbnailCache(str(tmp_path / "cache"), max_size=32)
+    reported = []
+    failed = cache.generate(image_dirs + [str(bad_dir)], num_workers=2, progress=lambda percent, image_dir: reported.append(image_dir))
+    assert list(failed) == [str(bad_dir)]
+    assert sorted(reported) == image_dirs
+    assert cache.missing(image_dirs) == []
+    with Image.open(cache.cached_path(image_dirs[0])) as thumbnail:
+        assert max(thumbnail.size) == 32
+
+
+def test_generate_cancelled_leaves_the_rest(tmp_path, rng):
+    image_dirs = write_images(tmp_path, rng, 40)
+    cache = thumbnail_cache.ThumbnailCache(str(tmp_path / "cache"), max_size=32)
+    cache.generate(image_dirs, num_workers=1, is_cancelled=lambda: True)
+    # Cancelled after the first poll: at most the images submitted ahead were written
+    assert len(cache.missing(image_dirs)) >= len(image_dirs) - thumbnail_cache.IN_FLIGHT_PER_WORKER
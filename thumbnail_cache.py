@@ -0,0 +1,138 @@
+"""
+Persistent thumbnail cache for browsing folders of images (no Qt dependency).
+
+Thumbnails are small normalized PNG files in a per-user cache folder, named
+after a hash of the image path, size and modification time, so a modified
+image gets a new thumbnail and the cache is reused across sessions. Missing
+thumbnails are generated by a pool of worker processes (reduced-resolution
+decode, see image_io.load_thumbnail). When the folder grows past its size cap
+the least recently used thumbnails are deleted.
+"""
+
+import concurrent.futures
+import hashlib
+import multiprocessing
+import os
+import numpy as np
+from PIL import Image
+
+# Custom modules
+import image_io
+
+THUMBNAIL_SIZE = 256  # Longest side (pixels)
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+EVICTION_TARGET = 0.9  # Fraction of the cap kept after an eviction
+IN_FLIGHT_PER_WORKER = 2  # Images submitted ahead per worker process
+CANCEL_POLL_INTERVAL = 0.1  # Seconds between cancellation checks while the workers are busy
+
+
+def default_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "alphaseg", "thumbnails")
+
+
+def write_thumbnail(image_dir, thumbnail_dir, max_size=THUMBNAIL_SIZE):
+    # Runs in a worker process
+    # Output: (image_dir, error message or None)
+    try:
+        thumbnail = image_io.load_thumbnail(image_dir, max_size)
+        temp_dir = f"{thumbnail_dir}.{os.getpid()}.tmp"
+        Image.fromarray(thumbnail).save(temp_dir, format="PNG")
+        os.replace(temp_dir, thumbnail_dir)
+        return image_dir, None
+    except Exception as error:
+        return image_dir, f"{type(error).__name__}: {error}"
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_CACHE_BYTES, max_size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def thumbnail_path(self, image_dir):
+        # Output: path of the thumbnail of the current version of the image
+        stat = os.stat(image_dir)
+        key = f"{os.path.abspath(image_dir)}|{stat.st_size}|{stat.st_mtime_ns}|{self.max_size}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+    def cached_path(self, image_dir):
+        # Output: thumbnail path if it exists (marked as recently used), None otherwise
+        thumbnail_dir = self.thumbnail_path(image_dir)
+        if not os.path.exists(thumbnail_dir):
+            return None
+        try:
+            os.utime(thumbnail_dir)
+        except OSError:
+            pass  # Read-only cache, eviction order is approximate
+        return thumbnail_dir
+
+    def get(self, image_dir):
+        # Output: numpy.ndarray(H, W, 3) of uint8, None if not generated yet
+        thumbnail_dir = self.cached_path(image_dir)
+        if thumbnail_dir is None:
+            return None
+        with Image.open(thumbnail_dir) as thumbnail:
+            return np.asarray(thumbnail.convert("RGB"))
+
+    def missing(self, image_dirs):
+        return [image_dir for image_dir in image_dirs if not os.path.exists(self.thumbnail_path(image_dir))]
+
+    def generate(self, image_dirs, num_workers=None, progress=None, is_cancelled=None):
+        # Generate the missing thumbnails in worker processes
+        # progress(percent, image path) is called as each thumbnail is written
+        # Output: {image path: error message} for the images that could not be read
+        todo = self.missing(image_dirs)
+        failed = {}
+        if len(todo) == 0:
+            return failed
+        num_workers = num_workers or max(1, min(len(todo), (os.cpu_count() or 2) - 1))
+        queued = iter(todo)
+        running = set()
+        done = 0
+        # Spawned processes do not inherit the Qt state of the GUI process
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            while True:
+                # Only a few images per worker are submitted at a time, so cancelling leaves little queued work
+                while len(running) < IN_FLIGHT_PER_WORKER * num_workers:
+                    image_dir = next(queued, None)
+                    if image_dir is None:
+                        break
+                    running.add(executor.submit(write_thumbnail, image_dir, self.thumbnail_path(image_dir), self.max_size))
+                if len(running) == 0:
+                    break
+                # The timeout bounds how long a cancellation waits for a slow image
+                finished, running = concurrent.futures.wait(running, timeout=CANCEL_POLL_INTERVAL, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    image_dir, error = future.result()
+                    done += 1
+                    if error is not None:
+                        failed[image_dir] = error
+                    elif progress is not None:
+                        progress(int(100 * done / len(todo)), image_dir)
+                if is_cancelled is not None and is_cancelled():
+                    for future in running:
+                        future.cancel()
+                    break
+        self.evict()
+        return failed
+
+    def evict(self):
+        # Delete the least recently used thumbnails once the folder is above its cap
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith(".png")]
+        stats = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries]
+        total = sum(size for _, size, _ in stats)
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for _, size, path in sorted(stats):
+            if total <= self.max_bytes * EVICTION_TARGET:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed